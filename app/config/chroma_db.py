@@ -1,56 +1,241 @@
 from pathlib import Path
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+import logging
 import os
-import chromadb
-from chromadb.config import Settings
-from chromadb.utils import embedding_functions
+import threading
+import time
+from app.config.db import mongo_client
+from app.config.embedding_model import DEFAULT_MODEL_NAME
+from app.services.quantization import DEFAULT_COMPRESSION
+from app.services.vector_store import delete_numpy_store, get_numpy_store
 
-# 初始化ChromaDB客户端 - 连接到Docker中的服务
-print("正在连接到ChromaDB...")
-chroma_client = chromadb.HttpClient(
-    host="localhost",
-    port=8000
-)
-print("ChromaDB连接已建立")
+logger = logging.getLogger(__name__)
 
-# 使用更准确的跨语言模型作为默认的嵌入函数
-print("正在初始化嵌入模型...")
-default_ef = embedding_functions.SentenceTransformerEmbeddingFunction(
-    model_name="paraphrase-multilingual-mpnet-base-v2"
-)
-print("嵌入模型初始化完成")
+# 向量库后端："chroma" 使用 ChromaDB 服务，"numpy" 使用进程内的本地向量库（仅适用于单进程部署）
+VECTOR_STORE_BACKEND = os.environ.get("VECTOR_STORE_BACKEND", "chroma").lower()
+if VECTOR_STORE_BACKEND not in ("chroma", "numpy"):
+    raise ValueError(f"不支持的向量库后端: {VECTOR_STORE_BACKEND}")
 
-def get_or_create_collection(collection_name="notes", embedding_function=None):
+# ChromaDB 服务地址；客户端在首次使用时才连接，服务不可用时不影响应用启动
+CHROMA_HOST = os.environ.get("CHROMA_HOST", "localhost")
+CHROMA_PORT = int(os.environ.get("CHROMA_PORT", "8000"))
+# 连接失败后至少间隔多少秒再重试，期间直接返回上次的错误，避免每个请求都等待连接超时
+CHROMA_RETRY_INTERVAL = float(os.environ.get("CHROMA_RETRY_INTERVAL", "5"))
+
+_chroma_client = None
+_chroma_error: Optional[Exception] = None
+_chroma_failed_at = 0.0
+_chroma_lock = threading.Lock()
+
+if VECTOR_STORE_BACKEND == "numpy":
+    logger.info("使用本地 NumPy 向量库")
+elif DEFAULT_COMPRESSION != "none":
+    # ChromaDB 后端始终传输并保存完整的 float32 向量
+    logger.warning(f"VECTOR_STORE_COMPRESSION={DEFAULT_COMPRESSION} 只对本地 NumPy 向量库生效，ChromaDB 后端将忽略该设置")
+
+def get_chroma_client():
+    """
+    获取 ChromaDB 客户端，首次调用时连接；连接失败时抛出异常，间隔 CHROMA_RETRY_INTERVAL 秒后的调用会重新连接
+    
+    Returns:
+        chromadb.HttpClient 实例
+    """
+    global _chroma_client, _chroma_error, _chroma_failed_at
+    if _chroma_client is not None:
+        return _chroma_client
+    with _chroma_lock:
+        if _chroma_client is not None:
+            return _chroma_client
+        if _chroma_error is not None and time.monotonic() - _chroma_failed_at < CHROMA_RETRY_INTERVAL:
+            raise ConnectionError(f"ChromaDB 不可用: {_chroma_error}")
+        # chromadb 导入较慢，放到首次连接时
+        import chromadb
+        
+        logger.info(f"正在连接到ChromaDB: {CHROMA_HOST}:{CHROMA_PORT}")
+        try:
+            _chroma_client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+        except Exception as e:
+            _chroma_error, _chroma_failed_at = e, time.monotonic()
+            logger.warning(f"连接 ChromaDB 失败，{CHROMA_RETRY_INTERVAL} 秒后可重试: {e}")
+            raise ConnectionError(f"ChromaDB 不可用: {e}") from e
+        _chroma_error = None
+        logger.info("ChromaDB连接已建立")
+        return _chroma_client
+
+def check_vector_store() -> None:
+    """检查向量库是否可用，不可用时抛出异常（用于就绪探针）"""
+    if VECTOR_STORE_BACKEND == "chroma":
+        get_chroma_client().heartbeat()
+
+# ChromaDB 集合的嵌入函数与语义搜索服务共享同一份模型权重，每个模型一个实例，首次使用时才创建
+_embedding_functions: Dict[str, Any] = {}
+
+def _shared_embedding_function(model_name: str):
+    ef = _embedding_functions.get(model_name)
+    if ef is None:
+        # 依赖 chromadb，只在使用 ChromaDB 后端时导入
+        from app.config.chroma_embedding import SharedEmbeddingFunction
+        ef = _embedding_functions.setdefault(model_name, SharedEmbeddingFunction(model_name))
+    return ef
+
+# --- 索引别名 ---
+# 搜索和写入使用的逻辑名称（别名）"notes" 指向一个带版本号的物理集合，
+# 重建索引时先写入新版本集合，完成后再原子地切换别名。别名记录保存在 MongoDB 中。
+DEFAULT_INDEX_ALIAS = "notes"
+ALIAS_CACHE_TTL = float(os.environ.get("INDEX_ALIAS_CACHE_TTL", "5"))
+
+index_meta_collection = mongo_client.notes.index_meta
+
+@dataclass(frozen=True)
+class IndexVersion:
+    """一个物理向量集合及生成其向量所用的嵌入模型"""
+    collection_name: str
+    model_name: str
+
+_alias_cache = {}
+_alias_cache_lock = threading.Lock()
+
+def _load_alias(alias: str) -> dict:
+    with _alias_cache_lock:
+        cached = _alias_cache.get(alias)
+        if cached is not None and time.monotonic() - cached[0] < ALIAS_CACHE_TTL:
+            return cached[1]
+    doc = index_meta_collection.find_one({"_id": f"alias:{alias}"}) or {}
+    with _alias_cache_lock:
+        _alias_cache[alias] = (time.monotonic(), doc)
+    return doc
+
+def _invalidate_alias_cache(alias: str) -> None:
+    with _alias_cache_lock:
+        _alias_cache.pop(alias, None)
+
+def get_active_index(alias: str = DEFAULT_INDEX_ALIAS) -> IndexVersion:
+    """
+    获取别名当前指向的索引版本（在 INDEX_ALIAS_CACHE_TTL 秒内使用进程内缓存）
+    
+    Args:
+        alias: 索引别名
+    
+    Returns:
+        当前提供搜索服务的 IndexVersion；尚未切换过时即为与别名同名的旧集合
     """
-    获取或创建一个ChromaDB集合
+    doc = _load_alias(alias)
+    active = doc.get("active")
+    if not active:
+        return IndexVersion(alias, DEFAULT_MODEL_NAME)
+    return IndexVersion(active["collection_name"], active["model_name"])
+
+def get_pending_index(alias: str = DEFAULT_INDEX_ALIAS) -> Optional[IndexVersion]:
+    """获取正在重建中的索引版本，没有重建任务时返回 None"""
+    pending = _load_alias(alias).get("pending")
+    if not pending:
+        return None
+    return IndexVersion(pending["collection_name"], pending["model_name"])
+
+def get_write_indexes(alias: str = DEFAULT_INDEX_ALIAS) -> List[IndexVersion]:
+    """获取写入时需要同步更新的所有索引版本（当前版本以及正在重建的版本）"""
+    indexes = [get_active_index(alias)]
+    pending = get_pending_index(alias)
+    if pending is not None and pending != indexes[0]:
+        indexes.append(pending)
+    return indexes
+
+def set_pending_index(version: Optional[IndexVersion], alias: str = DEFAULT_INDEX_ALIAS) -> None:
+    """登记（或在 version 为 None 时清除）正在重建的索引版本，重建期间的写入会同时写入该版本"""
+    pending = {"collection_name": version.collection_name, "model_name": version.model_name} if version else None
+    index_meta_collection.update_one({"_id": f"alias:{alias}"}, {"$set": {"pending": pending}}, upsert=True)
+    _invalidate_alias_cache(alias)
+
+def set_active_index(version: IndexVersion, alias: str = DEFAULT_INDEX_ALIAS) -> IndexVersion:
+    """
+    将别名原子地切换到新的索引版本，并清除重建中的版本
     
     Args:
-        collection_name: 集合名称
+        version: 新的索引版本
+        alias: 索引别名
+    
+    Returns:
+        切换前的索引版本
+    """
+    previous = get_active_index(alias)
+    index_meta_collection.update_one(
+        {"_id": f"alias:{alias}"},
+        {"$set": {
+            "active": {"collection_name": version.collection_name, "model_name": version.model_name},
+            "previous": {"collection_name": previous.collection_name, "model_name": previous.model_name},
+            "pending": None
+        }},
+        upsert=True
+    )
+    _invalidate_alias_cache(alias)
+    logger.info(f"索引别名 {alias} 已切换: {previous.collection_name} -> {version.collection_name}")
+    return previous
+
+# --- 索引别名结束 ---
+
+def get_or_create_collection(collection_name=DEFAULT_INDEX_ALIAS, embedding_function=None):
+    """
+    获取或创建一个向量集合
+    
+    Args:
+        collection_name: 集合名称；传入索引别名时解析为其当前指向的物理集合
         embedding_function: 嵌入函数，如果为None则使用默认嵌入函数
         
     Returns:
-        chromadb Collection 对象
+        向量集合（ChromaDB Collection 或本地 NumpyVectorStore）
+    """
+    if collection_name == DEFAULT_INDEX_ALIAS:
+        return get_index_collection(get_active_index(collection_name), embedding_function)
+    return _get_or_create_physical_collection(collection_name, embedding_function, DEFAULT_MODEL_NAME)
+
+def get_index_collection(version: IndexVersion, embedding_function=None):
     """
-    print(f"正在获取或创建集合: {collection_name}")
-    ef = embedding_function or default_ef
+    获取或创建指定索引版本对应的物理集合（不解析别名）
+    
+    Args:
+        version: 索引版本
+        embedding_function: 嵌入函数，如果为None则使用与该版本模型一致的共享嵌入函数
+        
+    Returns:
+        向量集合（ChromaDB Collection 或本地 NumpyVectorStore）
+    """
+    return _get_or_create_physical_collection(version.collection_name, embedding_function, version.model_name)
+
+def delete_index_collection(collection_name: str) -> None:
+    """删除一个物理向量集合"""
+    if VECTOR_STORE_BACKEND == "numpy":
+        delete_numpy_store(collection_name)
+    else:
+        get_chroma_client().delete_collection(collection_name)
+
+def _get_or_create_physical_collection(collection_name, ef, model_name):
+    # 本地向量库在搜索服务中直接以向量读写，不需要嵌入函数
+    if VECTOR_STORE_BACKEND == "numpy":
+        return get_numpy_store(collection_name)
+    ef = ef or _shared_embedding_function(model_name)
+    
+    logger.debug(f"正在获取或创建集合: {collection_name}")
+    client = get_chroma_client()
     
     # 尝试获取已存在的集合
     try:
         # 无法在获取时更改距离度量，只能在创建时指定
-        collection = chroma_client.get_collection(
+        collection = client.get_collection(
             name=collection_name,
             embedding_function=ef
         )
-        print(f"成功获取已存在的集合: {collection_name}")
+        logger.debug(f"成功获取已存在的集合: {collection_name}")
         # 可以在这里检查集合的元数据确认距离度量，但通常不直接修改
         # print(f"集合元数据: {collection.metadata}")
     except Exception as e:
-        print(f"获取集合失败，尝试创建新集合: {str(e)}")
+        logger.warning(f"获取集合失败，尝试创建新集合: {str(e)}")
         # 如果集合不存在，创建一个新的，并指定使用cosine距离
-        collection = chroma_client.create_collection(
+        collection = client.create_collection(
             name=collection_name,
             embedding_function=ef,
             metadata={"hnsw:space": "cosine"} # 指定距离度量为cosine
         )
-        print(f"成功创建新集合: {collection_name} (使用cosine距离)")
+        logger.info(f"成功创建新集合: {collection_name} (使用cosine距离)")
     
     return collection
\ No newline at end of file
@@ -0,0 +1,21 @@
+from typing import Optional
+
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+
+from app.config.embedding_model import DEFAULT_DEVICE, DEFAULT_MODEL_NAME, get_embedding_model
+from app.services.embedding_client import RemoteEmbeddingBatcher, get_embedding_client
+
+
+class SharedEmbeddingFunction(EmbeddingFunction):
+    """基于共享模型的 ChromaDB 嵌入函数，不会额外加载一份权重"""
+
+    def __init__(self, model_name: Optional[str] = None, device: Optional[str] = None):
+        self.model_name = model_name or DEFAULT_MODEL_NAME
+        self.device = device or DEFAULT_DEVICE
+
+    def __call__(self, input: Documents) -> Embeddings:
+        client = get_embedding_client()
+        if client is not None:
+            return RemoteEmbeddingBatcher(client, self.model_name).encode(list(input)).tolist()
+        model = get_embedding_model(self.model_name, self.device)
+        return model.encode(list(input)).tolist()
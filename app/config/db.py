@@ -1,8 +1,56 @@
 from pymongo.mongo_client import MongoClient
+from pymongo import ASCENDING
+from motor.motor_asyncio import AsyncIOMotorClient
+from app.services.metrics import MongoCommandMetrics
 import os
 
 # Get the MongoDB connection string from the environment variable
 URI = os.environ.get("MONGO_URI")
 
+# Both clients report per-command latency to the metrics registry
+_command_metrics = MongoCommandMetrics()
+
 # Create a new client and connect to the server
-mongo_client = MongoClient(URI)
+mongo_client = MongoClient(URI, event_listeners=[_command_metrics])
+
+# Async client used by the request handlers so that database calls do not block the event loop
+async_mongo_client = AsyncIOMotorClient(URI, event_listeners=[_command_metrics])
+
+
+# Deleted notes are remembered for this long so that delta sync clients can catch up
+TOMBSTONE_TTL_SECONDS = int(os.environ.get("TOMBSTONE_TTL_SECONDS", str(30 * 24 * 3600)))
+
+
+async def ensure_indexes():
+    """Create the indexes used by delta sync and the index outbox; safe to call on every startup."""
+    db = async_mongo_client.notes
+    await db.notes.create_index([("updated_at", ASCENDING)])
+    await db.index_outbox.create_index([("next_attempt_at", ASCENDING)])
+    await db.index_outbox.create_index([("owner", ASCENDING)])
+    await db.note_tombstones.create_index([("deleted_at", ASCENDING)], expireAfterSeconds=TOMBSTONE_TTL_SECONDS)
+
+
+_transactions_supported = None
+
+
+async def supports_transactions() -> bool:
+    """Multi-document transactions need a replica set or a sharded cluster; detected once per process."""
+    global _transactions_supported
+    if _transactions_supported is None:
+        try:
+            hello = await async_mongo_client.admin.command("hello")
+            _transactions_supported = bool(hello.get("setName") or hello.get("msg") == "isdbgrid")
+        except Exception:
+            _transactions_supported = False
+    return _transactions_supported
+
+
+async def run_in_transaction(callback):
+    """
+    Run `callback(session)` inside a transaction when the deployment supports one,
+    otherwise run it directly with `session=None`.
+    """
+    if not await supports_transactions():
+        return await callback(None)
+    async with await async_mongo_client.start_session() as session:
+        return await session.with_transaction(callback)
@@ -0,0 +1,142 @@
+import logging
+import os
+import platform
+import threading
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+logger = logging.getLogger(__name__)
+
+# 默认嵌入模型与设备，可通过环境变量覆盖
+DEFAULT_MODEL_NAME = os.environ.get("EMBEDDING_MODEL", "paraphrase-multilingual-mpnet-base-v2")
+DEFAULT_DEVICE = os.environ.get("EMBEDDING_DEVICE") or None
+
+# 推理后端："torch"（PyTorch）、"onnx"（ONNX Runtime）或 "onnx-int8"（动态量化为 int8 的 ONNX 模型）
+# ONNX 后端需要 pip install "sentence-transformers[onnx]"
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+DEFAULT_BACKEND = os.environ.get("EMBEDDING_BACKEND", "torch").lower()
+if DEFAULT_BACKEND not in EMBEDDING_BACKENDS:
+    raise ValueError(f"不支持的嵌入推理后端: {DEFAULT_BACKEND}")
+# 导出的 ONNX 模型缓存目录，每个模型一个子目录
+ONNX_CACHE_DIR = os.environ.get("EMBEDDING_ONNX_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "lmnotes", "onnx")
+# int8 量化针对的指令集（arm64、avx2、avx512、avx512_vnni），不指定时按当前 CPU 自动选择
+ONNX_QUANTIZATION = os.environ.get("EMBEDDING_ONNX_QUANTIZATION") or None
+
+# 每个进程内按 (模型名, 设备, 后端) 只保留一份模型权重
+# sentence_transformers（以及 PyTorch）在首次加载模型时才导入，使用共享嵌入服务的 API 进程不会导入它们
+_models: Dict[Tuple[str, Optional[str], str], "SentenceTransformer"] = {}
+_models_lock = threading.Lock()
+_export_lock = threading.Lock()
+
+
+def detect_quantization_config() -> str:
+    """按当前 CPU 支持的指令集选择 int8 量化配置"""
+    if ONNX_QUANTIZATION:
+        return ONNX_QUANTIZATION
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "arm64"
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = set(next((line for line in f if line.startswith("flags")), "").split())
+    except OSError:
+        flags = set()
+    if "avx512_vnni" in flags:
+        return "avx512_vnni"
+    if "avx512f" in flags:
+        return "avx512"
+    return "avx2"
+
+
+def onnx_model_dir(model_name: str) -> str:
+    """返回模型导出的 ONNX 文件所在目录"""
+    return os.path.join(ONNX_CACHE_DIR, model_name.replace("/", "__"))
+
+
+def _onnx_file_name(model_dir: str, backend: str, quantization: str) -> Optional[str]:
+    # 返回模型目录下对应后端的 ONNX 文件（相对路径），尚未导出时返回 None
+    if backend == "onnx-int8":
+        candidates = [f"onnx/model_qint8_{quantization}.onnx"]
+    else:
+        candidates = ["onnx/model.onnx", "model.onnx"]
+    return next((name for name in candidates if os.path.exists(os.path.join(model_dir, name))), None)
+
+
+def export_onnx_model(model_name: Optional[str] = None, backend: str = "onnx",
+                      quantization: Optional[str] = None) -> Tuple[str, str]:
+    """
+    将模型导出为 ONNX（以及可选的 int8 动态量化版本）并缓存到 ONNX_CACHE_DIR，已导出时直接返回
+
+    Args:
+        model_name: 模型名称，为 None 时使用默认模型
+        backend: "onnx" 或 "onnx-int8"
+        quantization: int8 量化配置，为 None 时按当前 CPU 自动选择
+
+    Returns:
+        (模型目录, 目录下的 ONNX 文件名)
+    """
+    if backend not in ("onnx", "onnx-int8"):
+        raise ValueError(f"只有 ONNX 后端需要导出: {backend}")
+    model_name = model_name or DEFAULT_MODEL_NAME
+    quantization = quantization or detect_quantization_config()
+    from sentence_transformers import SentenceTransformer
+
+    model_dir = onnx_model_dir(model_name)
+    with _export_lock:
+        file_name = _onnx_file_name(model_dir, backend, quantization)
+        if file_name is not None:
+            return model_dir, file_name
+        if _onnx_file_name(model_dir, "onnx", quantization) is None:
+            logger.info(f"正在将嵌入模型导出为 ONNX: {model_name} -> {model_dir}")
+            SentenceTransformer(model_name, device="cpu", backend="onnx").save_pretrained(model_dir)
+        if backend == "onnx-int8":
+            from sentence_transformers import export_dynamic_quantized_onnx_model
+
+            logger.info(f"正在对 ONNX 模型做 int8 动态量化 ({quantization}): {model_dir}")
+            base_file = _onnx_file_name(model_dir, "onnx", quantization)
+            base = SentenceTransformer(model_dir, device="cpu", backend="onnx", model_kwargs={"file_name": base_file})
+            export_dynamic_quantized_onnx_model(base, quantization, model_dir, file_suffix=f"qint8_{quantization}")
+        file_name = _onnx_file_name(model_dir, backend, quantization)
+        if file_name is None:
+            raise RuntimeError(f"导出 ONNX 模型后未找到模型文件: {model_dir}")
+        return model_dir, file_name
+
+
+def _load_model(model_name: str, device: Optional[str], backend: str) -> "SentenceTransformer":
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "torch":
+        return SentenceTransformer(model_name, device=device)
+    model_dir = onnx_model_dir(model_name)
+    if _onnx_file_name(model_dir, backend, detect_quantization_config()) is None:
+        logger.warning(f"未找到已导出的 {backend} 模型，首次加载时导出（建议预先运行 python -m app.services.embedding_export）")
+    model_dir, file_name = export_onnx_model(model_name, backend)
+    return SentenceTransformer(model_dir, device=device, backend="onnx", model_kwargs={"file_name": file_name})
+
+
+def get_embedding_model(model_name: Optional[str] = None, device: Optional[str] = None,
+                        backend: Optional[str] = None) -> "SentenceTransformer":
+    """
+    获取共享的 SentenceTransformer 模型，首次使用时才加载
+
+    Args:
+        model_name: 模型名称，为 None 时使用默认模型
+        device: 运行设备（如 "cpu"、"cuda"），为 None 时使用默认设备
+        backend: 推理后端，为 None 时使用 EMBEDDING_BACKEND
+
+    Returns:
+        SentenceTransformer 模型实例
+    """
+    key = (model_name or DEFAULT_MODEL_NAME, device or DEFAULT_DEVICE, backend or DEFAULT_BACKEND)
+    model = _models.get(key)
+    if model is not None:
+        return model
+    with _models_lock:
+        model = _models.get(key)
+        if model is None:
+            logger.info(f"正在加载嵌入模型: {key[0]} (device={key[1] or 'auto'}, backend={key[2]})")
+            model = _load_model(*key)
+            _models[key] = model
+            logger.info(f"嵌入模型加载完成: {key[0]}")
+    return model
@@ -0,0 +1,86 @@
+import json
+import logging
+import os
+import random
+import sys
+from datetime import datetime, timezone
+
+# 日志参数，可通过环境变量调整
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# 输出格式："text"（便于阅读）或 "json"（每行一个 JSON 对象，便于日志系统采集）
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text").lower()
+# DEBUG 级别日志的采样率（0~1）。热路径上的逐请求日志使用 DEBUG 级别，
+# 开启 DEBUG 时只记录其中一部分；INFO 及以上级别不采样
+LOG_DEBUG_SAMPLE_RATE = float(os.environ.get("LOG_DEBUG_SAMPLE_RATE", "0.1"))
+
+# LogRecord 的内置属性，其余属性视为通过 extra 传入的结构化字段
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def _fields(record: logging.LogRecord) -> dict:
+    return {key: value for key, value in vars(record).items() if key not in _RESERVED_ATTRS}
+
+
+class DebugSamplingFilter(logging.Filter):
+    """按采样率丢弃 DEBUG 日志，WARNING 等更高级别始终保留"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+        return random.random() < self.rate
+
+
+class TextFormatter(logging.Formatter):
+    """文本格式，结构化字段以 key=value 形式附加在消息之后"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = _fields(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行 JSON，结构化字段作为顶层键"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **_fields(record),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(level: str = LOG_LEVEL, format: str = LOG_FORMAT,
+                  debug_sample_rate: float = LOG_DEBUG_SAMPLE_RATE) -> None:
+    """
+    配置应用（app.*、main 以及 python -m 运行的入口模块）的日志输出，重复调用时只生效一次
+
+    Args:
+        level: 日志级别
+        format: 输出格式，"text" 或 "json"
+        debug_sample_rate: DEBUG 日志的采样率
+    """
+    handler = logging.StreamHandler(sys.stderr)
+    if format == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(TextFormatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    handler.addFilter(DebugSamplingFilter(debug_sample_rate))
+    for name in ("app", "main", "__main__"):
+        logger = logging.getLogger(name)
+        if logger.handlers:
+            continue
+        logger.setLevel(level)
+        logger.addHandler(handler)
+        logger.propagate = False
@@ -1,79 +1,390 @@
-from fastapi import APIRouter, HTTPException, status, Body, Query, Depends, Path
-from typing import List, Optional, Dict, Any
+from fastapi import APIRouter, HTTPException, status, Body, Query, Depends, Path, Request, Response
+from fastapi.responses import StreamingResponse
+from typing import List, Optional, Dict, Any, Tuple, AsyncIterator, Iterable
+from datetime import datetime, timedelta, timezone
 from bson import ObjectId
-from ..config.db import mongo_client
-from ..schema.schemas import noteEntity, notesEntity
-from ..services.semantic_search import add_to_search_index, remove_from_search_index, search_notes, debug_search
+from pymongo.errors import BulkWriteError
+from ..config.db import async_mongo_client, run_in_transaction
+from ..schema.schemas import noteEntity, projectedNoteEntity
+from ..services.semantic_search import search_notes, search_notes_batch, debug_search, embed_query, check_index_recall
+from ..services.index_outbox import OP_DELETE, OP_INSERT, OP_UPSERT, enqueue_index_task, enqueue_index_tasks, wait_for_index as wait_for_index_task, get_outbox_stats
+from ..services.reconciler import reconcile_once, get_reconcile_status
+from ..services.executor import run_blocking
+from ..services.knn_graph import get_related_notes
+from ..services.answer_cache import SemanticAnswerCache, compute_sources_fingerprint
+from ..services.context_builder import build_context
+from ..services.reindex import start_reindex, get_reindex_status
+from ..services.metrics import STAGE_DURATION, STAGE_ERRORS, register_cache, track_stage
+from ..services.llm_gateway import get_llm_gateway
 from app.models.qa import QAResponse, QASource
 import os
-import httpx
-from openai import OpenAI
-from pydantic import BaseModel
+import base64
+import json
+import logging
+import time
+import hashlib
+from pydantic import BaseModel, Field
+
+logger = logging.getLogger(__name__)
 
 # 初始化路由器
 router = APIRouter()
 
 # 数据库与集合
-db = mongo_client.notes
+db = async_mongo_client.notes
 notes_collection = db.notes
+# 已删除笔记的墓碑记录，供增量同步返回删除事件
+tombstones_collection = db.note_tombstones
+# 笔记集合的修订号，每次写入后递增，用于生成列表的 ETag
+notes_meta_collection = db.notes_meta
+
+# 语义答案缓存：相近问题且来源笔记未变化时直接复用答案
+answer_cache = SemanticAnswerCache()
+register_cache("answer", answer_cache.stats)
+
+# --- 写入记录 ---
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+async def _bump_revision() -> None:
+    """笔记集合发生写入后递增修订号，使已缓存的列表 ETag 失效"""
+    await notes_meta_collection.update_one({"_id": "revision"}, {"$inc": {"value": 1}}, upsert=True)
+
+async def _current_revision() -> int:
+    doc = await notes_meta_collection.find_one({"_id": "revision"})
+    return doc["value"] if doc else 0
 
-# --- OpenAI 客户端配置 ---
-
-# 1. 配置第三方 API 信息
-third_party_base_url = "https://api.deepseek.com/v1"  # DeepSeek API 地址
-# 直接硬编码 API Key (注意安全风险)
-third_party_api_key = "sk-08e9ecfa11b24864a2bc86031dcfec8f" 
-print("警告：API Key 已硬编码在代码中！这存在安全风险，仅建议用于本地测试或非共享项目。")
-
-# 2. 配置代理 (如果需要)
-proxy_url = os.environ.get("HTTPS_PROXY") 
-
-# 3. 初始化 OpenAI 客户端 
-http_client_instance = None 
-if proxy_url:
-    print(f"检测到代理，正在配置 httpx 客户端使用代理: {proxy_url}")
-    proxies = {"http://": proxy_url, "https://": proxy_url}
-    http_client_instance = httpx.Client(proxies=proxies)
-    print("代理配置完成")
-else:
-    print("未检测到代理")
-
-print(f"正在配置 OpenAI 客户端指向第三方 API: {third_party_base_url}")
-openai_client = OpenAI( 
-    base_url=third_party_base_url,
-    api_key=third_party_api_key, # 使用硬编码的 key
-    http_client=http_client_instance 
-)
-print("OpenAI 客户端配置完成 (使用第三方 API)")
-# --- OpenAI 客户端配置结束 ---
+# --- 写入记录结束 ---
+
+# 索引任务在后台完成，请求 wait_for_index 时通过此响应头告知索引是否已经完成
+INDEX_STATUS_HEADER = "X-Index-Status"
+
+async def _wait_for_index(response: Response, note_id: str, version) -> None:
+    indexed = await wait_for_index_task(note_id, version)
+    response.headers[INDEX_STATUS_HEADER] = "indexed" if indexed else "pending"
 
 # 路由定义
 @router.post("/", status_code=status.HTTP_201_CREATED)
-async def create_note(note: Dict[str, Any] = Body(...)):
-    """创建新笔记"""
-    # 处理并保存到MongoDB
-    result = notes_collection.insert_one(note)
-    note_id = str(result.inserted_id)
+async def create_note(
+    response: Response,
+    note: Dict[str, Any] = Body(...),
+    wait_for_index: bool = Query(False, description="是否等待笔记被索引后再返回（读己之写）"),
+):
+    """
+    创建新笔记
     
-    # 添加到语义搜索索引
-    try:
-        add_to_search_index(
-            id=note_id,
-            title=note.get("title", ""),
-            description=note.get("description", "")
-        )
-    except Exception as e:
-        # 如果添加到索引失败，记录错误，但不阻止笔记创建
-        print(f"Error adding to search index: {e}")
+    笔记与索引任务在同一事务中写入 MongoDB（部署不支持事务时依次写入），
+    由后台工作协程生成嵌入并写入向量索引。
+    """
+    note["updated_at"] = _utcnow()
+
+    async def write(session):
+        result = await notes_collection.insert_one(note, session=session)
+        version = await enqueue_index_task(str(result.inserted_id), OP_INSERT, session=session)
+        return result.inserted_id, version
+
+    inserted_id, version = await run_in_transaction(write)
+    await _bump_revision()
+    if wait_for_index:
+        await _wait_for_index(response, str(inserted_id), version)
     
     # 获取并返回新创建的笔记
-    created_note = notes_collection.find_one({"_id": result.inserted_id})
+    created_note = await notes_collection.find_one({"_id": inserted_id})
     return noteEntity(created_note)
 
-@router.get("/", response_model=List[Dict[str, Any]])
-async def get_notes():
-    """获取所有笔记"""
-    return notesEntity(notes_collection.find())
+# 批量导入时每批写入 MongoDB 和向量索引的笔记数量
+BULK_BATCH_SIZE = int(os.environ.get("BULK_BATCH_SIZE", "500"))
+
+async def _iter_bulk_items(request: Request) -> AsyncIterator[Tuple[Any, Optional[str]]]:
+    """
+    逐条读取批量导入的请求体，返回 (笔记, 错误信息)
+    
+    Content-Type 为 application/x-ndjson 时按行流式解析，否则按 JSON 数组解析。
+    """
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    try:
+                        yield json.loads(line), None
+                    except ValueError as e:
+                        yield None, f"无效的 JSON: {e}"
+        if buffer.strip():
+            try:
+                yield json.loads(buffer), None
+            except ValueError as e:
+                yield None, f"无效的 JSON: {e}"
+        return
+
+    try:
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="请求体不是有效的 JSON")
+    if not isinstance(body, list):
+        raise HTTPException(status_code=400, detail="请求体必须是笔记数组")
+    for item in body:
+        yield item, None
+
+async def _import_batch(batch: List[Tuple[int, Dict[str, Any]]], ids: List[Optional[str]], errors: List[Dict[str, Any]]) -> None:
+    """将一批笔记写入 MongoDB 并记录索引任务，逐条记录结果"""
+    docs = [doc for _, doc in batch]
+    updated_at = _utcnow()
+    for doc in docs:
+        doc["updated_at"] = updated_at
+    failed: Dict[int, str] = {}
+    try:
+        await notes_collection.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        failed = {err["index"]: err.get("errmsg", "写入失败") for err in e.details.get("writeErrors", [])}
+    except Exception as e:
+        failed = {position: str(e) for position in range(len(batch))}
+
+    inserted = []
+    for position, (index, doc) in enumerate(batch):
+        if position in failed:
+            errors.append({"index": index, "error": failed[position]})
+        else:
+            ids[index] = str(doc["_id"])
+            inserted.append(str(doc["_id"]))
+    if inserted:
+        await _bump_revision()
+        # 后台工作协程会把同一批新笔记合并为一次批量嵌入和批量写入
+        await enqueue_index_tasks(inserted, OP_INSERT)
+
+@router.post("/bulk/", status_code=status.HTTP_201_CREATED)
+async def bulk_create_notes(request: Request):
+    """
+    批量导入笔记
+    
+    请求体可以是笔记的 JSON 数组，也可以是 NDJSON（每行一条笔记，Content-Type: application/x-ndjson）。
+    笔记按批写入 MongoDB，并记录索引任务由后台批量生成嵌入、批量写入向量索引；
+    单条笔记出错不会中断整个导入。
+    """
+    ids: List[Optional[str]] = []
+    errors: List[Dict[str, Any]] = []
+    batch: List[Tuple[int, Dict[str, Any]]] = []
+
+    async for item, error in _iter_bulk_items(request):
+        index = len(ids)
+        ids.append(None)
+        if error is None and not isinstance(item, dict):
+            error = "每条笔记必须是 JSON 对象"
+        if error is not None:
+            errors.append({"index": index, "error": error})
+            continue
+        batch.append((index, item))
+        if len(batch) >= BULK_BATCH_SIZE:
+            await _import_batch(batch, ids, errors)
+            batch = []
+    if batch:
+        await _import_batch(batch, ids, errors)
+
+    errors.sort(key=lambda e: e["index"])
+    inserted_count = sum(1 for id in ids if id is not None)
+    logger.info(f"批量导入完成，共 {len(ids)} 条，成功写入 {inserted_count} 条，错误 {len(errors)} 条")
+    return {
+        "total": len(ids),
+        "inserted": inserted_count,
+        "ids": ids,
+        "errors": errors
+    }
+
+# --- 笔记列表与增量同步 ---
+
+# 未指定 fields 时返回的字段（与原先的列表格式一致）
+DEFAULT_LIST_FIELDS = ("title", "description")
+# 分页列表单页的最大数量
+MAX_LIST_LIMIT = 1000
+# 返回给客户端的同步游标会向前回退这么多秒，避免与查询同时提交的写入被遗漏；
+# 重叠部分返回的笔记由客户端按 id 合并去重
+SYNC_CURSOR_OVERLAP_SECONDS = float(os.environ.get("SYNC_CURSOR_OVERLAP_SECONDS", "5"))
+
+def _parse_fields(fields: Optional[str]) -> List[str]:
+    """解析逗号分隔的字段列表；id 总是返回，无需指定"""
+    if fields is None:
+        return list(DEFAULT_LIST_FIELDS)
+    parsed = []
+    for field in fields.split(","):
+        field = field.strip()
+        if not field or field in ("id", "_id") or field in parsed:
+            continue
+        if field.startswith("$"):
+            raise HTTPException(status_code=400, detail=f"无效的字段名: {field}")
+        parsed.append(field)
+    return parsed
+
+def _parse_since(since: str) -> datetime:
+    """解析 ISO 8601 时间（Python 3.10 的 fromisoformat 不支持 Z 后缀），无时区时按 UTC 处理"""
+    try:
+        parsed = datetime.fromisoformat(since[:-1] + "+00:00" if since.endswith(("Z", "z")) else since)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="since 必须是 ISO 8601 格式的时间")
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def _sync_cursor(started_at: datetime) -> str:
+    return (started_at - timedelta(seconds=SYNC_CURSOR_OVERLAP_SECONDS)).isoformat()
+
+# 增量同步分页游标的前缀；普通的同步游标是 ISO 8601 时间
+_CONTINUATION_PREFIX = "page:"
+
+def _encode_continuation(state: Dict[str, Any]) -> str:
+    return _CONTINUATION_PREFIX + base64.urlsafe_b64encode(json.dumps(state).encode("utf-8")).decode("ascii")
+
+def _parse_changes_cursor(since: str) -> Dict[str, Any]:
+    """
+    解析 /changes/ 的 since 参数
+    
+    返回 started_at（第一页的开始时间，全部读完后据此生成下一次的同步游标）以及
+    notes/deleted 两类变化各自的读取位置 [时间, 上一条的 id]；id 为 None 时从该时间（含）开始读取。
+    """
+    if not since.startswith(_CONTINUATION_PREFIX):
+        since_time = _parse_since(since)
+        return {"started_at": None, "notes": [since_time, None], "deleted": [since_time, None]}
+    try:
+        state = json.loads(base64.urlsafe_b64decode(since[len(_CONTINUATION_PREFIX):].encode("ascii")))
+        parsed = {"started_at": _parse_since(state["started_at"])}
+        for kind in ("notes", "deleted"):
+            position_time, position_id = state[kind]
+            if kind == "notes" and position_id is not None and not ObjectId.is_valid(position_id):
+                raise ValueError(position_id)
+            parsed[kind] = [_parse_since(position_time),
+                            ObjectId(position_id) if kind == "notes" and position_id is not None else position_id]
+        return parsed
+    except HTTPException:
+        raise
+    except Exception:
+        raise HTTPException(status_code=400, detail="无效的同步游标")
+
+async def _read_changes(collection, field: str, position: List[Any], projection: Dict[str, int],
+                        limit: int) -> Tuple[List[Dict[str, Any]], bool]:
+    """按 (field, _id) 顺序从 position 之后读取至多 limit 条，同时返回是否还有更多"""
+    position_time, position_id = position
+    if position_id is None:
+        query: Dict[str, Any] = {field: {"$gte": position_time}}
+    else:
+        query = {"$or": [{field: {"$gt": position_time}}, {field: position_time, "_id": {"$gt": position_id}}]}
+    # 多取一条用于判断是否还有下一页
+    docs = await collection.find(query, {**projection, field: 1}).sort([(field, 1), ("_id", 1)]).limit(limit + 1).to_list(length=limit + 1)
+    return docs[:limit], len(docs) > limit
+
+def _position_after(docs: List[Dict[str, Any]], field: str, has_more: bool, restart_at: datetime) -> List[Any]:
+    # 还有更多时从本页最后一条之后继续；已读完时下一页从 restart_at 起重新读取，覆盖期间的新变化
+    if not has_more:
+        return [(restart_at - timedelta(seconds=SYNC_CURSOR_OVERLAP_SECONDS)).isoformat(), None]
+    last = docs[-1]
+    last_time = last[field] if last[field].tzinfo else last[field].replace(tzinfo=timezone.utc)
+    return [last_time.isoformat(), str(last["_id"])]
+
+async def _stream_json_array(items: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[bytes]:
+    """将笔记逐条编码为 JSON 数组，避免在内存中拼出整个响应"""
+    yield b"["
+    first = True
+    async for item in items:
+        yield (b"" if first else b",") + json.dumps(item, ensure_ascii=False).encode("utf-8")
+        first = False
+    yield b"]"
+
+async def _iter_entities(docs: Iterable[Dict[str, Any]], fields: List[str]) -> AsyncIterator[Dict[str, Any]]:
+    for doc in docs:
+        yield projectedNoteEntity(doc, fields)
+
+async def _iter_cursor_entities(cursor, fields: List[str]) -> AsyncIterator[Dict[str, Any]]:
+    async for doc in cursor:
+        yield projectedNoteEntity(doc, fields)
+
+@router.get("/")
+async def get_notes(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_LIST_LIMIT, description="每页数量，不指定时返回全部笔记"),
+    after: Optional[str] = Query(None, description="分页游标：上一页响应头 X-Next-Cursor 的值"),
+    fields: Optional[str] = Query(None, description="逗号分隔的返回字段，例如 title；id 总是返回"),
+):
+    """
+    获取笔记列表（按 _id 升序，即按创建时间排序）
+    
+    结果以 JSON 数组流式返回。指定 limit 时按 _id 游标分页，还有下一页时
+    响应头 X-Next-Cursor 给出下一页的 after 参数。响应头 X-Sync-Cursor 可作为
+    /changes/ 的 since 参数获取之后的变化；ETag 在笔记没有变化时保持不变，
+    客户端带 If-None-Match 请求时返回 304。
+    """
+    projection = _parse_fields(fields)
+    query: Dict[str, Any] = {}
+    if after is not None:
+        if not ObjectId.is_valid(after):
+            raise HTTPException(status_code=400, detail="无效的分页游标")
+        query["_id"] = {"$gt": ObjectId(after)}
+
+    started_at = _utcnow()
+    params = json.dumps([limit, after, projection])
+    etag = f'W/"{await _current_revision()}-{hashlib.sha1(params.encode("utf-8")).hexdigest()[:16]}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "X-Sync-Cursor": _sync_cursor(started_at)}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    cursor = notes_collection.find(query, {field: 1 for field in projection} or {"_id": 1}).sort("_id", 1)
+    if limit is None:
+        return StreamingResponse(
+            _stream_json_array(_iter_cursor_entities(cursor, projection)),
+            media_type="application/json",
+            headers=headers
+        )
+
+    # 多取一条用于判断是否还有下一页
+    docs = await cursor.limit(limit + 1).to_list(length=limit + 1)
+    if len(docs) > limit:
+        docs = docs[:limit]
+        headers["X-Next-Cursor"] = str(docs[-1]["_id"])
+    return StreamingResponse(
+        _stream_json_array(_iter_entities(docs, projection)),
+        media_type="application/json",
+        headers=headers
+    )
+
+@router.get("/changes/")
+async def get_note_changes(
+    since: str = Query(..., description="同步游标：上次响应中的 cursor 或列表响应头 X-Sync-Cursor"),
+    fields: Optional[str] = Query(None, description="逗号分隔的返回字段，id 总是返回"),
+    limit: int = Query(MAX_LIST_LIMIT, ge=1, le=MAX_LIST_LIMIT, description="每页最多返回的修改笔记数和删除笔记数"),
+):
+    """
+    获取指定时间之后新增、修改和删除的笔记
+    
+    返回 notes（新增或修改的笔记）、deleted（已删除笔记的 id）、cursor（下次请求的 since）
+    和 has_more。变化较多时按 limit 分页：has_more 为 true 时立即用 cursor 请求下一页，
+    直到 has_more 为 false，此时的 cursor 用于下一次同步。游标会与之前的结果略有重叠，
+    客户端应按 id 合并。
+    """
+    cursor_state = _parse_changes_cursor(since)
+    projection = _parse_fields(fields)
+    started_at = _utcnow()
+    # 分页过程中提交的变化由第一页的开始时间覆盖
+    sync_started_at = cursor_state["started_at"] or started_at
+
+    changed, more_notes = await _read_changes(
+        notes_collection, "updated_at", cursor_state["notes"], {field: 1 for field in projection} or {"_id": 1}, limit)
+    deleted, more_deleted = await _read_changes(tombstones_collection, "deleted_at", cursor_state["deleted"], {}, limit)
+
+    if more_notes or more_deleted:
+        cursor = _encode_continuation({
+            "started_at": sync_started_at.isoformat(),
+            "notes": _position_after(changed, "updated_at", more_notes, sync_started_at),
+            "deleted": _position_after(deleted, "deleted_at", more_deleted, sync_started_at),
+        })
+    else:
+        cursor = _sync_cursor(sync_started_at)
+    return {
+        "notes": [projectedNoteEntity(doc, projection) for doc in changed],
+        "deleted": [doc["_id"] for doc in deleted],
+        "cursor": cursor,
+        "has_more": more_notes or more_deleted,
+    }
+
+# --- 笔记列表与增量同步结束 ---
 
 @router.get("/{id}")
 async def get_note(id: str):
@@ -81,56 +392,94 @@ async def get_note(id: str):
     if not ObjectId.is_valid(id):
         raise HTTPException(status_code=400, detail="无效的ID格式")
         
-    note = notes_collection.find_one({"_id": ObjectId(id)})
+    note = await notes_collection.find_one({"_id": ObjectId(id)})
     if note:
         return noteEntity(note)
     raise HTTPException(status_code=404, detail="笔记未找到")
 
+# 相关笔记一次最多返回的数量
+MAX_RELATED_LIMIT = 100
+
+@router.get("/{id}/related", response_model=List[Dict[str, Any]])
+async def get_related(
+    id: str,
+    limit: int = Query(10, ge=1, le=MAX_RELATED_LIMIT, description="最大结果数量"),
+    threshold: float = Query(0.0, description="相似度阈值"),
+):
+    """
+    获取与指定笔记相似的笔记
+    
+    直接使用笔记已存储的向量查询近邻，结果缓存在近邻图中并随索引任务增量更新，不调用嵌入模型。
+    """
+    if not ObjectId.is_valid(id):
+        raise HTTPException(status_code=400, detail="无效的ID格式")
+    if await notes_collection.count_documents({"_id": ObjectId(id)}, limit=1) == 0:
+        raise HTTPException(status_code=404, detail="笔记未找到")
+    results = await run_blocking(get_related_notes, id, limit=limit, threshold=threshold)
+    if results is None:
+        raise HTTPException(status_code=404, detail="笔记尚未被索引，请稍后重试")
+    return results
+
 @router.put("/{id}")
-async def update_note(id: str, note: Dict[str, Any] = Body(...)):
+async def update_note(
+    id: str,
+    response: Response,
+    note: Dict[str, Any] = Body(...),
+    wait_for_index: bool = Query(False, description="是否等待笔记被索引后再返回（读己之写）"),
+):
     """更新笔记"""
     if not ObjectId.is_valid(id):
         raise HTTPException(status_code=400, detail="无效的ID格式")
     
-    # 更新MongoDB中的笔记
-    notes_collection.update_one({"_id": ObjectId(id)}, {"$set": note})
+    # 更新MongoDB中的笔记，并在同一事务中记录索引任务（标题和描述未变化时索引更新会被跳过）
+    async def write(session):
+        result = await notes_collection.update_one({"_id": ObjectId(id)}, {"$set": {**note, "updated_at": _utcnow()}}, session=session)
+        if result.matched_count == 0:
+            return None
+        return await enqueue_index_task(id, OP_UPSERT, session=session)
+
+    version = await run_in_transaction(write)
+    if version is None:
+        raise HTTPException(status_code=404, detail="笔记未找到")
+    await _bump_revision()
     
-    # 更新语义搜索索引
-    try:
-        add_to_search_index(
-            id=id,
-            title=note.get("title", ""),
-            description=note.get("description", "")
-        )
-    except Exception as e:
-        print(f"Error updating search index: {e}")
+    # 引用了该笔记的缓存答案已过期
+    answer_cache.invalidate_note(id)
+    if wait_for_index:
+        await _wait_for_index(response, id, version)
     
-    # 获取并返回更新后的笔记
-    updated_note = notes_collection.find_one({"_id": ObjectId(id)})
-    if updated_note:
-        return noteEntity(updated_note)
-    raise HTTPException(status_code=404, detail="笔记未找到")
+    # 获取更新后的笔记
+    updated_note = await notes_collection.find_one({"_id": ObjectId(id)})
+    if not updated_note:
+        raise HTTPException(status_code=404, detail="笔记未找到")
+    return noteEntity(updated_note)
 
 @router.delete("/{note_id}", status_code=204)
-async def delete_note(note_id: str):
-    """删除笔记并同步删除向量索引"""
-    # 先从主数据库删除
+async def delete_note(
+    note_id: str,
+    wait_for_index: bool = Query(False, description="是否等待笔记从索引中删除后再返回"),
+):
+    """删除笔记，并记录从向量索引中删除的任务"""
     if not ObjectId.is_valid(note_id):
         raise HTTPException(status_code=400, detail="无效的ID格式")
-    delete_result = notes_collection.delete_one({"_id": ObjectId(note_id)})
-    
-    if delete_result.deleted_count == 1:
-        # 如果主数据库删除成功，再尝试从搜索索引中删除
-        try:
-            remove_from_search_index(note_id)
-        except Exception as e:
-            # 记录从索引删除失败的错误，但仍然认为主删除成功
-            print(f"主数据库删除成功，但从搜索索引删除笔记时出错: {str(e)}")
-        # 即使索引删除失败，也返回成功 (状态码 204)
-        return
-    else:
+
+    async def write(session):
+        delete_result = await notes_collection.delete_one({"_id": ObjectId(note_id)}, session=session)
+        if delete_result.deleted_count != 1:
+            return None
+        # 记录墓碑，增量同步的客户端据此移除该笔记
+        await tombstones_collection.update_one({"_id": note_id}, {"$set": {"deleted_at": _utcnow()}}, upsert=True, session=session)
+        return await enqueue_index_task(note_id, OP_DELETE, session=session)
+
+    version = await run_in_transaction(write)
+    if version is None:
         # 如果主数据库中没有找到笔记，则返回 404
         raise HTTPException(status_code=404, detail="Note not found")
+    await _bump_revision()
+    answer_cache.invalidate_note(note_id)
+    if wait_for_index:
+        indexed = await wait_for_index_task(note_id, version)
+        return Response(status_code=204, headers={INDEX_STATUS_HEADER: "indexed" if indexed else "pending"})
 
 @router.get("/search/", response_model=List[Dict[str, Any]])
 async def search(
@@ -139,72 +488,154 @@ async def search(
     threshold: float = Query(0.3, description="相似度阈值"),
 ):
     """语义搜索笔记"""
-    results = search_notes(
+    results = await run_blocking(
+        search_notes,
         query=q,
         limit=limit,
         threshold=threshold
     )
     return results
 
+# 一次批量搜索最多包含的查询数量
+SEARCH_BATCH_MAX_QUERIES = int(os.environ.get("SEARCH_BATCH_MAX_QUERIES", "64"))
+
+class BatchSearchQuery(BaseModel):
+    q: str
+    limit: int = Field(5, ge=1, description="最大结果数量")
+    threshold: float = Field(0.3, description="相似度阈值")
+
+class BatchSearchRequest(BaseModel):
+    queries: List[BatchSearchQuery]
+
+@router.post("/search/batch/", response_model=List[List[Dict[str, Any]]])
+async def search_batch(request: BatchSearchRequest):
+    """
+    批量语义搜索笔记
+    
+    所有查询一次编码、一次向量检索，按请求顺序返回每个查询的结果列表。
+    """
+    if len(request.queries) > SEARCH_BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"一次最多搜索 {SEARCH_BATCH_MAX_QUERIES} 个查询")
+    results = await run_blocking(
+        search_notes_batch,
+        [{"query": item.q, "limit": item.limit, "threshold": item.threshold} for item in request.queries]
+    )
+    return results
+
 @router.get("/search/debug/", response_model=Dict[str, Any])
 async def search_debug(
     q: str = Query(..., description="搜索查询"),
     limit: int = Query(20, description="最大结果数量"),
 ):
     """用于调试的语义搜索笔记"""
-    results = debug_search(
+    results = await run_blocking(
+        debug_search,
         query=q,
         limit=limit
     )
     return results
 
+@router.get("/search/recall/", response_model=Dict[str, Any])
+async def search_recall(
+    samples: int = Query(100, ge=1, le=1000, description="抽样的查询数量"),
+    k: int = Query(10, ge=1, le=100, description="top-k"),
+):
+    """检查压缩向量检索相对精确检索的召回率（仅本地 NumPy 向量库支持）"""
+    result = await run_blocking(check_index_recall, samples=samples, k=k)
+    if result is None:
+        raise HTTPException(status_code=400, detail="当前向量库后端不支持召回率检查")
+    return result
+
+@router.get("/index/outbox/")
+async def index_outbox_status():
+    """查询后台索引任务的积压情况"""
+    return await get_outbox_stats()
+
+@router.post("/index/reconcile/")
+async def reconcile_index():
+    """立即执行一轮 MongoDB 与向量索引的一致性检查，差异写入索引发件箱修复"""
+    stats = await reconcile_once()
+    if stats is None:
+        raise HTTPException(status_code=409, detail="一致性检查正在进行中")
+    return stats
+
+@router.get("/index/reconcile/")
+async def reconcile_index_status():
+    """查询上一轮一致性检查的结果和巡检进度"""
+    return await get_reconcile_status() or {}
+
+# --- 重建索引 ---
+
+class ReindexRequest(BaseModel):
+    model_name: Optional[str] = None
+
+@router.post("/reindex/", status_code=status.HTTP_202_ACCEPTED)
+async def reindex(request: Optional[ReindexRequest] = Body(None)):
+    """
+    在后台重建向量索引（可同时切换嵌入模型）
+    
+    新索引写入带版本号的新集合，重建期间搜索仍由当前集合提供；
+    完成后别名原子地切换到新集合。任务带检查点，进程重启后会从检查点继续。
+    """
+    await start_reindex(model_name=request.model_name if request else None)
+    return await get_reindex_status()
+
+@router.get("/reindex/status/")
+async def reindex_status():
+    """查询重建索引任务的进度"""
+    job = await get_reindex_status()
+    if job is None:
+        raise HTTPException(status_code=404, detail="没有重建索引任务")
+    return job
+
+# --- 重建索引结束 ---
+
 # --- 新增 RAG 功能 ---
 
 # 定义接收问题的请求体模型
 class QAQuery(BaseModel):
     question: str
 
-@router.post("/ask/", response_model=QAResponse)
-async def ask_question(query: QAQuery):
+SYSTEM_PROMPT = "你是一个友好且实用的笔记助手。你的目标是帮助用户管理和理解他们的笔记内容。保持对话自然、回答简洁有用，就像一个熟悉用户笔记的朋友。避免过度学术化或冗长的分析，而是专注于提供用户真正需要的信息。"
+NO_SOURCES_ANSWER = "抱歉，在您的笔记中找不到与您问题相关的信息。"
+
+# 检索候选数量：上下文受 token 预算限制，取太多候选只会浪费检索和传输
+RAG_SEARCH_LIMIT = int(os.environ.get("RAG_SEARCH_LIMIT", "20"))
+
+async def retrieve_sources(user_question: str) -> Tuple[List[float], str, List[QASource]]:
     """
-    接收用户问题，检索相关笔记，并使用 LLM 基于笔记内容生成答案。
+    检索与问题相关的笔记，并在 token 预算内构建上下文
+    
+    Returns:
+        (问题嵌入, 上下文字符串, 实际放入上下文的来源笔记)
     """
-    user_question = query.question
-    print(f"收到问题: {user_question}")
-
-    # 1. 检索相关笔记
-    search_limit = 100  # 设置一个较大的值，实际上不限制检索结果数量
+    search_limit = RAG_SEARCH_LIMIT
     search_threshold = 0.2
     try:
-        print(f"正在搜索相关笔记 (limit={search_limit}, threshold={search_threshold})...")
-        source_results_raw = search_notes(
-            query=user_question, 
-            limit=search_limit, 
-            threshold=search_threshold
-        )
-        sources = [QASource(**item) for item in source_results_raw]  # 转换为模型
-        print(f"找到 {len(sources)} 条相关笔记")
+        with track_stage("query_embedding"):
+            question_embedding = await run_blocking(embed_query, user_question)
+        with track_stage("retrieve"):
+            source_results_raw = await run_blocking(
+                search_notes,
+                query=user_question, 
+                limit=search_limit, 
+                threshold=search_threshold,
+                query_embedding=question_embedding,
+                include_embeddings=True
+            )
     except Exception as e:
-        print(f"搜索笔记时发生错误: {e}")
+        logger.error(f"搜索笔记时发生错误: {e}")
         raise HTTPException(status_code=500, detail="检索相关笔记时出错")
 
-    # 2. 处理检索结果和构建上下文
-    if not sources:
-        return QAResponse(
-            answer="抱歉，在您的笔记中找不到与您问题相关的信息。",
-            sources=[]
-        )
-
-    context_string = "\n\n".join([
-        f"笔记ID: {s.id}\n标题: {s.metadata.get('title', 'N/A')}\n描述: {s.metadata.get('description', 'N/A')}" 
-        for s in sources
-    ])
-    max_context_length = 3000
-    if len(context_string) > max_context_length:
-        context_string = context_string[:max_context_length] + "..."
-        print("上下文过长，已截断")
+    # 按相似度贪心打包并去除近重复笔记，只返回真正用到的来源
+    with track_stage("context_build"):
+        context_string, used_results = build_context(source_results_raw)
+    sources = [QASource(**item) for item in used_results]  # 转换为模型
+    logger.debug("相关笔记检索完成", extra={"candidates": len(source_results_raw), "sources": len(sources)})
+    return question_embedding, context_string, sources
 
-    # 3. 构建 Prompt
+def build_messages(user_question: str, context_string: str) -> List[Dict[str, str]]:
+    """根据构建好的上下文生成发送给 LLM 的消息列表"""
     prompt = f'''
 请根据以下提供的上下文信息来回答用户的问题。
 
@@ -219,24 +650,48 @@ async def ask_question(query: QAQuery):
 
 回答：
 '''
-    print("构建的 Prompt (为保护隐私，通常不打印完整上下文):")
-    print(f"用户问题: {user_question}")
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+@router.post("/ask/", response_model=QAResponse)
+async def ask_question(query: QAQuery):
+    """
+    接收用户问题，检索相关笔记，并使用 LLM 基于笔记内容生成答案。
+    """
+    user_question = query.question
+
+    # 1. 检索相关笔记
+    question_embedding, context_string, sources = await retrieve_sources(user_question)
+
+    # 2. 处理检索结果
+    if not sources:
+        return QAResponse(
+            answer=NO_SOURCES_ANSWER,
+            sources=[]
+        )
+
+    # 相近问题且来源笔记未变化时直接返回缓存的答案
+    fingerprint = compute_sources_fingerprint(s.model_dump() for s in sources)
+    cached_answer = answer_cache.lookup(question_embedding, fingerprint)
+    if cached_answer is not None:
+        logger.debug("命中语义答案缓存，跳过 LLM 调用")
+        return QAResponse(answer=cached_answer, sources=sources)
+
+    # 3. 构建 Prompt
+    messages = build_messages(user_question, context_string)
 
     # 4. 调用 LLM 生成答案
     try:
-        print("正在调用 LLM API (无 max_tokens 限制)... 使用模型 deepseek-chat")
-        completion = openai_client.chat.completions.create(
-            model="deepseek-chat",
-            messages=[
-                {"role": "system", "content": "你是一个友好且实用的笔记助手。你的目标是帮助用户管理和理解他们的笔记内容。保持对话自然、回答简洁有用，就像一个熟悉用户笔记的朋友。避免过度学术化或冗长的分析，而是专注于提供用户真正需要的信息。"},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7 
-        )
-        generated_answer = completion.choices[0].message.content.strip()
-        print(f"LLM 返回答案: {generated_answer}")
+        # LLM 网关：连接池、并发上限、截止时间、重试与相同请求合并
+        llm_gateway = get_llm_gateway()
+        with track_stage("llm"):
+            generated_answer = await llm_gateway.complete(messages, temperature=0.7)
+        logger.debug("LLM 返回答案", extra={"model": llm_gateway.model, "answer_length": len(generated_answer)})
+        answer_cache.store(question_embedding, fingerprint, [s.id for s in sources], generated_answer)
     except Exception as e:
-        print(f"调用 LLM API 时发生错误: {e}")
+        logger.error(f"调用 LLM API 时发生错误: {e}")
         generated_answer = f"抱歉，在调用 AI 模型生成答案时遇到错误: {str(e)}"
 
     # 5. 返回最终响应
@@ -245,4 +700,62 @@ async def ask_question(query: QAQuery):
         sources=sources 
     )
 
+def _ndjson_event(event_type: str, **payload: Any) -> bytes:
+    """将一个流式事件编码为一行 NDJSON"""
+    return (json.dumps({"type": event_type, **payload}, ensure_ascii=False) + "\n").encode("utf-8")
+
+@router.post("/ask/stream/")
+async def ask_question_stream(query: QAQuery, request: Request):
+    """
+    流式版本的问答接口，以 NDJSON 逐行返回事件：
+    先返回 sources（检索到的来源笔记），再逐段返回 token，最后返回 done。
+    客户端断开连接时会停止生成。
+    """
+    user_question = query.question
+
+    # 检索在开始响应之前完成，这样检索失败时仍能返回正常的 HTTP 错误码
+    question_embedding, context_string, sources = await retrieve_sources(user_question)
+    fingerprint = compute_sources_fingerprint(s.model_dump() for s in sources)
+
+    async def event_stream():
+        yield _ndjson_event("sources", sources=[s.model_dump() for s in sources])
+        if not sources:
+            yield _ndjson_event("token", content=NO_SOURCES_ANSWER)
+            yield _ndjson_event("done")
+            return
+
+        cached_answer = answer_cache.lookup(question_embedding, fingerprint)
+        if cached_answer is not None:
+            logger.debug("命中语义答案缓存，跳过 LLM 调用")
+            yield _ndjson_event("token", content=cached_answer)
+            yield _ndjson_event("done")
+            return
+
+        stream = get_llm_gateway().stream(build_messages(user_question, context_string), temperature=0.7)
+        started = time.perf_counter()
+        try:
+            answer_parts = []
+            async for content in stream:
+                if await request.is_disconnected():
+                    logger.info("客户端已断开连接，停止生成答案")
+                    return
+                if not answer_parts:
+                    # 首个 token 的延迟（用户感知的等待时间）
+                    STAGE_DURATION.observe(time.perf_counter() - started, stage="llm_first_token")
+                answer_parts.append(content)
+                yield _ndjson_event("token", content=content)
+            STAGE_DURATION.observe(time.perf_counter() - started, stage="llm_stream")
+            # 只缓存完整生成的答案
+            answer_cache.store(question_embedding, fingerprint, [s.id for s in sources], "".join(answer_parts).strip())
+            yield _ndjson_event("done")
+        except Exception as e:
+            STAGE_ERRORS.inc(stage="llm_stream")
+            logger.error(f"流式调用 LLM API 时发生错误: {e}")
+            yield _ndjson_event("error", message=f"抱歉，在调用 AI 模型生成答案时遇到错误: {str(e)}")
+        finally:
+            # 关闭上游连接，客户端断开或生成被取消时不再继续消耗 token
+            await stream.aclose()
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
 # --- RAG 功能结束 --- 
\ No newline at end of file
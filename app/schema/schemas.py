@@ -1,3 +1,6 @@
+from datetime import timezone
+
+
 def noteEntity(item) -> dict:
     return {
         "id": str(item["_id"]),
@@ -6,4 +9,14 @@ def noteEntity(item) -> dict:
     }
 
 def notesEntity(entity) -> list:
-    return [noteEntity(item) for item in entity]
\ No newline at end of file
+    return [noteEntity(item) for item in entity]
+
+def projectedNoteEntity(item, fields) -> dict:
+    entity = {"id": str(item["_id"])}
+    for field in fields:
+        value = item.get(field)
+        # datetime 字段统一输出为带时区的 ISO 8601 字符串（MongoDB 中保存的是 UTC 时间）
+        if hasattr(value, "isoformat"):
+            value = (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).isoformat()
+        entity[field] = value
+    return entity
@@ -0,0 +1,188 @@
+import hashlib
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+import numpy as np
+
+# 语义答案缓存参数，可通过环境变量调整
+DEFAULT_MAX_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", "512"))
+DEFAULT_TTL_SECONDS = float(os.environ.get("ANSWER_CACHE_TTL", "86400"))
+DEFAULT_SIMILARITY_THRESHOLD = float(os.environ.get("ANSWER_CACHE_SIMILARITY", "0.95"))
+
+
+def compute_sources_fingerprint(sources: Iterable[Dict[str, Any]]) -> str:
+    """
+    计算一组来源笔记的指纹，来源的 ID 或内容任一变化都会导致指纹变化
+
+    Args:
+        sources: 来源笔记列表，每项包含 id 和 metadata（title、description）
+
+    Returns:
+        来源集合的 SHA-256 十六进制摘要
+    """
+    digest = hashlib.sha256()
+    for source in sorted(sources, key=lambda s: s["id"]):
+        metadata = source.get("metadata") or {}
+        digest.update(source["id"].encode("utf-8"))
+        digest.update(b"\x00")
+        digest.update(f"{metadata.get('title', '')} {metadata.get('description', '')}".encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+@dataclass
+class _CachedAnswer:
+    embedding: np.ndarray
+    fingerprint: str
+    note_ids: Set[str]
+    answer: str
+    created_at: float = field(default_factory=time.monotonic)
+
+
+class SemanticAnswerCache:
+    """
+    RAG 答案的语义缓存
+
+    以问题嵌入和来源指纹为键：只有来源指纹完全一致、且问题嵌入的余弦相似度
+    不低于 similarity_threshold 时才视为命中。任一被引用笔记发生变化时，
+    可通过 invalidate_note() 使相关条目失效。
+    """
+
+    def __init__(
+        self,
+        max_size: int = DEFAULT_MAX_SIZE,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        similarity_threshold: float = DEFAULT_SIMILARITY_THRESHOLD,
+    ):
+        """
+        Args:
+            max_size: 最多缓存的答案数量，为 0 时禁用缓存
+            ttl_seconds: 条目有效期（秒），小于等于 0 表示永不过期
+            similarity_threshold: 问题嵌入之间的最小余弦相似度
+        """
+        self.max_size = max(max_size, 0)
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[int, _CachedAnswer]" = OrderedDict()
+        self._by_fingerprint: Dict[str, Set[int]] = {}
+        self._by_note: Dict[str, Set[int]] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _expired(self, entry: _CachedAnswer) -> bool:
+        return self.ttl_seconds > 0 and time.monotonic() - entry.created_at > self.ttl_seconds
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        same_fingerprint = self._by_fingerprint.get(entry.fingerprint)
+        if same_fingerprint is not None:
+            same_fingerprint.discard(entry_id)
+            if not same_fingerprint:
+                del self._by_fingerprint[entry.fingerprint]
+        for note_id in entry.note_ids:
+            citing = self._by_note.get(note_id)
+            if citing is not None:
+                citing.discard(entry_id)
+                if not citing:
+                    del self._by_note[note_id]
+
+    def lookup(self, question_embedding: List[float], fingerprint: str) -> Optional[str]:
+        """
+        查找语义相近且来源一致的缓存答案
+
+        Args:
+            question_embedding: 问题的嵌入向量
+            fingerprint: 本次检索到的来源指纹
+
+        Returns:
+            命中时返回缓存的答案，否则返回 None
+        """
+        query = self._normalize(question_embedding)
+        with self._lock:
+            best_id, best_similarity = None, self.similarity_threshold
+            for entry_id in list(self._by_fingerprint.get(fingerprint, ())):
+                entry = self._entries[entry_id]
+                if self._expired(entry):
+                    self._remove(entry_id)
+                    continue
+                similarity = float(np.dot(query, entry.embedding))
+                if similarity >= best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+            if best_id is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            return self._entries[best_id].answer
+
+    def store(self, question_embedding: List[float], fingerprint: str, note_ids: Iterable[str], answer: str) -> None:
+        """
+        缓存一条答案
+
+        Args:
+            question_embedding: 问题的嵌入向量
+            fingerprint: 生成答案时使用的来源指纹
+            note_ids: 答案引用的笔记 ID
+            answer: 生成的答案
+        """
+        if self.max_size == 0:
+            return
+        entry = _CachedAnswer(self._normalize(question_embedding), fingerprint, set(note_ids), answer)
+        with self._lock:
+            entry_id = next(self._ids)
+            self._entries[entry_id] = entry
+            self._by_fingerprint.setdefault(fingerprint, set()).add(entry_id)
+            for note_id in entry.note_ids:
+                self._by_note.setdefault(note_id, set()).add(entry_id)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_note(self, note_id: str) -> int:
+        """
+        使引用了指定笔记的所有缓存答案失效
+
+        Args:
+            note_id: 发生变化的笔记 ID
+
+        Returns:
+            被移除的条目数量
+        """
+        with self._lock:
+            entry_ids = list(self._by_note.get(note_id, ()))
+            for entry_id in entry_ids:
+                self._remove(entry_id)
+            return len(entry_ids)
+
+    def clear(self) -> None:
+        """清空缓存（计数器保留）"""
+        with self._lock:
+            self._entries.clear()
+            self._by_fingerprint.clear()
+            self._by_note.clear()
+
+    def stats(self) -> Dict[str, float]:
+        """返回命中/未命中次数、命中率和当前条目数"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+            }
@@ -0,0 +1,126 @@
+import os
+import re
+from typing import List
+
+from app.services.tokens import CJK_CHARS, estimate_tokens
+
+# 嵌入模型的最大输入长度（token），超出部分会被静默截断；
+# paraphrase-multilingual-mpnet-base-v2 为 128，其中 2 个为起止特殊 token
+EMBEDDING_MAX_TOKENS = int(os.environ.get("EMBEDDING_MAX_TOKENS", "128"))
+# 分块参数（按估算的 token 数计），可通过环境变量调整
+DEFAULT_CHUNK_SIZE = int(os.environ.get("CHUNK_MAX_TOKENS", "96"))
+DEFAULT_CHUNK_OVERLAP = int(os.environ.get("CHUNK_OVERLAP_TOKENS", "24"))
+# 标题过长时每个块至少保留的 token 数
+MIN_CHUNK_SIZE = 32
+
+# 嵌入模型的分词器把非 CJK 文本切得更细，按每 3 个字符 1 个 token 估算以留出余量
+_CHARS_PER_TOKEN = 3
+
+# 在段落和句末标点之后切分，保留标点本身；英文句号只在其后为空白时视为句末（不切分 3.14、v2.1）
+_SENTENCE_RE = re.compile(r"(?:[^。！？!?；;\n.]|\.(?!\s))*(?:[。！？!?；;]+|\.(?=\s)|\n+|$)")
+# 超长句子退回按词切分：CJK 字符逐字，其余按空白分隔的单词（连同其后的空白）
+_WORD_RE = re.compile(f"[{CJK_CHARS}]|[^\\s{CJK_CHARS}]+\\s*|\\s+")
+
+
+def estimate_embedding_tokens(text: str) -> int:
+    """估算文本经嵌入模型分词后的 token 数（偏保守）"""
+    return estimate_tokens(text, _CHARS_PER_TOKEN)
+
+
+def chunk_size_for_title(title: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """返回嵌入文本为 "标题 块内容" 时块内容可用的 token 数，保证整体不超过模型的最大输入长度"""
+    available = EMBEDDING_MAX_TOKENS - 2 - estimate_embedding_tokens(f"{title} ")
+    return max(min(chunk_size, available), MIN_CHUNK_SIZE)
+
+
+def _split_sentences(text: str) -> List[str]:
+    sentences: List[str] = []
+    for sentence in _SENTENCE_RE.findall(text):
+        if not sentence:
+            continue
+        # 单独的换行归入前一个句子，保留段落分隔
+        if not sentence.strip() and sentences:
+            sentences[-1] += sentence
+        elif sentence.strip():
+            sentences.append(sentence)
+    return sentences
+
+
+def _split_long(sentence: str, chunk_size: int, overlap: int) -> List[str]:
+    # 按词打包为不超过 chunk_size 的片段，相邻片段重叠不超过 overlap；单个超长的词按字符截断
+    words: List[str] = []
+    for word in _WORD_RE.findall(sentence):
+        if estimate_embedding_tokens(word) > chunk_size:
+            step = chunk_size * _CHARS_PER_TOKEN
+            words.extend(word[i:i + step] for i in range(0, len(word), step))
+        else:
+            words.append(word)
+    pieces: List[str] = []
+    current: List[str] = []
+    current_len = 0
+    for word in words:
+        length = estimate_embedding_tokens(word)
+        if current and current_len + length > chunk_size:
+            pieces.append("".join(current))
+            carried: List[str] = []
+            carried_len = 0
+            for previous in reversed(current):
+                previous_len = estimate_embedding_tokens(previous)
+                if carried_len + previous_len > overlap or carried_len + previous_len + length > chunk_size:
+                    break
+                carried.insert(0, previous)
+                carried_len += previous_len
+            current, current_len = carried, carried_len
+        current.append(word)
+        current_len += length
+    if current:
+        pieces.append("".join(current))
+    return pieces
+
+
+def split_into_chunks(text: str, chunk_size: int = DEFAULT_CHUNK_SIZE, overlap: int = DEFAULT_CHUNK_OVERLAP) -> List[str]:
+    """
+    将长文本切分为相互重叠的块
+
+    先按段落和句子切分，再把相邻句子合并到估算不超过 chunk_size 个 token 的块中；
+    每个块以上一个块末尾不超过 overlap 个 token 的完整句子开头。由于块边界落在
+    句子边界上，局部编辑通常只会改变附近的少数几个块。
+
+    Args:
+        text: 要切分的文本
+        chunk_size: 每个块的最大 token 数（估算）
+        overlap: 相邻块之间重叠的最大 token 数（估算）
+
+    Returns:
+        文本块列表；空文本返回空列表
+    """
+    overlap = min(overlap, chunk_size // 2)
+    sentences: List[str] = []
+    for sentence in _split_sentences(text):
+        if estimate_embedding_tokens(sentence) > chunk_size:
+            sentences.extend(_split_long(sentence, chunk_size, overlap))
+        else:
+            sentences.append(sentence)
+
+    chunks: List[str] = []
+    current: List[str] = []
+    current_len = 0
+    for sentence in sentences:
+        length = estimate_embedding_tokens(sentence)
+        if current and current_len + length > chunk_size:
+            chunks.append("".join(current).strip())
+            # 以上一个块末尾的若干完整句子作为重叠部分
+            carried: List[str] = []
+            carried_len = 0
+            for previous in reversed(current):
+                previous_len = estimate_embedding_tokens(previous)
+                if carried_len + previous_len > overlap or carried_len + previous_len + length > chunk_size:
+                    break
+                carried.insert(0, previous)
+                carried_len += previous_len
+            current, current_len = carried, carried_len
+        current.append(sentence)
+        current_len += length
+    if current:
+        chunks.append("".join(current).strip())
+    return chunks
@@ -0,0 +1,99 @@
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.tokens import estimate_tokens
+
+# 上下文构建参数，可通过环境变量调整
+DEFAULT_TOKEN_BUDGET = int(os.environ.get("RAG_CONTEXT_TOKENS", "1500"))
+DEFAULT_DEDUP_SIMILARITY = float(os.environ.get("RAG_DEDUP_SIMILARITY", "0.95"))
+
+# 截断时优先在这些位置断开，避免把句子切成两半
+_SENTENCE_END_RE = re.compile(r"[。！？!?；;\n]|\.\s")
+
+
+def format_source(source: Dict[str, Any], description: Optional[str] = None) -> str:
+    """将一条来源笔记格式化为上下文片段"""
+    metadata = source.get("metadata") or {}
+    if description is None:
+        description = metadata.get("description", "N/A")
+    return f"笔记ID: {source['id']}\n标题: {metadata.get('title', 'N/A')}\n描述: {description}"
+
+
+def _truncate_to_budget(source: Dict[str, Any], budget: int) -> Optional[str]:
+    """在 token 预算内截断来源笔记的描述，尽量在句子边界处断开"""
+    description = (source.get("metadata") or {}).get("description", "")
+    # 按字符数二分查找能放进预算的最长前缀
+    low, high = 0, len(description)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(format_source(source, description[:mid] + "...")) <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    if low == 0:
+        return None
+    prefix = description[:low]
+    boundaries = [m.end() for m in _SENTENCE_END_RE.finditer(prefix)]
+    # 句子边界太靠前时宁可在字符处截断，也不要丢掉大部分内容
+    if boundaries and boundaries[-1] >= low // 2:
+        prefix = prefix[:boundaries[-1]].rstrip()
+    return format_source(source, prefix + "...")
+
+
+def build_context(
+    sources: List[Dict[str, Any]],
+    token_budget: int = DEFAULT_TOKEN_BUDGET,
+    dedup_similarity: float = DEFAULT_DEDUP_SIMILARITY,
+) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    在 token 预算内按相似度贪心地打包来源笔记
+
+    完整笔记放不下时跳过并尝试下一条；只有第一条笔记就超出预算时才截断它。
+    带有 embedding 字段的来源会与已选来源比较，余弦相似度不低于
+    dedup_similarity 的近重复笔记会被丢弃。
+
+    Args:
+        sources: 检索结果，每项包含 id、metadata、similarity，可选 embedding
+        token_budget: 上下文的 token 预算
+        dedup_similarity: 判定为近重复的余弦相似度阈值
+
+    Returns:
+        (上下文字符串, 实际使用的来源列表)
+    """
+    separator_tokens = estimate_tokens("\n\n")
+    remaining = token_budget
+    blocks: List[str] = []
+    used: List[Dict[str, Any]] = []
+    used_vectors: List[np.ndarray] = []
+
+    for source in sorted(sources, key=lambda s: s.get("similarity", 0.0), reverse=True):
+        vector = None
+        if source.get("embedding") is not None:
+            vector = np.asarray(source["embedding"], dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            vector = vector / norm if norm > 0 else None
+        if vector is not None and used_vectors:
+            if float(np.max(np.stack(used_vectors) @ vector)) >= dedup_similarity:
+                continue
+
+        cost = separator_tokens if blocks else 0
+        block = format_source(source)
+        if estimate_tokens(block) + cost > remaining:
+            if blocks:
+                continue
+            block = _truncate_to_budget(source, remaining)
+            if block is None:
+                continue
+
+        blocks.append(block)
+        used.append(source)
+        if vector is not None:
+            used_vectors.append(vector)
+        remaining -= estimate_tokens(block) + cost
+        if remaining <= separator_tokens:
+            break
+
+    return "\n\n".join(blocks), used
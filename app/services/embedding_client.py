@@ -0,0 +1,278 @@
+import itertools
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 设置后所有嵌入请求发送给共享的嵌入服务进程（python -m app.services.embedding_server），
+# 本进程不加载模型；未设置时在进程内推理
+EMBEDDING_SERVER_SOCKET = os.environ.get("EMBEDDING_SERVER_SOCKET") or None
+EMBEDDING_SERVER_TIMEOUT = float(os.environ.get("EMBEDDING_SERVER_TIMEOUT", "30"))
+# 单个请求等待响应的最长秒数，超时后请求以 TimeoutError 失败，避免服务卡住时调用线程永久阻塞
+EMBEDDING_SERVER_REQUEST_TIMEOUT = float(os.environ.get("EMBEDDING_SERVER_REQUEST_TIMEOUT", "120"))
+
+# --- 协议 ---
+# 每个帧以 4 字节小端长度开头，后跟负载。一个连接上可以有多个未完成的请求，响应按 request_id 匹配。
+# 请求负载：request_id(u32) 模型名长度(u16) 文本数(u32) 模型名 [文本长度(u32) 文本(UTF-8)]...
+# 响应负载：request_id(u32) 状态(u8) 3 字节填充 行数(u32) 维度(u32)，之后是行数 x 维度个小端 float32；
+# 状态非 0 时之后是 UTF-8 错误信息。16 字节的头部保证向量数据按 4 字节对齐，可以直接在接收缓冲区上构造数组。
+FRAME_HEADER = struct.Struct("<I")
+REQUEST_HEADER = struct.Struct("<IHI")
+TEXT_HEADER = struct.Struct("<I")
+RESPONSE_HEADER = struct.Struct("<IB3xII")
+STATUS_OK = 0
+STATUS_ERROR = 1
+MAX_FRAME_BYTES = 256 * 1024 * 1024
+
+
+def recv_exactly(sock: socket.socket, size: int) -> bytearray:
+    """读取恰好 size 个字节，连接关闭时抛出 ConnectionError"""
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            raise ConnectionError("嵌入服务连接已关闭")
+        received += n
+    return buffer
+
+
+def recv_frame(sock: socket.socket) -> bytearray:
+    """读取一个帧的负载"""
+    (size,) = FRAME_HEADER.unpack(recv_exactly(sock, FRAME_HEADER.size))
+    if size > MAX_FRAME_BYTES:
+        raise ConnectionError(f"帧过大: {size} 字节")
+    return recv_exactly(sock, size)
+
+
+def encode_request(request_id: int, model_name: str, texts: Sequence[str]) -> bytes:
+    model = model_name.encode("utf-8")
+    parts = [REQUEST_HEADER.pack(request_id, len(model), len(texts)), model]
+    for text in texts:
+        data = text.encode("utf-8")
+        parts.append(TEXT_HEADER.pack(len(data)))
+        parts.append(data)
+    payload = b"".join(parts)
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def decode_request(payload: bytearray) -> Tuple[int, str, List[str]]:
+    """解析请求，帧内容不完整或不是合法的 UTF-8 时抛出 ValueError"""
+    try:
+        request_id, model_length, count = REQUEST_HEADER.unpack_from(payload, 0)
+        offset = REQUEST_HEADER.size
+        model_name = bytes(payload[offset:offset + model_length]).decode("utf-8")
+        offset += model_length
+        texts = []
+        for _ in range(count):
+            (length,) = TEXT_HEADER.unpack_from(payload, offset)
+            offset += TEXT_HEADER.size
+            if offset + length > len(payload):
+                raise ValueError("文本长度超出帧范围")
+            texts.append(bytes(payload[offset:offset + length]).decode("utf-8"))
+            offset += length
+    except (struct.error, UnicodeDecodeError) as e:
+        raise ValueError(str(e)) from e
+    if offset != len(payload):
+        raise ValueError(f"帧末尾有 {len(payload) - offset} 字节多余数据")
+    return request_id, model_name, texts
+
+
+def decode_response(payload: bytearray) -> Tuple[int, Optional[np.ndarray], Optional[str]]:
+    """解析响应，向量直接引用接收缓冲区（不复制）"""
+    request_id, status, rows, dim = RESPONSE_HEADER.unpack_from(payload, 0)
+    if status != STATUS_OK:
+        return request_id, None, bytes(payload[RESPONSE_HEADER.size:]).decode("utf-8", "replace")
+    vectors = np.frombuffer(payload, dtype="<f4", count=rows * dim, offset=RESPONSE_HEADER.size).reshape(rows, dim)
+    return request_id, vectors, None
+
+
+# --- 协议结束 ---
+
+
+class EmbeddingClient:
+    """
+    嵌入服务的客户端，线程安全
+
+    每个进程保持一个 Unix socket 连接，多个请求可以同时在途，由后台线程读取响应并
+    完成对应的 Future。连接断开时所有在途请求失败，下一次请求时自动重连；超过
+    request_timeout 仍未收到响应的请求由看门狗线程以 TimeoutError 结束。
+    """
+
+    def __init__(self, socket_path: str, timeout: float = EMBEDDING_SERVER_TIMEOUT,
+                 request_timeout: float = EMBEDDING_SERVER_REQUEST_TIMEOUT):
+        """
+        Args:
+            socket_path: 嵌入服务的 Unix socket 路径
+            timeout: 连接超时（秒）
+            request_timeout: 单个请求等待响应的超时（秒）
+        """
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.request_timeout = request_timeout
+        self._sock: Optional[socket.socket] = None
+        # request_id -> (Future, 截止时间)
+        self._pending: Dict[int, Tuple[Future, float]] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        threading.Thread(target=self._expire_requests, name="embedding-client-watchdog", daemon=True).start()
+
+    def _connect(self) -> socket.socket:
+        # 调用方持有 self._lock
+        if self._sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            sock.settimeout(None)
+            # 只限制发送：服务不再读取时 sendall 不会在持有锁的情况下永久阻塞（接收由读线程无限等待）
+            seconds = int(self.timeout)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO,
+                            struct.pack("ll", seconds, int((self.timeout - seconds) * 1e6)))
+            self._sock = sock
+            threading.Thread(target=self._read_responses, args=(sock,), name="embedding-client", daemon=True).start()
+        return self._sock
+
+    def _read_responses(self, sock: socket.socket) -> None:
+        try:
+            while True:
+                request_id, vectors, error = decode_response(recv_frame(sock))
+                with self._lock:
+                    entry = self._pending.pop(request_id, None)
+                # 已超时的请求的响应直接丢弃
+                if entry is None:
+                    continue
+                future = entry[0]
+                if error is not None:
+                    future.set_exception(RuntimeError(f"嵌入服务返回错误: {error}"))
+                else:
+                    future.set_result(vectors)
+        except (OSError, ConnectionError) as e:
+            self._fail_pending(sock, e)
+
+    def _fail_pending(self, sock: socket.socket, error: Exception) -> None:
+        with self._lock:
+            if self._sock is sock:
+                self._sock = None
+            pending, self._pending = self._pending, {}
+        try:
+            sock.close()
+        except OSError:
+            pass
+        if pending:
+            logger.warning(f"与嵌入服务的连接中断，{len(pending)} 个请求失败: {error}")
+        for future, _ in pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(f"与嵌入服务的连接中断: {error}"))
+
+    def _expire_requests(self) -> None:
+        interval = min(max(self.request_timeout / 4, 0.05), 1.0)
+        while not self._closed.wait(interval):
+            now = time.monotonic()
+            with self._lock:
+                expired = [request_id for request_id, (_, deadline) in self._pending.items() if deadline <= now]
+                futures = [self._pending.pop(request_id)[0] for request_id in expired]
+            if futures:
+                logger.warning(f"{len(futures)} 个嵌入请求超过 {self.request_timeout} 秒未响应")
+            for future in futures:
+                if not future.done():
+                    future.set_exception(TimeoutError(f"嵌入服务超过 {self.request_timeout} 秒未响应"))
+
+    def embed(self, texts: Sequence[str], model_name: str = "") -> "Future[np.ndarray]":
+        """
+        发送一批文本，返回 (n, dim) float32 数组的 Future
+
+        Args:
+            texts: 文本列表
+            model_name: 模型名称，为空时使用服务端的默认模型
+        """
+        future: "Future[np.ndarray]" = Future()
+        future.set_running_or_notify_cancel()
+        with self._lock:
+            request_id = next(self._ids) & 0xFFFFFFFF
+            try:
+                sock = self._connect()
+                self._pending[request_id] = (future, time.monotonic() + self.request_timeout)
+                sock.sendall(encode_request(request_id, model_name, texts))
+            except OSError as e:
+                self._pending.pop(request_id, None)
+                future.set_exception(ConnectionError(f"无法连接嵌入服务 {self.socket_path}: {e}"))
+                sock = self._sock
+                self._sock = None
+                if sock is not None:
+                    try:
+                        sock.close()
+                    except OSError:
+                        pass
+        return future
+
+    def close(self) -> None:
+        self._closed.set()
+        with self._lock:
+            sock, self._sock = self._sock, None
+        if sock is not None:
+            sock.close()
+
+
+class RemoteEmbeddingBatcher:
+    """
+    与 EmbeddingBatcher 接口相同的远程版本：文本发送给嵌入服务，由服务端跨进程合并批次
+    """
+
+    def __init__(self, client: EmbeddingClient, model_name: str):
+        self.client = client
+        self.model_name = model_name
+
+    def submit(self, text: str) -> "Future[np.ndarray]":
+        """提交单条文本，返回其嵌入向量的 Future"""
+        return self.submit_many([text])[0]
+
+    def submit_many(self, texts: Sequence[str]) -> List["Future[np.ndarray]"]:
+        """提交多条文本（一次请求），按顺序返回各自的 Future"""
+        if not texts:
+            return []
+        batch = self.client.embed(texts, self.model_name)
+        futures: List["Future[np.ndarray]"] = [Future() for _ in texts]
+
+        def dispatch(done: Future) -> None:
+            error = done.exception()
+            for i, future in enumerate(futures):
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    # 每行是响应缓冲区上的视图
+                    future.set_result(done.result()[i])
+
+        batch.add_done_callback(dispatch)
+        return futures
+
+    def encode(self, texts: Sequence[str], timeout: Optional[float] = None) -> np.ndarray:
+        """阻塞等待多条文本的嵌入结果，返回形状为 (n, dim) 的数组"""
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        return self.client.embed(texts, self.model_name).result(timeout=timeout)
+
+
+_client: Optional[EmbeddingClient] = None
+_client_lock = threading.Lock()
+
+
+def get_embedding_client() -> Optional[EmbeddingClient]:
+    """返回共享的嵌入服务客户端，未配置 EMBEDDING_SERVER_SOCKET 时返回 None"""
+    global _client
+    if EMBEDDING_SERVER_SOCKET is None:
+        return None
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = EmbeddingClient(EMBEDDING_SERVER_SOCKET)
+    return _client
@@ -0,0 +1,95 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+from app.services.metrics import observe_batch, track_stage
+
+# 微批处理参数，可通过环境变量调整
+DEFAULT_MAX_BATCH_SIZE = int(os.environ.get("EMBED_MAX_BATCH_SIZE", "64"))
+DEFAULT_MAX_WAIT_MS = float(os.environ.get("EMBED_MAX_WAIT_MS", "5"))
+
+
+class EmbeddingBatcher:
+    """
+    将并发的单条嵌入请求合并为一次批量 encode 调用
+
+    调用方通过 submit() 提交文本并拿到一个 Future，后台线程收集请求，
+    在凑满 max_batch_size 条或等待超过 max_wait_ms 毫秒后统一编码，
+    再把每条向量通过各自的 Future 返回。
+    """
+
+    def __init__(
+        self,
+        encode_fn: Callable[[List[str]], np.ndarray],
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+        max_wait_ms: float = DEFAULT_MAX_WAIT_MS,
+        name: str = "embedding-batcher",
+    ):
+        """
+        Args:
+            encode_fn: 批量编码函数，接收文本列表，返回形状为 (n, dim) 的数组
+            max_batch_size: 单批最多合并的文本数量
+            max_wait_ms: 收到第一条请求后最多等待多少毫秒再开始编码
+            name: 后台线程名称
+        """
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size 必须大于等于 1")
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max(max_wait_ms, 0.0) / 1000.0
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    def submit(self, text: str) -> "Future[np.ndarray]":
+        """提交单条文本，返回其嵌入向量的 Future"""
+        future: "Future[np.ndarray]" = Future()
+        self._queue.put((text, future))
+        return future
+
+    def submit_many(self, texts: Sequence[str]) -> List["Future[np.ndarray]"]:
+        """提交多条文本，按顺序返回各自的 Future"""
+        return [self.submit(text) for text in texts]
+
+    def encode(self, texts: Sequence[str], timeout: Optional[float] = None) -> np.ndarray:
+        """阻塞等待多条文本的嵌入结果，返回形状为 (n, dim) 的数组"""
+        futures = self.submit_many(texts)
+        return np.stack([f.result(timeout=timeout) for f in futures]) if futures else np.empty((0, 0), dtype=np.float32)
+
+    def _collect_batch(self) -> List[tuple]:
+        # 阻塞等待第一条请求，然后在截止时间内尽量多收集
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect_batch()
+            # 跳过调用方已经取消的请求
+            batch = [(text, f) for text, f in batch if f.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            observe_batch("embed", len(batch))
+            try:
+                with track_stage("embed"):
+                    embeddings = self.encode_fn([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
@@ -0,0 +1,153 @@
+"""
+一次性导出嵌入模型的 ONNX / int8 ONNX 版本，并检查其向量与 PyTorch 版本的一致性
+
+    python -m app.services.embedding_export --backend onnx-int8
+    python -m app.services.embedding_export --backend onnx --samples-from-db 500
+
+导出结果缓存在 EMBEDDING_ONNX_DIR 中，之后设置 EMBEDDING_BACKEND 即可使用。
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app.config.logging_config import setup_logging
+from app.config.embedding_model import (
+    DEFAULT_MODEL_NAME,
+    detect_quantization_config,
+    export_onnx_model,
+    get_embedding_model,
+)
+
+logger = logging.getLogger(__name__)
+
+# 平均余弦相似度低于该值时认为导出的模型与 PyTorch 版本不一致
+DEFAULT_MIN_COSINE = {"onnx": 0.999, "onnx-int8": 0.98}
+
+# 没有笔记数据时使用的多语言样本
+SAMPLE_TEXTS = [
+    "今天的会议讨论了向量检索的延迟问题",
+    "明天下午三点和产品团队复盘上线计划",
+    "红烧肉的做法：先焯水，再小火慢炖一个小时",
+    "发票编号 INV-20931 需要在月底前报销",
+    "How do I reduce the p99 latency of the search endpoint?",
+    "Reading notes: Designing Data-Intensive Applications, chapter 3",
+    "Grocery list: eggs, milk, spinach, coffee beans",
+    "Project kickoff scheduled for next Monday with the platform team",
+    "来週の出張の準備をする必要がある",
+    "Python の非同期処理についてのメモ",
+    "机器学习模型的训练数据需要重新清洗",
+    "The quarterly budget review moved to Thursday",
+]
+
+
+def _load_texts(samples_from_db: int) -> List[str]:
+    if samples_from_db <= 0:
+        return list(SAMPLE_TEXTS)
+    from app.config.db import mongo_client
+    cursor = mongo_client.notes.notes.aggregate([
+        {"$sample": {"size": samples_from_db}},
+        {"$project": {"title": 1, "description": 1}},
+    ])
+    texts = [f"{doc.get('title', '')} {doc.get('description', '')}".strip() for doc in cursor]
+    return [text for text in texts if text] or list(SAMPLE_TEXTS)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1.0)
+
+
+def _per_query_latency_ms(model, texts: Sequence[str], repeats: int) -> float:
+    # 逐条编码（与在线查询一致），先预热一次
+    model.encode([texts[0]])
+    started = time.perf_counter()
+    for _ in range(repeats):
+        for text in texts:
+            model.encode([text])
+    return (time.perf_counter() - started) / (repeats * len(texts)) * 1000
+
+
+def check_parity(backend: str, model_name: Optional[str] = None, texts: Optional[Sequence[str]] = None,
+                 repeats: int = 3) -> Dict[str, Any]:
+    """
+    比较指定后端与 PyTorch 后端对同一批文本生成的向量
+
+    Args:
+        backend: 要检查的后端（"onnx" 或 "onnx-int8"）
+        model_name: 模型名称，为 None 时使用默认模型
+        texts: 样本文本，为 None 时使用内置的多语言样本
+        repeats: 测量逐条编码延迟时的重复次数
+
+    Returns:
+        余弦相似度统计、最近邻一致率以及两个后端的逐条编码延迟
+    """
+    model_name = model_name or DEFAULT_MODEL_NAME
+    texts = list(texts or SAMPLE_TEXTS)
+    reference_model = get_embedding_model(model_name, device="cpu", backend="torch")
+    candidate_model = get_embedding_model(model_name, device="cpu", backend=backend)
+    reference = _normalize(reference_model.encode(texts))
+    candidate = _normalize(candidate_model.encode(texts))
+
+    cosine = np.sum(reference * candidate, axis=1)
+    # 每条文本在样本中的最近邻（排除自身）是否一致，反映检索排序是否受影响
+    neighbor_agreement = None
+    if len(texts) > 2:
+        reference_sim = reference @ reference.T
+        candidate_sim = candidate @ candidate.T
+        np.fill_diagonal(reference_sim, -np.inf)
+        np.fill_diagonal(candidate_sim, -np.inf)
+        neighbor_agreement = float(np.mean(reference_sim.argmax(axis=1) == candidate_sim.argmax(axis=1)))
+
+    latency_texts = texts[:min(len(texts), 32)]
+    torch_ms = _per_query_latency_ms(reference_model, latency_texts, repeats)
+    backend_ms = _per_query_latency_ms(candidate_model, latency_texts, repeats)
+    return {
+        "model": model_name,
+        "backend": backend,
+        "samples": len(texts),
+        "cosine_mean": float(cosine.mean()),
+        "cosine_min": float(cosine.min()),
+        "nearest_neighbor_agreement": neighbor_agreement,
+        "torch_ms_per_query": round(torch_ms, 3),
+        "backend_ms_per_query": round(backend_ms, 3),
+        "speedup": round(torch_ms / backend_ms, 2) if backend_ms > 0 else None,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="导出 ONNX 嵌入模型并检查与 PyTorch 的一致性")
+    parser.add_argument("--backend", choices=("onnx", "onnx-int8"), default="onnx-int8")
+    parser.add_argument("--model", default=None, help="模型名称，默认使用 EMBEDDING_MODEL")
+    parser.add_argument("--samples-from-db", type=int, default=0, help="从 MongoDB 随机抽取多少条笔记做一致性检查")
+    parser.add_argument("--min-cosine", type=float, default=None, help="平均余弦相似度的下限")
+    parser.add_argument("--skip-parity", action="store_true", help="只导出，不做一致性检查")
+    args = parser.parse_args(argv)
+    setup_logging()
+
+    # int8 量化配置由 EMBEDDING_ONNX_QUANTIZATION 指定，加载模型时使用同一配置
+    quantization = detect_quantization_config()
+    model_dir, file_name = export_onnx_model(args.model, args.backend, quantization)
+    logger.info(f"已导出: {os.path.join(model_dir, file_name)}")
+    if args.skip_parity:
+        return 0
+
+    report = check_parity(args.backend, args.model, _load_texts(args.samples_from_db))
+    report["quantization"] = quantization if args.backend == "onnx-int8" else None
+    min_cosine = args.min_cosine if args.min_cosine is not None else DEFAULT_MIN_COSINE[args.backend]
+    report["min_cosine"] = min_cosine
+    report["passed"] = report["cosine_mean"] >= min_cosine
+    with open(os.path.join(model_dir, f"parity-{args.backend}.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0 if report["passed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
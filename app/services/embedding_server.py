@@ -0,0 +1,201 @@
+"""
+共享嵌入服务：一个本地进程持有嵌入模型，通过 Unix socket 为同一节点上的所有 API worker 编码文本
+
+    python -m app.services.embedding_server --socket /run/lmnotes/embedding.sock
+
+API worker 设置同一个 EMBEDDING_SERVER_SOCKET 后不再加载模型。所有 worker 的请求进入同一个
+批处理器合并编码，向量以原始 float32 字节返回，协议见 app.services.embedding_client。
+"""
+import argparse
+import logging
+import os
+import queue
+import signal
+import socket
+import socketserver
+import sys
+import threading
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.config.logging_config import setup_logging
+from app.config.embedding_model import DEFAULT_MODEL_NAME, get_embedding_model
+from app.services.embedding_client import (
+    EMBEDDING_SERVER_SOCKET,
+    FRAME_HEADER,
+    RESPONSE_HEADER,
+    STATUS_ERROR,
+    STATUS_OK,
+    decode_request,
+    recv_frame,
+)
+from app.services.embedding_engine import DEFAULT_MAX_BATCH_SIZE, DEFAULT_MAX_WAIT_MS, EmbeddingBatcher
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET_PATH = "/tmp/lmnotes-embedding.sock"
+
+
+class EmbeddingService:
+    """按模型名称维护批处理器，所有连接共用，从而跨 worker 合并批次"""
+
+    def __init__(self, max_batch_size: int = DEFAULT_MAX_BATCH_SIZE, max_wait_ms: float = DEFAULT_MAX_WAIT_MS):
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._batchers: Dict[str, EmbeddingBatcher] = {}
+        self._lock = threading.Lock()
+
+    def get_batcher(self, model_name: str) -> EmbeddingBatcher:
+        model_name = model_name or DEFAULT_MODEL_NAME
+        with self._lock:
+            batcher = self._batchers.get(model_name)
+            if batcher is None:
+                batcher = EmbeddingBatcher(lambda texts: get_embedding_model(model_name).encode(texts),
+                                           max_batch_size=self.max_batch_size, max_wait_ms=self.max_wait_ms,
+                                           name=f"embedding-server-{model_name}")
+                self._batchers[model_name] = batcher
+        return batcher
+
+    def warm_up(self, model_name: Optional[str] = None) -> None:
+        """启动时加载模型并编码一次，避免第一个请求承担加载耗时"""
+        self.get_batcher(model_name or DEFAULT_MODEL_NAME).encode(["warm up"])
+
+
+class _ConnectionHandler(socketserver.BaseRequestHandler):
+    """
+    处理一个 API worker 的连接
+
+    读线程只负责解析请求并提交给批处理器，编码完成后响应交给写线程发送，
+    因此同一连接上的多个请求可以同时在途，并与其它连接的请求合并成批。
+    """
+
+    def setup(self) -> None:
+        self._responses: "queue.Queue[Optional[List]]" = queue.Queue()
+        self._writer = threading.Thread(target=self._write_responses, name="embedding-server-writer", daemon=True)
+        self._writer.start()
+
+    def handle(self) -> None:
+        service: EmbeddingService = self.server.service
+        try:
+            while True:
+                payload = recv_frame(self.request)
+                try:
+                    request_id, model_name, texts = decode_request(payload)
+                except ValueError as e:
+                    # 帧边界仍然完整，回复错误后继续处理同一连接上的后续请求
+                    request_id = FRAME_HEADER.unpack_from(payload)[0] if len(payload) >= FRAME_HEADER.size else 0
+                    self._respond_error(request_id, ValueError(f"无法解析请求: {e}"))
+                    continue
+                try:
+                    futures = service.get_batcher(model_name).submit_many(texts)
+                except Exception as e:
+                    self._respond_error(request_id, e)
+                    continue
+                self._respond_when_done(request_id, futures)
+        except (ConnectionError, OSError):
+            pass
+
+    def finish(self) -> None:
+        self._responses.put(None)
+        self._writer.join()
+
+    def _respond_when_done(self, request_id: int, futures: List["Future[np.ndarray]"]) -> None:
+        if not futures:
+            self._responses.put([RESPONSE_HEADER.pack(request_id, STATUS_OK, 0, 0)])
+            return
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def on_done(_: Future) -> None:
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            try:
+                vectors = np.ascontiguousarray(np.stack([f.result() for f in futures]), dtype="<f4")
+            except Exception as e:
+                self._respond_error(request_id, e)
+                return
+            header = RESPONSE_HEADER.pack(request_id, STATUS_OK, vectors.shape[0], vectors.shape[1])
+            # 向量数组的内存直接写入 socket，不做序列化
+            self._responses.put([header, memoryview(vectors).cast("B")])
+
+        for future in futures:
+            future.add_done_callback(on_done)
+
+    def _respond_error(self, request_id: int, error: Exception) -> None:
+        logger.error(f"嵌入请求失败: {error}")
+        header = RESPONSE_HEADER.pack(request_id, STATUS_ERROR, 0, 0)
+        self._responses.put([header, str(error).encode("utf-8")])
+
+    def _write_responses(self) -> None:
+        broken = False
+        while True:
+            parts = self._responses.get()
+            if parts is None:
+                return
+            if broken:
+                continue
+            try:
+                self.request.sendall(FRAME_HEADER.pack(sum(len(part) for part in parts)))
+                for part in parts:
+                    self.request.sendall(part)
+            except OSError:
+                # 客户端已断开，丢弃剩余响应，等待读线程结束
+                broken = True
+
+
+class EmbeddingServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, service: EmbeddingService):
+        self.service = service
+        if os.path.exists(socket_path):
+            # 上次异常退出留下的 socket 文件；如果仍有服务在监听则拒绝启动
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(socket_path)
+            except OSError:
+                os.unlink(socket_path)
+            else:
+                raise RuntimeError(f"已有嵌入服务在监听 {socket_path}")
+            finally:
+                probe.close()
+        super().__init__(socket_path, _ConnectionHandler)
+        os.chmod(socket_path, 0o660)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="共享嵌入服务")
+    parser.add_argument("--socket", default=EMBEDDING_SERVER_SOCKET or DEFAULT_SOCKET_PATH, help="Unix socket 路径")
+    parser.add_argument("--max-batch-size", type=int, default=DEFAULT_MAX_BATCH_SIZE, help="单批最多合并的文本数量")
+    parser.add_argument("--max-wait-ms", type=float, default=DEFAULT_MAX_WAIT_MS, help="凑批最多等待的毫秒数")
+    parser.add_argument("--no-warm-up", action="store_true", help="启动时不预先加载默认模型")
+    args = parser.parse_args(argv)
+    setup_logging()
+
+    service = EmbeddingService(args.max_batch_size, args.max_wait_ms)
+    if not args.no_warm_up:
+        service.warm_up()
+    server = EmbeddingServer(args.socket, service)
+
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    logger.info(f"嵌入服务已启动: {args.socket} (max_batch_size={args.max_batch_size}, max_wait_ms={args.max_wait_ms})")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        logger.info("嵌入服务已停止")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
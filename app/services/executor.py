@@ -0,0 +1,28 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
+T = TypeVar("T")
+
+# 用于执行阻塞调用（嵌入编码、ChromaDB 同步客户端等）的有界线程池
+BLOCKING_POOL_SIZE = int(os.environ.get("BLOCKING_POOL_SIZE", str(min(32, (os.cpu_count() or 1) + 4))))
+
+blocking_executor = ThreadPoolExecutor(max_workers=BLOCKING_POOL_SIZE, thread_name_prefix="blocking")
+
+
+async def run_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    在有界线程池中执行阻塞函数，避免阻塞事件循环
+
+    Args:
+        func: 要执行的同步函数
+        *args: 位置参数
+        **kwargs: 关键字参数
+
+    Returns:
+        函数的返回值
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(blocking_executor, functools.partial(func, *args, **kwargs))
@@ -0,0 +1,297 @@
+import asyncio
+import logging
+import os
+import random
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from app.config.db import async_mongo_client
+from app.services.executor import run_blocking
+from app.services.knn_graph import related_graph
+from app.services.metrics import observe_batch
+from app.services.semantic_search import add_many_to_search_index, add_to_search_index, remove_from_search_index
+
+logger = logging.getLogger(__name__)
+
+# 索引发件箱参数，可通过环境变量调整
+OUTBOX_WORKERS = int(os.environ.get("OUTBOX_WORKERS", "2"))
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", "64"))
+OUTBOX_POLL_INTERVAL = float(os.environ.get("OUTBOX_POLL_INTERVAL", "1.0"))
+OUTBOX_LEASE_SECONDS = float(os.environ.get("OUTBOX_LEASE_SECONDS", "60"))
+OUTBOX_RETRY_BASE_SECONDS = float(os.environ.get("OUTBOX_RETRY_BASE_SECONDS", "1.0"))
+OUTBOX_RETRY_MAX_SECONDS = float(os.environ.get("OUTBOX_RETRY_MAX_SECONDS", "3600"))
+# 请求 wait_for_index 时最多等待的秒数
+OUTBOX_WAIT_TIMEOUT = float(os.environ.get("OUTBOX_WAIT_TIMEOUT", "10"))
+
+db = async_mongo_client.notes
+notes_collection = db.notes
+# 每条笔记最多一条待处理的索引任务（_id 为笔记 ID），同一笔记的多次写入会合并为最后一次
+outbox_collection = db.index_outbox
+
+# 任务类型：insert 为新笔记（跳过与已有索引的比较，可批量写入），
+# upsert 为更新（只重新嵌入变化的块），delete 为删除
+OP_INSERT = "insert"
+OP_UPSERT = "upsert"
+OP_DELETE = "delete"
+
+_worker_id = f"{socket.gethostname()}:{os.getpid()}"
+_workers: List[asyncio.Task] = []
+_wakeup: Optional[asyncio.Event] = None
+_progress: Optional[asyncio.Event] = None
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _task_update(op: str, version: ObjectId) -> Dict[str, Any]:
+    # 不修改 owner/lease_until：任务正在被处理时，新版本要等当前处理结束（或租约过期）后
+    # 才能被领取，避免同一笔记被两个工作者并发索引、旧内容后写入覆盖新内容
+    return {
+        "$set": {
+            "op": op,
+            "version": version,
+            "attempts": 0,
+            "next_attempt_at": _now(),
+            "enqueued_at": _now(),
+            "last_error": None,
+        }
+    }
+
+
+async def enqueue_index_task(note_id: str, op: str, session=None) -> ObjectId:
+    """
+    记录一条索引任务，应与笔记写入在同一事务中调用
+
+    Args:
+        note_id: 笔记ID
+        op: 任务类型（OP_INSERT、OP_UPSERT 或 OP_DELETE）
+        session: MongoDB 会话（事务），不支持事务时为 None
+
+    Returns:
+        任务版本号，可传给 wait_for_index()
+    """
+    version = ObjectId()
+    await outbox_collection.update_one({"_id": note_id}, _task_update(op, version), upsert=True, session=session)
+    _notify_workers()
+    return version
+
+
+async def enqueue_index_tasks(note_ids: List[str], op: str, session=None) -> Dict[str, ObjectId]:
+    """批量记录索引任务，返回笔记ID到任务版本号的映射"""
+    if not note_ids:
+        return {}
+    versions = {note_id: ObjectId() for note_id in note_ids}
+    await outbox_collection.bulk_write(
+        [UpdateOne({"_id": note_id}, _task_update(op, version), upsert=True) for note_id, version in versions.items()],
+        ordered=False,
+        session=session
+    )
+    _notify_workers()
+    return versions
+
+
+async def wait_for_index(note_id: str, version: ObjectId, timeout: float = OUTBOX_WAIT_TIMEOUT) -> bool:
+    """
+    等待指定版本的索引任务完成（读己之写）
+
+    任务被同一笔记更新的写入取代时也视为完成。
+
+    Args:
+        note_id: 笔记ID
+        version: enqueue_index_task() 返回的任务版本号
+        timeout: 最长等待秒数
+
+    Returns:
+        任务是否在超时前完成
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        task = await outbox_collection.find_one({"_id": note_id}, {"version": 1})
+        if task is None or task["version"] != version:
+            return True
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return False
+        # 本进程的工作协程处理完一批后会唤醒等待者；任务由其它进程处理时靠轮询发现
+        try:
+            await asyncio.wait_for(_get_progress_event().wait(), min(remaining, 0.25))
+        except asyncio.TimeoutError:
+            pass
+
+
+async def get_outbox_stats() -> Dict[str, Any]:
+    """返回待处理任务数、正在重试的任务数以及最早任务的入队时间"""
+    pending = await outbox_collection.count_documents({})
+    retrying = await outbox_collection.count_documents({"attempts": {"$gt": 0}})
+    oldest = await outbox_collection.find_one({}, {"enqueued_at": 1, "last_error": 1}, sort=[("enqueued_at", 1)])
+    return {
+        "pending": pending,
+        "retrying": retrying,
+        "oldest_enqueued_at": oldest["enqueued_at"] if oldest else None,
+        "workers": sum(1 for task in _workers if not task.done()),
+    }
+
+
+def _get_progress_event() -> asyncio.Event:
+    global _progress
+    if _progress is None:
+        _progress = asyncio.Event()
+    return _progress
+
+
+def _notify_progress() -> None:
+    global _progress
+    if _progress is not None:
+        _progress.set()
+        _progress = None
+
+
+def _notify_workers() -> None:
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+def start_index_workers(workers: int = OUTBOX_WORKERS) -> None:
+    """启动后台索引工作协程（在应用启动时调用）"""
+    global _wakeup
+    if any(not task.done() for task in _workers):
+        return
+    _wakeup = asyncio.Event()
+    _workers[:] = [asyncio.create_task(_worker_loop(i)) for i in range(workers)]
+    logger.info(f"已启动 {workers} 个索引工作协程")
+
+
+async def stop_index_workers() -> None:
+    """停止后台索引工作协程，未完成的任务留在发件箱中由下次启动继续处理"""
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+
+
+async def _worker_loop(worker_index: int) -> None:
+    while True:
+        try:
+            processed = await process_outbox_batch()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception(f"索引工作协程 {worker_index} 出错: {e}")
+            processed = 0
+        if processed:
+            continue
+        # 发件箱为空时等待新任务或轮询间隔（可能有其它进程写入或重试时间到期的任务）
+        _wakeup.clear()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), OUTBOX_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def _claim_batch() -> Tuple[str, List[Dict[str, Any]]]:
+    """领取一批到期且未被其它工作者持有的任务"""
+    now = _now()
+    claimable = {
+        "next_attempt_at": {"$lte": now},
+        "$or": [{"lease_until": {"$exists": False}}, {"lease_until": {"$lt": now}}],
+    }
+    candidates = await outbox_collection.find(claimable, {"_id": 1}).sort("next_attempt_at", 1).limit(OUTBOX_BATCH_SIZE).to_list(length=OUTBOX_BATCH_SIZE)
+    if not candidates:
+        return "", []
+    token = f"{_worker_id}:{uuid.uuid4().hex}"
+    await outbox_collection.update_many(
+        {"_id": {"$in": [c["_id"] for c in candidates]}, **claimable},
+        {"$set": {"owner": token, "lease_until": now + timedelta(seconds=OUTBOX_LEASE_SECONDS)}}
+    )
+    return token, await outbox_collection.find({"owner": token}).to_list(length=None)
+
+
+async def process_outbox_batch() -> int:
+    """
+    领取并处理一批索引任务
+
+    任务只记录笔记ID，处理时从 MongoDB 读取笔记的当前内容；笔记已不存在时按删除处理。
+
+    Returns:
+        处理（成功或失败）的任务数量
+    """
+    token, tasks = await _claim_batch()
+    if not tasks:
+        return 0
+    observe_batch("index_outbox", len(tasks))
+
+    upsert_ids = [task["_id"] for task in tasks if task["op"] != OP_DELETE]
+    notes: Dict[str, Dict[str, Any]] = {}
+    object_ids = [ObjectId(id) for id in upsert_ids if ObjectId.is_valid(id)]
+    if object_ids:
+        async for doc in notes_collection.find({"_id": {"$in": object_ids}}, {"title": 1, "description": 1}):
+            notes[str(doc["_id"])] = doc
+
+    errors: Dict[str, str] = {}
+    inserts = [task for task in tasks if task["op"] == OP_INSERT and task["_id"] in notes]
+    if inserts:
+        # 新笔记批量嵌入并批量写入
+        errors.update(await run_blocking(
+            add_many_to_search_index,
+            [(task["_id"], notes[task["_id"]].get("title", ""), notes[task["_id"]].get("description", "")) for task in inserts]
+        ))
+
+    async def apply(task: Dict[str, Any]) -> None:
+        note = notes.get(task["_id"])
+        if note is None:
+            await run_blocking(remove_from_search_index, task["_id"])
+        else:
+            await run_blocking(add_to_search_index, id=task["_id"], title=note.get("title", ""), description=note.get("description", ""))
+
+    # 更新与删除逐条处理；并发提交的嵌入请求仍会被批处理器合并
+    insert_ids = {task["_id"] for task in inserts}
+    others = [task for task in tasks if task["_id"] not in insert_ids]
+    results = await asyncio.gather(*(apply(task) for task in others), return_exceptions=True)
+    for task, result in zip(others, results):
+        if isinstance(result, Exception):
+            errors[task["_id"]] = str(result)
+
+    done = [task for task in tasks if task["_id"] not in errors]
+    if done:
+        # 用已写入的向量增量更新相关笔记的近邻图，不调用嵌入模型
+        try:
+            await run_blocking(related_graph.apply_changes,
+                               [task["_id"] for task in done if task["_id"] in notes],
+                               [task["_id"] for task in done if task["_id"] not in notes])
+        except Exception as e:
+            logger.warning(f"更新相关笔记近邻图失败，清空缓存: {e}")
+            related_graph.clear()
+        # 只删除版本号未变的任务；处理期间又有新写入时保留新任务
+        await outbox_collection.delete_many({"$or": [{"_id": task["_id"], "version": task["version"]} for task in done]})
+    for task in tasks:
+        if task["_id"] in errors:
+            await _schedule_retry(task, errors[task["_id"]])
+    # 释放处理期间被新写入取代的任务，使其可以立即被领取
+    await outbox_collection.update_many({"owner": token}, {"$unset": {"owner": "", "lease_until": ""}})
+
+    if errors:
+        logger.warning(f"索引任务处理完成，成功 {len(done)} 条，失败 {len(errors)} 条（稍后重试）")
+    _notify_progress()
+    return len(tasks)
+
+
+async def _schedule_retry(task: Dict[str, Any], error: str) -> None:
+    """按指数退避（带抖动）安排重试"""
+    attempts = task.get("attempts", 0) + 1
+    delay = min(OUTBOX_RETRY_MAX_SECONDS, OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+    delay *= random.uniform(0.5, 1.0)
+    await outbox_collection.update_one(
+        {"_id": task["_id"], "version": task["version"]},
+        {
+            "$set": {"attempts": attempts, "last_error": error, "next_attempt_at": _now() + timedelta(seconds=delay)},
+            "$unset": {"owner": "", "lease_until": ""},
+        }
+    )
+    logger.warning(f"笔记 {task['_id']} 的索引任务第 {attempts} 次失败，{delay:.1f} 秒后重试: {error}")
@@ -0,0 +1,317 @@
+import asyncio
+import heapq
+import logging
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.config.db import TOMBSTONE_TTL_SECONDS, mongo_client
+from app.services.executor import run_blocking
+from app.services.tokens import CJK_CHARS
+
+logger = logging.getLogger(__name__)
+
+# BM25 参数，可通过环境变量调整
+BM25_K1 = float(os.environ.get("BM25_K1", "1.2"))
+BM25_B = float(os.environ.get("BM25_B", "0.75"))
+# 标题中的词项按此倍数计入词频，使标题命中的得分高于正文命中
+TITLE_WEIGHT = int(os.environ.get("KEYWORD_TITLE_WEIGHT", "2"))
+# 从 MongoDB 增量同步其它进程写入的间隔（秒），为 0 时不同步
+KEYWORD_SYNC_INTERVAL = float(os.environ.get("KEYWORD_SYNC_INTERVAL", "5"))
+# 增量同步时水位线向前回退的秒数，覆盖与上一轮同时提交的写入和进程之间的时钟偏差
+KEYWORD_SYNC_OVERLAP_SECONDS = float(os.environ.get("KEYWORD_SYNC_OVERLAP_SECONDS", "5"))
+# 增量同步每次从 MongoDB 读取的笔记（或墓碑）数量
+KEYWORD_SYNC_BATCH = int(os.environ.get("KEYWORD_SYNC_BATCH", "1000"))
+
+# CJK 字符（含日文假名、韩文）按字符二元组切分，其余按字母数字单词切分
+_CJK_RUN_RE = re.compile(f"[{CJK_CHARS}]+")
+_WORD_RE = re.compile(r"[^\W_]+")
+# 产品编号、版本号等由连字符或点连接的词整体也作为一个词项，例如 "ab-1234"、"v2.1"
+_CODE_RE = re.compile(r"[^\W_]+(?:[-_./][^\W_]+)+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    将文本切分为词项（NFKC 规范化并转为小写）
+
+    连续的 CJK 字符切分为重叠的二元组（单个字符时为一元组），
+    其余文本切分为字母数字单词，连字符连接的编号额外保留整体。
+
+    Args:
+        text: 要切分的文本
+
+    Returns:
+        词项列表（可能重复）
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens: List[str] = []
+    for run in _CJK_RUN_RE.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    rest = _CJK_RUN_RE.sub(" ", text)
+    tokens.extend(_WORD_RE.findall(rest))
+    tokens.extend(_CODE_RE.findall(rest))
+    return tokens
+
+
+class InvertedIndex:
+    """
+    支持增量更新的内存倒排索引，使用 BM25 打分
+
+    查询只遍历查询词项的倒排表，开销与倒排表长度成正比，而不是与笔记总数成正比。
+    所有方法都是线程安全的。
+    """
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B, title_weight: int = TITLE_WEIGHT):
+        self.k1 = k1
+        self.b = b
+        self.title_weight = title_weight
+        self.ready = False
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._doc_terms: Dict[str, Counter] = {}
+        self._doc_lengths: Dict[str, int] = {}
+        self._total_length = 0
+        self._lock = threading.RLock()
+
+    def _terms(self, title: str, description: str) -> Counter:
+        terms = Counter(tokenize(description))
+        for term in tokenize(title):
+            terms[term] += self.title_weight
+        return terms
+
+    def _remove_locked(self, doc_id: str) -> None:
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self._postings[term]
+        self._total_length -= self._doc_lengths.pop(doc_id, 0)
+
+    def _add_locked(self, doc_id: str, terms: Counter) -> None:
+        self._remove_locked(doc_id)
+        if not terms:
+            return
+        self._doc_terms[doc_id] = terms
+        for term, frequency in terms.items():
+            self._postings.setdefault(term, {})[doc_id] = frequency
+        length = sum(terms.values())
+        self._doc_lengths[doc_id] = length
+        self._total_length += length
+
+    def add(self, doc_id: str, title: str, description: str) -> None:
+        """添加或更新一条笔记"""
+        terms = self._terms(title, description)
+        with self._lock:
+            self._add_locked(doc_id, terms)
+
+    def remove(self, doc_id: str) -> None:
+        """删除一条笔记，不存在时忽略"""
+        with self._lock:
+            self._remove_locked(doc_id)
+
+    def rebuild(self, docs: Iterable[Tuple[str, str, str]]) -> None:
+        """
+        用给定的笔记全量重建索引
+
+        重建期间持有锁，并发的 add/remove 会等待重建完成后再应用，
+        因此不会被重建覆盖。
+
+        Args:
+            docs: (笔记ID, 标题, 描述) 的可迭代对象
+        """
+        with self._lock:
+            self._postings.clear()
+            self._doc_terms.clear()
+            self._doc_lengths.clear()
+            self._total_length = 0
+            for doc_id, title, description in docs:
+                self._add_locked(doc_id, self._terms(title, description))
+            self.ready = True
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[str, float]]:
+        """
+        按 BM25 得分检索笔记
+
+        Args:
+            query: 查询文本
+            limit: 返回结果的最大数量
+
+        Returns:
+            按得分降序排列的 (笔记ID, 得分) 列表
+        """
+        query_terms = set(tokenize(query))
+        scores: Dict[str, float] = {}
+        with self._lock:
+            doc_count = len(self._doc_terms)
+            if not doc_count:
+                return []
+            average_length = self._total_length / doc_count
+            for term in query_terms:
+                posting = self._postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (doc_count - len(posting) + 0.5) / (len(posting) + 0.5))
+                for doc_id, frequency in posting.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[doc_id] / average_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+    def stats(self) -> Dict[str, float]:
+        """返回笔记数、词项数和平均文档长度"""
+        with self._lock:
+            doc_count = len(self._doc_terms)
+            return {
+                "ready": self.ready,
+                "documents": doc_count,
+                "terms": len(self._postings),
+                "average_length": self._total_length / doc_count if doc_count else 0.0,
+            }
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """
+    用倒数排名融合（RRF）合并多个排序结果
+
+    Args:
+        rankings: 多个按相关性降序排列的 ID 列表
+        k: 平滑常数，越大时排名靠后的结果权重越接近排名靠前的结果
+
+    Returns:
+        按融合得分降序排列的 (ID, 得分) 列表
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+# 进程内共享的关键词索引，首次搜索时从 MongoDB 加载，之后按水位线增量同步
+keyword_index = InvertedIndex()
+_load_lock = threading.Lock()
+# 已同步到的时间点：此前提交的修改和删除都已应用到本进程的索引
+_watermark: Optional[datetime] = None
+_sync_task: Optional[asyncio.Task] = None
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _load_locked() -> None:
+    global _watermark
+    logger.info("正在从 MongoDB 加载关键词索引...")
+    loaded_at = _now()
+    cursor = mongo_client.notes.notes.find({}, {"title": 1, "description": 1})
+    keyword_index.rebuild(
+        (str(doc["_id"]), str(doc.get("title", "")), str(doc.get("description", ""))) for doc in cursor
+    )
+    _watermark = loaded_at
+    logger.info(f"关键词索引加载完成: {keyword_index.stats()}")
+
+
+def get_keyword_index() -> Optional[InvertedIndex]:
+    """
+    获取已加载的关键词索引，首次调用时从 MongoDB 全量加载
+
+    Returns:
+        关键词索引；加载失败时返回 None（调用方退化为纯向量检索）
+    """
+    if keyword_index.ready:
+        return keyword_index
+    with _load_lock:
+        if keyword_index.ready:
+            return keyword_index
+        try:
+            _load_locked()
+        except Exception as e:
+            logger.error(f"加载关键词索引时出错: {e}")
+            return None
+    return keyword_index
+
+
+def _changed_since(collection, field: str, since: datetime, projection: Dict[str, int]) -> Iterable[Dict[str, Any]]:
+    # 按 (field, _id) 分页读取 field >= since 的文档，每页 KEYWORD_SYNC_BATCH 条
+    query: Dict[str, Any] = {field: {"$gte": since}}
+    while True:
+        page = list(collection.find(query, projection).sort([(field, 1), ("_id", 1)]).limit(KEYWORD_SYNC_BATCH))
+        yield from page
+        if len(page) < KEYWORD_SYNC_BATCH:
+            return
+        last = page[-1]
+        query = {"$or": [
+            {field: {"$gt": last[field]}},
+            {field: last[field], "_id": {"$gt": last["_id"]}},
+        ]}
+
+
+def sync_keyword_index() -> Dict[str, int]:
+    """
+    将水位线之后 MongoDB 中修改（updated_at）和删除（墓碑）的笔记应用到本进程的关键词索引
+
+    索引发件箱只更新处理任务的那个进程的索引，其它 worker 进程靠该同步看到变化。
+    水位线早于墓碑的保留期时无法确定哪些笔记被删除，改为全量重新加载。
+
+    Returns:
+        本轮更新和删除的笔记数量
+    """
+    global _watermark
+    stats = {"updated": 0, "removed": 0}
+    if not keyword_index.ready or _watermark is None:
+        return stats
+    with _load_lock:
+        started_at = _now()
+        if started_at - _watermark > timedelta(seconds=TOMBSTONE_TTL_SECONDS):
+            _load_locked()
+            return stats
+        since = _watermark - timedelta(seconds=KEYWORD_SYNC_OVERLAP_SECONDS)
+        db = mongo_client.notes
+        for doc in _changed_since(db.notes, "updated_at", since, {"title": 1, "description": 1, "updated_at": 1}):
+            keyword_index.add(str(doc["_id"]), str(doc.get("title", "")), str(doc.get("description", "")))
+            stats["updated"] += 1
+        for doc in _changed_since(db.note_tombstones, "deleted_at", since, {"deleted_at": 1}):
+            keyword_index.remove(doc["_id"])
+            stats["removed"] += 1
+        _watermark = started_at
+    if stats["updated"] or stats["removed"]:
+        logger.debug(f"关键词索引增量同步完成: {stats}")
+    return stats
+
+
+async def _sync_loop(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_blocking(sync_keyword_index)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception(f"关键词索引增量同步出错: {e}")
+
+
+def start_keyword_sync(interval: float = KEYWORD_SYNC_INTERVAL) -> None:
+    """启动关键词索引的定时增量同步（关键词索引加载后调用）"""
+    global _sync_task
+    if interval <= 0 or (_sync_task is not None and not _sync_task.done()):
+        return
+    _sync_task = asyncio.create_task(_sync_loop(interval))
+
+
+async def stop_keyword_sync() -> None:
+    """停止关键词索引的定时增量同步"""
+    global _sync_task
+    if _sync_task is not None:
+        _sync_task.cancel()
+        await asyncio.gather(_sync_task, return_exceptions=True)
+        _sync_task = None
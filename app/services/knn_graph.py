@@ -0,0 +1,320 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from app.config.chroma_db import get_active_index, get_index_collection
+from app.services.metrics import register_cache, track_stage
+from app.services.semantic_search import SEARCH_CHUNK_OVERSAMPLE, chunk_id
+
+logger = logging.getLogger(__name__)
+
+# 每条笔记缓存的近邻数量，请求的 limit 超过它时直接查询向量库
+RELATED_GRAPH_K = int(os.environ.get("RELATED_GRAPH_K", "20"))
+# 最多缓存多少条笔记的近邻（LRU）
+RELATED_CACHE_SIZE = int(os.environ.get("RELATED_CACHE_SIZE", "10000"))
+# 近邻缓存的有效期（秒）：图只随本进程处理的索引任务增量更新，其它进程写入的变化在过期后才可见
+RELATED_CACHE_TTL = float(os.environ.get("RELATED_CACHE_TTL", "600"))
+
+
+@dataclass
+class _Entry:
+    # 笔记向量（各块向量的均值，已归一化）
+    vector: np.ndarray
+    # 按相似度降序排列的 (笔记ID, 相似度)，是真实近邻排名的前缀
+    neighbors: List[Tuple[str, float]]
+    # neighbors 是否已包含集合中所有其它笔记（笔记总数不足 k 时）
+    exhaustive: bool
+    created_at: float
+
+
+def _normalize_rows(vectors: Any) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1.0)
+
+
+def get_note_chunk_vectors(collection, note_id: str) -> Optional[np.ndarray]:
+    """
+    读取笔记已存储的块向量（不调用模型）
+
+    Returns:
+        归一化后的块向量矩阵；笔记尚未被索引时返回 None
+    """
+    with track_stage("vector_get"):
+        result = collection.get(where={"parent_id": note_id}, include=["embeddings"])
+        embeddings = result.get("embeddings")
+        if embeddings is None or len(embeddings) == 0:
+            # 旧版整条笔记向量没有 parent_id，其 ID 即笔记 ID
+            result = collection.get(ids=[note_id], include=["embeddings"])
+            embeddings = result.get("embeddings")
+    if embeddings is None or len(embeddings) == 0:
+        return None
+    return _normalize_rows(embeddings)
+
+
+def note_vector(chunk_vectors: np.ndarray) -> np.ndarray:
+    """由块向量得到整条笔记的查询向量（均值后归一化）"""
+    return _normalize_rows(chunk_vectors.mean(axis=0))[0]
+
+
+def _query_neighbors(collection, vector: np.ndarray, note_id: str, k: int) -> Tuple[List[Tuple[str, float]], bool]:
+    # 以笔记向量查询块级近邻，按笔记聚合取最高相似度，排除笔记自身；
+    # 返回的是近邻排名的前缀，以及它是否已包含集合中所有其它笔记
+    n_results = (k + 1) * SEARCH_CHUNK_OVERSAMPLE
+    while True:
+        with track_stage("vector_query"):
+            results = collection.query(query_embeddings=[vector.tolist()], n_results=n_results,
+                                       include=["metadatas", "distances"])
+        ids = results["ids"][0] if results.get("ids") else []
+        metadatas = results["metadatas"][0] if results.get("metadatas") else [None] * len(ids)
+        distances = results["distances"][0] if results.get("distances") else []
+        best: Dict[str, float] = {}
+        for hit_id, metadata, distance in zip(ids, metadatas, distances):
+            parent_id = (metadata or {}).get("parent_id", hit_id)
+            similarity = 1 - distance
+            if parent_id != note_id and similarity > best.get(parent_id, -2.0):
+                best[parent_id] = similarity
+        neighbors = sorted(best.items(), key=lambda item: item[1], reverse=True)
+        # 命中数少于请求数说明集合中的块已全部返回；否则候选块可能被少数多块笔记占满，
+        # 聚合后不足 k 条笔记时扩大候选窗口重新查询
+        exhaustive = len(ids) < n_results
+        if exhaustive or len(neighbors) >= k:
+            return neighbors[:k], exhaustive and len(neighbors) <= k
+        n_results *= 2
+
+
+class KnnGraph:
+    """
+    相关笔记的近邻图缓存
+
+    每条被查询过的笔记缓存其笔记向量和前 k 个近邻。笔记新增或更新时，只用它的块向量与已缓存的
+    笔记向量做一次矩阵乘法，把它插入相似度足够高的近邻列表；删除时只从引用它的近邻列表中移除。
+    笔记自身内容变化时丢弃其缓存，下次查询时重新计算。整个过程不调用嵌入模型。
+    """
+
+    def __init__(self, k: int = RELATED_GRAPH_K, max_entries: int = RELATED_CACHE_SIZE,
+                 ttl: float = RELATED_CACHE_TTL):
+        """
+        Args:
+            k: 每条笔记缓存的近邻数量
+            max_entries: 最多缓存的笔记数量
+            ttl: 缓存的有效期（秒）
+        """
+        self.k = k
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        # 近邻ID -> 近邻列表中包含它的笔记
+        self._referrers: Dict[str, Set[str]] = {}
+        self._collection_name: Optional[str] = None
+        # 每次图发生变化时递增，计算期间图被修改的结果不写入缓存
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clear()
+
+    def _clear(self) -> None:
+        self._entries.clear()
+        self._referrers.clear()
+        self._generation += 1
+
+    def _link(self, note_id: str, neighbors: List[Tuple[str, float]]) -> None:
+        for neighbor_id, _ in neighbors:
+            self._referrers.setdefault(neighbor_id, set()).add(note_id)
+
+    def _unlink(self, note_id: str, neighbor_id: str) -> None:
+        referrers = self._referrers.get(neighbor_id)
+        if referrers is not None:
+            referrers.discard(note_id)
+            if not referrers:
+                del self._referrers[neighbor_id]
+
+    def _drop_entry(self, note_id: str) -> None:
+        entry = self._entries.pop(note_id, None)
+        if entry is not None:
+            for neighbor_id, _ in entry.neighbors:
+                self._unlink(note_id, neighbor_id)
+
+    def _remove_from_neighbors(self, note_id: str) -> None:
+        # 从所有近邻列表中移除该笔记；剩余部分仍是真实排名的前缀，只是变短
+        for referrer in self._referrers.pop(note_id, set()):
+            entry = self._entries.get(referrer)
+            if entry is not None:
+                entry.neighbors = [(n, s) for n, s in entry.neighbors if n != note_id]
+
+    def _store(self, note_id: str, entry: _Entry) -> None:
+        self._drop_entry(note_id)
+        self._entries[note_id] = entry
+        self._link(note_id, entry.neighbors)
+        while len(self._entries) > self.max_entries:
+            self._drop_entry(next(iter(self._entries)))
+
+    def _lookup(self, note_id: str, limit: int) -> Optional[List[Tuple[str, float]]]:
+        entry = self._entries.get(note_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry.created_at > self.ttl:
+            self._drop_entry(note_id)
+            return None
+        if limit > len(entry.neighbors) and not entry.exhaustive:
+            return None
+        self._entries.move_to_end(note_id)
+        return entry.neighbors[:limit]
+
+    def related(self, note_id: str, limit: int = 10) -> Optional[List[Tuple[str, float]]]:
+        """
+        返回与笔记最相似的其它笔记
+
+        Args:
+            note_id: 笔记ID
+            limit: 返回的最大数量
+
+        Returns:
+            按相似度降序排列的 (笔记ID, 相似度)；笔记尚未被索引时返回 None
+        """
+        version = get_active_index()
+        collection = get_index_collection(version)
+        with self._lock:
+            # 切换索引版本（例如重建索引更换模型）后旧的近邻不再有效
+            if version.collection_name != self._collection_name:
+                self._clear()
+                self._collection_name = version.collection_name
+            cached = self._lookup(note_id, limit)
+            if cached is not None:
+                self.hits += 1
+                return cached
+            self.misses += 1
+            generation = self._generation
+
+        chunk_vectors = get_note_chunk_vectors(collection, note_id)
+        if chunk_vectors is None:
+            return None
+        vector = note_vector(chunk_vectors)
+        k = max(self.k, limit)
+        neighbors, exhaustive = _query_neighbors(collection, vector, note_id, k)
+        with self._lock:
+            if generation == self._generation and version.collection_name == self._collection_name:
+                self._store(note_id, _Entry(vector, neighbors[:self.k], exhaustive and len(neighbors) <= self.k,
+                                            time.monotonic()))
+        return neighbors[:limit]
+
+    def apply_changes(self, upserted: List[str], removed: List[str]) -> None:
+        """
+        索引任务完成后增量更新近邻图
+
+        Args:
+            upserted: 新增或更新后已写入向量索引的笔记ID
+            removed: 已从向量索引删除的笔记ID
+        """
+        with self._lock:
+            if not self._entries or (not upserted and not removed):
+                return
+            self._generation += 1
+            for note_id in list(upserted) + list(removed):
+                self._drop_entry(note_id)
+                self._remove_from_neighbors(note_id)
+            if not upserted or not self._entries:
+                return
+            collection_name = self._collection_name
+
+        version = get_active_index()
+        if version.collection_name != collection_name:
+            return
+        collection = get_index_collection(version)
+        changed: List[Tuple[str, np.ndarray]] = []
+        for note_id in upserted:
+            chunk_vectors = get_note_chunk_vectors(collection, note_id)
+            if chunk_vectors is not None:
+                changed.append((note_id, chunk_vectors))
+        if not changed:
+            return
+
+        with self._lock:
+            if self._collection_name != collection_name or not self._entries:
+                return
+            self._generation += 1
+            entry_ids = list(self._entries)
+            cached_vectors = np.stack([self._entries[id].vector for id in entry_ids])
+            for note_id, chunk_vectors in changed:
+                # 与 related() 的查询一致：相似度为笔记向量与该笔记各块向量的最大余弦相似度
+                similarities = (cached_vectors @ chunk_vectors.T).max(axis=1)
+                for entry_id, similarity in zip(entry_ids, similarities.tolist()):
+                    if entry_id != note_id:
+                        self._insert_neighbor(entry_id, note_id, similarity)
+
+    def _insert_neighbor(self, entry_id: str, note_id: str, similarity: float) -> None:
+        entry = self._entries.get(entry_id)
+        if entry is None:
+            return
+        neighbors = entry.neighbors
+        # 列表只是排名前缀时，低于末位的笔记排在前缀之外，不能插入
+        if not entry.exhaustive and (not neighbors or similarity < neighbors[-1][1]):
+            return
+        neighbors.append((note_id, similarity))
+        neighbors.sort(key=lambda item: item[1], reverse=True)
+        self._link(entry_id, [(note_id, similarity)])
+        if len(neighbors) > self.k:
+            for dropped_id, _ in neighbors[self.k:]:
+                self._unlink(entry_id, dropped_id)
+            del neighbors[self.k:]
+            entry.exhaustive = False
+
+
+related_graph = KnnGraph()
+register_cache("related_notes", related_graph.stats)
+
+
+def get_related_notes(note_id: str, limit: int = 10, threshold: float = 0.0) -> Optional[List[Dict[str, Any]]]:
+    """
+    查找与指定笔记相似的笔记，使用已存储的向量与近邻图缓存，不调用嵌入模型
+
+    Args:
+        note_id: 笔记ID
+        limit: 返回结果的最大数量
+        threshold: 相似度阈值
+
+    Returns:
+        与搜索结果格式一致的笔记列表；笔记尚未被索引时返回 None
+    """
+    neighbors = related_graph.related(note_id, limit)
+    if neighbors is None:
+        return None
+    neighbors = [(id, similarity) for id, similarity in neighbors if similarity >= threshold]
+    if not neighbors:
+        return []
+    # 标题和描述保存在头块元数据中；旧版整条笔记向量的 ID 即笔记 ID
+    collection = get_index_collection(get_active_index())
+    with track_stage("vector_get"):
+        fetched = collection.get(ids=[chunk_id(id, 0) for id, _ in neighbors] + [id for id, _ in neighbors],
+                                 include=["metadatas"])
+    metadatas: Dict[str, Dict[str, Any]] = {}
+    for fetched_id, metadata in zip(fetched.get("ids") or [], fetched.get("metadatas") or []):
+        metadata = metadata or {}
+        metadatas.setdefault(metadata.get("parent_id", fetched_id), metadata)
+    return [
+        {
+            "id": id,
+            "metadata": {
+                "title": metadatas.get(id, {}).get("title", ""),
+                "description": metadatas.get(id, {}).get("description", metadatas.get(id, {}).get("text", "")),
+            },
+            "similarity": similarity,
+        }
+        for id, similarity in neighbors
+    ]
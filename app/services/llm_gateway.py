@@ -0,0 +1,242 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+
+from app.services.metrics import LLM_COALESCED, LLM_RETRIES
+
+logger = logging.getLogger(__name__)
+
+# OpenAI 兼容服务的地址、密钥与模型
+LLM_BASE_URL = os.environ.get("API_BASE_URL", "https://api.deepseek.com/v1")
+LLM_API_KEY = os.environ.get("THIRD_PARTY_API_KEY") or None
+LLM_MODEL = os.environ.get("LLM_MODEL", "deepseek-chat")
+
+# 同时在途的 LLM 调用上限，超出的调用排队等待（排队时间计入截止时间）
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "16"))
+# 单次调用（含排队与重试）的截止时间；流式调用为收到首个 token 的截止时间
+LLM_TIMEOUT_SECONDS = float(os.environ.get("LLM_TIMEOUT_SECONDS", "60"))
+LLM_CONNECT_TIMEOUT_SECONDS = float(os.environ.get("LLM_CONNECT_TIMEOUT_SECONDS", "5"))
+# 连接失败、超时、429 与 5xx 时的重试次数，退避时间为 [0, min(上限, 基数 * 2^n)] 内的随机值
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_DELAY = float(os.environ.get("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.environ.get("LLM_RETRY_MAX_DELAY", "8"))
+# 连接池：保持长连接，避免每次调用重新握手 TLS
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", "32"))
+LLM_KEEPALIVE_SECONDS = float(os.environ.get("LLM_KEEPALIVE_SECONDS", "60"))
+
+_RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+def _is_retryable(error: Exception) -> bool:
+    import openai
+
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code in _RETRYABLE_STATUS
+
+
+def _request_key(model: str, messages: List[Dict[str, str]], temperature: float) -> str:
+    payload = json.dumps({"model": model, "messages": messages, "temperature": temperature},
+                         ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMGateway:
+    """
+    LLM 调用网关
+
+    所有调用共用一个带长连接池的异步 HTTP 客户端，并发数由信号量限制，每次调用有
+    截止时间，可重试的错误按带抖动的指数退避重试。内容完全相同的非流式请求在途时
+    只发送一次，其余调用方等待同一个结果。
+    """
+
+    def __init__(
+        self,
+        base_url: str = LLM_BASE_URL,
+        api_key: Optional[str] = LLM_API_KEY,
+        model: str = LLM_MODEL,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        timeout: float = LLM_TIMEOUT_SECONDS,
+        max_retries: int = LLM_MAX_RETRIES,
+        retry_base_delay: float = LLM_RETRY_BASE_DELAY,
+        retry_max_delay: float = LLM_RETRY_MAX_DELAY,
+        http_client: Optional[httpx.AsyncClient] = None,
+    ):
+        """
+        Args:
+            base_url: OpenAI 兼容服务的地址（含 /v1）
+            api_key: API 密钥
+            model: 模型名称
+            max_concurrency: 同时在途的调用上限
+            timeout: 单次调用的截止时间（秒）
+            max_retries: 可重试错误的最大重试次数
+            retry_base_delay: 退避基数（秒）
+            retry_max_delay: 单次退避上限（秒）
+            http_client: 自定义 HTTP 客户端（例如测试时使用的 ASGI 传输），为 None 时创建连接池
+        """
+        # openai SDK 导入较慢，放到创建网关时
+        from openai import AsyncOpenAI
+
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency 必须大于等于 1")
+        if not api_key:
+            logger.warning("未设置 THIRD_PARTY_API_KEY，LLM 调用可能被拒绝")
+        if http_client is None:
+            proxy = os.environ.get("HTTPS_PROXY") or None
+            if proxy:
+                logger.info(f"LLM 调用使用代理: {proxy}")
+            http_client = httpx.AsyncClient(
+                proxy=proxy,
+                timeout=httpx.Timeout(timeout, connect=LLM_CONNECT_TIMEOUT_SECONDS),
+                limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                                    max_keepalive_connections=LLM_MAX_CONNECTIONS,
+                                    keepalive_expiry=LLM_KEEPALIVE_SECONDS),
+            )
+        self.model = model
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self._http_client = http_client
+        # 重试由网关统一处理，SDK 自身不再重试
+        self._client = AsyncOpenAI(base_url=base_url, api_key=api_key or "missing", http_client=http_client,
+                                   max_retries=0)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # 在途的非流式请求：请求键 -> [任务, 等待者数量]
+        self._inflight: Dict[str, list] = {}
+        logger.info(f"LLM 网关已配置: {base_url} (model={model}, max_concurrency={max_concurrency})")
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * (2 ** attempt)))
+
+    async def _call_with_retries(self, deadline: float, **kwargs) -> Any:
+        # 在截止时间内调用 chat.completions.create，返回 SDK 的结果（流式时为流对象）
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"LLM 调用超过截止时间 {self.timeout} 秒")
+            try:
+                return await asyncio.wait_for(self._client.chat.completions.create(timeout=remaining, **kwargs),
+                                              remaining)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"LLM 调用超过截止时间 {self.timeout} 秒")
+            except Exception as e:
+                delay = self._backoff(attempt)
+                if attempt >= self.max_retries or not _is_retryable(e) or time.monotonic() + delay >= deadline:
+                    raise
+                attempt += 1
+                LLM_RETRIES.inc()
+                logger.warning(f"LLM 调用失败，{delay:.2f} 秒后第 {attempt} 次重试: {e}")
+                await asyncio.sleep(delay)
+
+    async def _acquire(self, deadline: float) -> None:
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"等待 LLM 并发额度超过截止时间 {self.timeout} 秒")
+
+    async def _complete(self, messages: List[Dict[str, str]], temperature: float) -> str:
+        deadline = time.monotonic() + self.timeout
+        await self._acquire(deadline)
+        try:
+            completion = await self._call_with_retries(deadline, model=self.model, messages=messages,
+                                                       temperature=temperature)
+        finally:
+            self._semaphore.release()
+        return (completion.choices[0].message.content or "").strip()
+
+    async def complete(self, messages: List[Dict[str, str]], temperature: float = 0.7) -> str:
+        """
+        生成完整回答，相同请求在途时合并为一次调用
+
+        Args:
+            messages: 消息列表
+            temperature: 采样温度
+
+        Returns:
+            回答文本
+        """
+        key = _request_key(self.model, messages, temperature)
+        entry = self._inflight.get(key)
+        if entry is None:
+            task = asyncio.ensure_future(self._complete(messages, temperature))
+            entry = self._inflight[key] = [task, 0]
+            task.add_done_callback(lambda _: self._inflight.pop(key, None) if self._inflight.get(key) is entry else None)
+        else:
+            LLM_COALESCED.inc()
+        task = entry[0]
+        entry[1] += 1
+        try:
+            # shield：单个调用方取消（如客户端断开）不影响其它等待同一结果的调用方
+            return await asyncio.shield(task)
+        finally:
+            entry[1] -= 1
+            # 所有等待者都已离开时取消上游调用
+            if entry[1] == 0 and not task.done():
+                if self._inflight.get(key) is entry:
+                    del self._inflight[key]
+                task.cancel()
+
+    async def stream(self, messages: List[Dict[str, str]], temperature: float = 0.7) -> AsyncIterator[str]:
+        """
+        流式生成回答，逐段返回内容；截止时间只约束到开始返回为止
+
+        生成过程中一直占用一个并发额度，调用方停止迭代（或关闭生成器）时关闭上游连接。
+
+        Args:
+            messages: 消息列表
+            temperature: 采样温度
+        """
+        deadline = time.monotonic() + self.timeout
+        await self._acquire(deadline)
+        stream = None
+        try:
+            stream = await self._call_with_retries(deadline, model=self.model, messages=messages,
+                                                   temperature=temperature, stream=True)
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                content = chunk.choices[0].delta.content
+                if content:
+                    yield content
+        finally:
+            if stream is not None:
+                await stream.close()
+            self._semaphore.release()
+
+    async def aclose(self) -> None:
+        """关闭连接池"""
+        await self._http_client.aclose()
+
+
+_gateway: Optional[LLMGateway] = None
+
+
+def get_llm_gateway() -> LLMGateway:
+    """获取共享的 LLM 网关，首次调用时按环境变量创建"""
+    global _gateway
+    if _gateway is None:
+        _gateway = LLMGateway()
+    return _gateway
+
+
+def set_llm_gateway(gateway: LLMGateway) -> None:
+    """替换共享的 LLM 网关（基准测试与本地桩服务使用）"""
+    global _gateway
+    _gateway = gateway
+
+
+async def close_llm_gateway() -> None:
+    """关闭共享网关的连接池"""
+    global _gateway
+    if _gateway is not None:
+        gateway, _gateway = _gateway, None
+        await gateway.aclose()
@@ -0,0 +1,287 @@
+import bisect
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+# 耗时直方图的默认分桶（秒），覆盖从缓存命中到 LLM 调用的范围
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# 批大小直方图的分桶
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+# Prometheus 文本格式的 Content-Type
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+# 采集器在抓取时返回的样本：(指标名, 类型, 说明, [(标签, 值), ...])
+CollectedMetric = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _escape_help(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(str(value))}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(ABC):
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 的标签应为 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {_escape_help(self.help)}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self._render_samples())
+        return lines
+
+    @abstractmethod
+    def _render_samples(self) -> Iterable[str]:
+        """返回指标的样本行（不含 HELP 和 TYPE）"""
+
+
+class Counter(_Metric):
+    """单调递增的计数器"""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _render_samples(self) -> Iterable[str]:
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self._labels(key))} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    """分桶直方图，用于耗时和批大小，分位数由 Prometheus 端按分桶估算"""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 每组标签：[各分桶计数（非累计，最后一项为 +Inf）, 总和, 次数]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """记录 with 块的耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self, **labels) -> Optional[Dict[str, float]]:
+        """返回一组标签的次数与总和，没有观测值时返回 None"""
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return {"count": state[2], "sum": state[1]} if state else None
+
+    def snapshots(self) -> List[Tuple[Dict[str, str], Dict[str, float]]]:
+        """返回所有标签组合的次数与总和"""
+        with self._lock:
+            return [(self._labels(key), {"count": state[2], "sum": state[1]}) for key, state in self._values.items()]
+
+    def _render_samples(self) -> Iterable[str]:
+        with self._lock:
+            values = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        for key, counts, total, count in values:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_format_labels({**labels, 'le': _format_value(float(bound))})} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(labels)} {count}"
+
+
+class MetricsRegistry:
+    """进程内的指标注册表，按 Prometheus 文本格式输出"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Iterable[CollectedMetric]]] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"指标已注册: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def register_collector(self, collector: Callable[[], Iterable[CollectedMetric]]) -> None:
+        """注册一个在抓取时才计算样本的采集器（用于缓存统计等已有计数的对象）"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        # 同名的采集样本合并到一个 HELP/TYPE 下
+        collected: Dict[str, CollectedMetric] = {}
+        for collector in collectors:
+            for name, type, help, samples in collector():
+                if name in collected:
+                    collected[name][3].extend(samples)
+                else:
+                    collected[name] = (name, type, help, list(samples))
+        for name, type, help, samples in collected.values():
+            lines.append(f"# HELP {name} {_escape_help(help)}")
+            lines.append(f"# TYPE {name} {type}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+def counter(name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+    """创建并注册一个计数器"""
+    return REGISTRY.register(Counter(name, help, labelnames))
+
+
+def histogram(name: str, help: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS) -> Histogram:
+    """创建并注册一个直方图"""
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
+
+
+def render_metrics() -> str:
+    """以 Prometheus 文本格式输出所有指标"""
+    return REGISTRY.render()
+
+
+# --- 应用指标 ---
+
+STAGE_DURATION = histogram(
+    "lmnotes_stage_duration_seconds",
+    "Duration of each processing stage (embed, vector_query, vector_upsert, mongo, llm, context_build, ...)",
+    ("stage",)
+)
+STAGE_ERRORS = counter("lmnotes_stage_errors_total", "Number of failed calls per processing stage", ("stage",))
+BATCH_SIZE = histogram("lmnotes_batch_size", "Number of items per batch", ("batch",), buckets=BATCH_SIZE_BUCKETS)
+HTTP_REQUEST_DURATION = histogram(
+    "lmnotes_http_request_duration_seconds",
+    "HTTP request duration by route template",
+    ("method", "route", "status")
+)
+MONGO_COMMAND_DURATION = histogram(
+    "lmnotes_mongo_command_duration_seconds",
+    "MongoDB command duration by command name",
+    ("command",)
+)
+MONGO_COMMAND_ERRORS = counter("lmnotes_mongo_command_errors_total", "Failed MongoDB commands", ("command",))
+LLM_RETRIES = counter("lmnotes_llm_retries_total", "LLM calls retried after a retryable error")
+LLM_COALESCED = counter("lmnotes_llm_coalesced_total", "LLM calls served by an identical in-flight request")
+
+
+@contextmanager
+def track_stage(stage: str) -> Iterator[None]:
+    """
+    记录一个处理阶段的耗时，阶段抛出异常时同时计入错误次数
+
+    Args:
+        stage: 阶段名称
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - start, stage=stage)
+
+
+def observe_batch(batch: str, size: int) -> None:
+    """记录一次批处理的大小"""
+    BATCH_SIZE.observe(size, batch=batch)
+
+
+def register_cache(name: str, stats: Callable[[], Dict[str, float]]) -> None:
+    """
+    导出一个缓存的命中/未命中次数与当前大小
+
+    Args:
+        name: 缓存名称（cache 标签）
+        stats: 返回包含 hits、misses、size 的字典的函数
+    """
+    def collect() -> Iterable[CollectedMetric]:
+        values = stats()
+        labels = {"cache": name}
+        yield "lmnotes_cache_hits_total", "counter", "Cache hits", [(labels, values["hits"])]
+        yield "lmnotes_cache_misses_total", "counter", "Cache misses", [(labels, values["misses"])]
+        yield "lmnotes_cache_entries", "gauge", "Current number of cache entries", [(labels, values["size"])]
+    REGISTRY.register_collector(collect)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """记录每个 MongoDB 命令的耗时（同步与异步客户端共用）"""
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        pass
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        MONGO_COMMAND_DURATION.observe(event.duration_micros / 1e6, command=event.command_name)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        MONGO_COMMAND_DURATION.observe(event.duration_micros / 1e6, command=event.command_name)
+        MONGO_COMMAND_ERRORS.inc(command=event.command_name)
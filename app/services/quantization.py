@@ -0,0 +1,187 @@
+import os
+from typing import Callable, Optional
+
+import numpy as np
+
+# 向量压缩参数，可通过环境变量调整
+# 压缩方式："none"、"int8"（标量量化）、"pca"（降维）或 "pca-int8"（先降维再量化）
+DEFAULT_COMPRESSION = os.environ.get("VECTOR_STORE_COMPRESSION", "none").lower()
+DEFAULT_PCA_DIM = int(os.environ.get("VECTOR_STORE_PCA_DIM", "192"))
+# 压缩向量粗排时取 k 的多少倍候选，再用原始 float32 向量精排
+DEFAULT_RESCORE_FACTOR = int(os.environ.get("VECTOR_STORE_RESCORE_FACTOR", "4"))
+# 拟合 PCA 和量化范围时最多使用的样本数
+_MAX_FIT_SAMPLES = 20000
+# 分块计算粗排得分，限制 int8 转 float32 时的临时内存
+_SCORE_BLOCK_ROWS = 65536
+
+COMPRESSION_MODES = ("none", "int8", "pca", "pca-int8")
+# 配置错误时在启动时失败，而不是等到向量数量达到拟合阈值后每次写入都失败
+if DEFAULT_COMPRESSION not in COMPRESSION_MODES:
+    raise ValueError(f"不支持的向量压缩方式: {DEFAULT_COMPRESSION}（可选: {', '.join(COMPRESSION_MODES)}）")
+
+
+class VectorCodec:
+    """
+    向量压缩编码：可选的 PCA 降维加可选的逐维 int8 标量量化
+
+    编码后的向量只用于粗排（近似内积），精排使用原始的 float32 向量。
+    """
+
+    def __init__(self, mode: str, mean: Optional[np.ndarray] = None, components: Optional[np.ndarray] = None,
+                 scale: Optional[np.ndarray] = None):
+        """
+        Args:
+            mode: 压缩方式，见 COMPRESSION_MODES
+            mean: PCA 的均值向量
+            components: PCA 的投影矩阵（目标维度 x 原始维度）
+            scale: 每一维的量化步长
+        """
+        if mode not in COMPRESSION_MODES or mode == "none":
+            raise ValueError(f"不支持的压缩方式: {mode}")
+        self.mode = mode
+        self.mean = mean
+        self.components = components
+        self.scale = scale
+
+    @classmethod
+    def fit(cls, vectors: np.ndarray, mode: str, pca_dim: int = DEFAULT_PCA_DIM, seed: int = 0) -> "VectorCodec":
+        """
+        在样本向量上拟合编码参数
+
+        Args:
+            vectors: 样本向量（n x d，已归一化）
+            mode: 压缩方式
+            pca_dim: PCA 的目标维度
+            seed: 采样随机种子
+
+        Returns:
+            拟合好的 VectorCodec
+        """
+        if len(vectors) > _MAX_FIT_SAMPLES:
+            rows = np.random.default_rng(seed).choice(len(vectors), _MAX_FIT_SAMPLES, replace=False)
+            vectors = vectors[np.sort(rows)]
+        sample = np.asarray(vectors, dtype=np.float32)
+        codec = cls(mode)
+        if mode.startswith("pca"):
+            codec.mean = sample.mean(axis=0)
+            # 右奇异向量即主成分方向，按奇异值从大到小排列
+            _, _, vt = np.linalg.svd(sample - codec.mean, full_matrices=False)
+            codec.components = np.ascontiguousarray(vt[:min(pca_dim, vt.shape[0])], dtype=np.float32)
+            sample = codec.project(sample)
+        if mode.endswith("int8"):
+            # 逐维对称量化，步长取该维绝对值的 99.9 分位数，少量离群值被截断
+            bound = np.quantile(np.abs(sample), 0.999, axis=0)
+            codec.scale = (np.maximum(bound, 1e-6) / 127.0).astype(np.float32)
+        return codec
+
+    @property
+    def dim(self) -> Optional[int]:
+        """编码后的维度（未降维时为 None，即与原始维度一致）"""
+        return self.components.shape[0] if self.components is not None else None
+
+    def project(self, vectors: np.ndarray) -> np.ndarray:
+        """PCA 投影（未启用 PCA 时原样返回）"""
+        if self.components is None:
+            return np.asarray(vectors, dtype=np.float32)
+        return ((np.asarray(vectors, dtype=np.float32) - self.mean) @ self.components.T).astype(np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """编码向量，返回 int8 或 float32 数组"""
+        projected = self.project(vectors)
+        if self.scale is None:
+            return projected
+        return np.clip(np.rint(projected / self.scale), -127, 127).astype(np.int8)
+
+    def encode_queries(self, queries: np.ndarray) -> np.ndarray:
+        """
+        编码查询向量，使 codes @ encoded_queries.T 近似原始内积
+
+        量化步长并入查询一侧，粗排时不需要反量化整块编码。PCA 投影时省略了
+        均值项，对同一查询的所有候选相差同一个常数，不影响排序。
+        """
+        projected = np.asarray(queries, dtype=np.float32)
+        if self.components is not None:
+            projected = projected @ self.components.T
+        if self.scale is not None:
+            projected = projected * self.scale
+        return projected.astype(np.float32)
+
+    def bytes_per_vector(self, full_dim: int) -> int:
+        """每个编码向量占用的字节数"""
+        dim = self.dim or full_dim
+        return dim * (1 if self.scale is not None else 4)
+
+    def save(self, path: str) -> None:
+        arrays = {"mode": np.array(self.mode)}
+        for name in ("mean", "components", "scale"):
+            if getattr(self, name) is not None:
+                arrays[name] = getattr(self, name)
+        with open(path, "wb") as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "VectorCodec":
+        with np.load(path) as data:
+            return cls(str(data["mode"]), **{name: data[name] for name in ("mean", "components", "scale") if name in data})
+
+
+def approximate_scores(codes: np.ndarray, encoded_queries: np.ndarray) -> np.ndarray:
+    """
+    分块计算编码向量与查询的近似内积
+
+    Args:
+        codes: 编码向量（n x d'）
+        encoded_queries: VectorCodec.encode_queries 的结果（q x d'）
+
+    Returns:
+        近似得分矩阵（q x n）
+    """
+    scores = np.empty((len(encoded_queries), len(codes)), dtype=np.float32)
+    for start in range(0, len(codes), _SCORE_BLOCK_ROWS):
+        block = codes[start:start + _SCORE_BLOCK_ROWS].astype(np.float32, copy=False)
+        scores[:, start:start + len(block)] = encoded_queries @ block.T
+    return scores
+
+
+def rescore_top_k(scores: np.ndarray, k: int, rescore_factor: int, exact: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+    """
+    用近似得分取候选，再用精确得分重排
+
+    Args:
+        scores: 单个查询的近似得分（n），无效行应为 -inf
+        k: 返回数量
+        rescore_factor: 候选数量为 k 的倍数
+        exact: 输入候选行号、返回其精确得分的函数
+
+    Returns:
+        按精确得分降序排列的 top-k 行号
+    """
+    valid = int(np.isfinite(scores).sum())
+    k = min(k, valid)
+    if k == 0:
+        return np.zeros(0, dtype=np.int64)
+    candidates = min(valid, max(k, k * rescore_factor))
+    rows = np.argpartition(-scores, candidates - 1)[:candidates]
+    rows = rows[np.isfinite(scores[rows])]
+    exact_scores = exact(rows)
+    order = np.argsort(-exact_scores)[:k]
+    return rows[order]
+
+
+def recall_at_k(exact_ids, approximate_ids) -> float:
+    """
+    计算近似检索相对精确检索的平均召回率
+
+    Args:
+        exact_ids: 每个查询的精确 top-k 结果
+        approximate_ids: 每个查询的近似 top-k 结果
+
+    Returns:
+        召回率（0~1）
+    """
+    total, hit = 0, 0
+    for exact, approximate in zip(exact_ids, approximate_ids):
+        exact = set(exact)
+        total += len(exact)
+        hit += len(exact & set(approximate))
+    return hit / total if total else 1.0
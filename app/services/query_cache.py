@@ -0,0 +1,83 @@
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+# 查询嵌入缓存参数，可通过环境变量调整
+DEFAULT_MAX_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", "1024"))
+DEFAULT_TTL_SECONDS = float(os.environ.get("QUERY_CACHE_TTL", "3600"))
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    """规范化查询文本：统一全半角、去除首尾空白并合并连续空白"""
+    return _WHITESPACE_RE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+class QueryEmbeddingCache:
+    """
+    线程安全的查询嵌入 LRU 缓存，支持条目过期时间
+
+    以 (模型名, 规范化查询文本) 为键，超过 max_size 时淘汰最久未使用的条目，
+    超过 ttl_seconds 的条目视为未命中。
+    """
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE, ttl_seconds: float = DEFAULT_TTL_SECONDS):
+        """
+        Args:
+            max_size: 最多缓存的条目数量，为 0 时禁用缓存
+            ttl_seconds: 条目有效期（秒），小于等于 0 表示永不过期
+        """
+        self.max_size = max(max_size, 0)
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, List[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, model_name: str, query: str) -> Optional[List[float]]:
+        """查找缓存的嵌入向量，未命中或已过期时返回 None"""
+        key = (model_name, query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl_seconds > 0 and time.monotonic() - entry[0] > self.ttl_seconds:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, model_name: str, query: str, embedding: List[float]) -> None:
+        """写入一条嵌入向量"""
+        if self.max_size == 0:
+            return
+        key = (model_name, query)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """清空缓存（计数器保留）"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        """返回命中/未命中次数、命中率和当前条目数"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+            }
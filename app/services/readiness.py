@@ -0,0 +1,142 @@
+import asyncio
+import importlib
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from app.config.chroma_db import check_vector_store, get_active_index, get_index_collection
+from app.config.db import async_mongo_client, ensure_indexes
+from app.services.executor import run_blocking
+from app.services.index_outbox import start_index_workers
+from app.services.keyword_index import get_keyword_index, start_keyword_sync
+from app.services.reconciler import start_reconciler
+from app.services.reindex import resume_reindex_jobs
+from app.services.semantic_search import embed_text
+
+logger = logging.getLogger(__name__)
+
+# 依赖初始化失败后的重试间隔：从 1 秒开始翻倍，不超过该上限
+STARTUP_RETRY_MAX_DELAY = float(os.environ.get("STARTUP_RETRY_MAX_DELAY", "30"))
+# 就绪探针中每项实时检查的超时时间（秒）
+READINESS_CHECK_TIMEOUT = float(os.environ.get("READINESS_CHECK_TIMEOUT", "2"))
+# 启动后在后台编码一次，提前加载嵌入模型（或确认共享嵌入服务可用）
+EMBEDDING_WARM_UP = os.environ.get("EMBEDDING_WARM_UP", "true").lower() == "true"
+
+# 就绪前必须完成初始化的依赖
+REQUIRED_COMPONENTS = ("mongo", "vector_store", "embedding_model")
+
+# 每个依赖的初始化状态：ready、attempts、error、ready_at
+_components: Dict[str, Dict[str, Any]] = {}
+_started_at = time.monotonic()
+
+
+def _set_state(name: str, **state: Any) -> None:
+    _components.setdefault(name, {"ready": False, "attempts": 0, "error": None})
+    _components[name].update(state)
+
+
+async def _initialize_with_retry(name: str, init: Callable[[], Awaitable[Any]]) -> None:
+    """反复执行初始化直到成功，失败之间按指数退避等待"""
+    delay = 1.0
+    _set_state(name)
+    while True:
+        _components[name]["attempts"] += 1
+        try:
+            await init()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            _set_state(name, error=str(e))
+            logger.warning(f"初始化 {name} 失败，{delay:.0f} 秒后重试: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, STARTUP_RETRY_MAX_DELAY)
+            continue
+        _set_state(name, ready=True, error=None, ready_at=round(time.monotonic() - _started_at, 3))
+        logger.info(f"{name} 已就绪")
+        return
+
+
+async def _init_mongo() -> None:
+    await ensure_indexes()
+    # 后台任务依赖 MongoDB，连接可用后再启动
+    start_index_workers()
+    start_reconciler()
+    await resume_reindex_jobs()
+
+
+async def _init_vector_store() -> None:
+    # 连接向量库并打开当前索引版本的集合（本地向量库会在此加载数据文件）
+    await run_blocking(lambda: get_index_collection(get_active_index()))
+
+
+async def _init_embedding_model() -> None:
+    if EMBEDDING_WARM_UP:
+        version = await run_blocking(get_active_index)
+        await run_blocking(embed_text, "warm up", version.model_name)
+
+
+async def _load_keyword_index() -> None:
+    if await run_blocking(get_keyword_index) is None:
+        raise RuntimeError("关键词索引加载失败")
+    # 其它进程写入的笔记靠增量同步进入本进程的索引
+    start_keyword_sync()
+
+
+async def _preload_llm_client() -> None:
+    # 提前导入 openai SDK 并创建连接池，避免第一个问答请求承担这部分耗时
+    from app.services.llm_gateway import get_llm_gateway
+
+    await run_blocking(importlib.import_module, "openai")
+    get_llm_gateway()
+
+
+async def initialize_dependencies() -> None:
+    """
+    在后台初始化外部依赖（应用启动后立即可以响应请求）
+
+    MongoDB 可用后启动索引工作协程、一致性检查并继续重建任务；之后并行连接向量库、
+    预热嵌入模型、加载关键词索引和 LLM 客户端。每一项失败时都会退避重试，直到成功或应用关闭。
+    """
+    for name in REQUIRED_COMPONENTS:
+        _set_state(name)
+    await _initialize_with_retry("mongo", _init_mongo)
+    await asyncio.gather(
+        _initialize_with_retry("vector_store", _init_vector_store),
+        _initialize_with_retry("embedding_model", _init_embedding_model),
+        _initialize_with_retry("keyword_index", _load_keyword_index),
+        _initialize_with_retry("llm_client", _preload_llm_client),
+    )
+
+
+async def _check(check: Callable[[], Awaitable[Any]]) -> Optional[str]:
+    # 返回 None 表示检查通过，否则返回错误信息
+    try:
+        await asyncio.wait_for(check(), READINESS_CHECK_TIMEOUT)
+        return None
+    except asyncio.TimeoutError:
+        return f"超过 {READINESS_CHECK_TIMEOUT} 秒未响应"
+    except Exception as e:
+        return str(e) or type(e).__name__
+
+
+async def check_readiness() -> Dict[str, Any]:
+    """
+    检查应用是否可以处理请求
+
+    必需依赖都已完成初始化，并且 MongoDB 与向量库此刻都能响应时才算就绪。
+
+    Returns:
+        包含 ready 以及每个依赖状态的字典
+    """
+    checks: Dict[str, Dict[str, Any]] = {}
+    for name, state in _components.items():
+        checks[name] = {"ready": state["ready"], "attempts": state["attempts"], "error": state["error"]}
+    if checks.get("mongo", {}).get("ready"):
+        error = await _check(lambda: async_mongo_client.admin.command("ping"))
+        checks["mongo"].update(ready=error is None, error=error)
+    if checks.get("vector_store", {}).get("ready"):
+        error = await _check(lambda: run_blocking(check_vector_store))
+        checks["vector_store"].update(ready=error is None, error=error)
+    ready = all(checks.get(name, {}).get("ready") for name in REQUIRED_COMPONENTS)
+    return {"ready": ready, "components": checks}
@@ -0,0 +1,284 @@
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from app.config.chroma_db import get_active_index, get_index_collection
+from app.config.db import async_mongo_client
+from app.services.executor import run_blocking
+from app.services.index_outbox import OP_DELETE, OP_UPSERT, enqueue_index_tasks, outbox_collection
+from app.services.semantic_search import chunk_id, compute_content_hash
+
+logger = logging.getLogger(__name__)
+
+# 一致性检查参数，可通过环境变量调整（RECONCILE_INTERVAL_SECONDS 为 0 时不启动定时检查）
+RECONCILE_INTERVAL_SECONDS = float(os.environ.get("RECONCILE_INTERVAL_SECONDS", "300"))
+# 每轮全量巡检的笔记数和索引条目数；一次完整巡检分摊到多轮中完成
+RECONCILE_SWEEP_BATCH = int(os.environ.get("RECONCILE_SWEEP_BATCH", "1000"))
+# 增量检查时水位线向前回退的秒数，覆盖与上一轮同时提交的写入
+RECONCILE_WATERMARK_OVERLAP_SECONDS = float(os.environ.get("RECONCILE_WATERMARK_OVERLAP_SECONDS", "60"))
+RECONCILE_LEASE_SECONDS = float(os.environ.get("RECONCILE_LEASE_SECONDS", "300"))
+
+db = async_mongo_client.notes
+notes_collection = db.notes
+tombstones_collection = db.note_tombstones
+# 检查进度（水位线和巡检游标），多个进程之间通过租约保证同一时间只有一个在执行
+reconcile_state = db.reconcile_state
+_STATE_ID = "notes"
+
+_worker_id = f"{socket.gethostname()}:{os.getpid()}"
+_task: Optional[asyncio.Task] = None
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    # MongoDB 返回的是不带时区的 UTC 时间
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+async def _pending_ids(note_ids: List[str]) -> Set[str]:
+    """返回已有待处理索引任务的笔记，这些笔记正在同步中，不需要修复"""
+    docs = await outbox_collection.find({"_id": {"$in": note_ids}}, {"_id": 1}).to_list(length=None)
+    return {doc["_id"] for doc in docs}
+
+
+async def _check_notes(collection, notes: List[Dict[str, Any]], stats: Dict[str, int]) -> List[str]:
+    """比较笔记内容哈希与索引中头块记录的哈希，返回缺失或过期的笔记ID"""
+    if not notes:
+        return []
+    ids = [str(note["_id"]) for note in notes]
+    heads = await run_blocking(collection.get, ids=[chunk_id(id, 0) for id in ids], include=["metadatas"])
+    indexed_hashes = {
+        metadata["parent_id"]: metadata.get("content_hash")
+        for metadata in heads.get("metadatas") or [] if metadata and "parent_id" in metadata
+    }
+    repair = []
+    for id, note in zip(ids, notes):
+        if id not in indexed_hashes:
+            stats["missing"] += 1
+            repair.append(id)
+        elif indexed_hashes[id] != compute_content_hash(note.get("title", ""), note.get("description", "")):
+            stats["stale"] += 1
+            repair.append(id)
+    stats["checked_notes"] += len(notes)
+    return repair
+
+
+async def _still_indexed(collection, note_ids: List[str], stats: Dict[str, int]) -> List[str]:
+    """返回已删除但仍留在索引中的笔记ID（检查头块和旧版整条笔记向量）"""
+    if not note_ids:
+        return []
+    ids = [chunk_id(id, 0) for id in note_ids] + note_ids
+    found = await run_blocking(collection.get, ids=ids, include=[])
+    present = set(found.get("ids") or [])
+    leftovers = [id for id in note_ids if id in present or chunk_id(id, 0) in present]
+    stats["deleted"] += len(leftovers)
+    return leftovers
+
+
+async def _pages(collection, field: str, since: datetime, until: datetime,
+                 projection: Dict[str, int]) -> AsyncIterator[List[Dict[str, Any]]]:
+    """按 (field, _id) 分页读取 since <= field < until 的文档，每页 RECONCILE_SWEEP_BATCH 条"""
+    query: Dict[str, Any] = {field: {"$gte": since, "$lt": until}}
+    while True:
+        page = await collection.find(query, {**projection, field: 1}).sort([(field, 1), ("_id", 1)]).limit(RECONCILE_SWEEP_BATCH).to_list(length=RECONCILE_SWEEP_BATCH)
+        if page:
+            yield page
+        if len(page) < RECONCILE_SWEEP_BATCH:
+            return
+        last = page[-1]
+        query = {
+            field: {"$lt": until},
+            "$or": [{field: {"$gt": last[field]}}, {field: last[field], "_id": {"$gt": last["_id"]}}],
+        }
+
+
+async def _enqueue_repairs(repair: Set[str], remove: Set[str], stats: Dict[str, int]) -> None:
+    """将需要修复和删除的笔记写入索引发件箱，已有待处理任务的笔记正在同步，跳过"""
+    pending = await _pending_ids(list(repair | remove))
+    repair = repair - pending
+    remove = remove - pending - repair
+    await enqueue_index_tasks(sorted(repair), OP_UPSERT)
+    await enqueue_index_tasks(sorted(remove), OP_DELETE)
+    stats["repaired"] += len(repair)
+    stats["removed"] += len(remove)
+
+
+async def _advance(fields: Dict[str, Any]) -> None:
+    """保存检查进度并续期租约"""
+    result = await reconcile_state.update_one(
+        {"_id": _STATE_ID, "owner": _worker_id},
+        {"$set": {**fields, "lease_until": _now() + timedelta(seconds=RECONCILE_LEASE_SECONDS)}}
+    )
+    if result.matched_count == 0:
+        raise RuntimeError("一致性检查的租约已丢失")
+
+
+async def _check_changes(collection, state: Dict[str, Any], now: datetime, stats: Dict[str, int]) -> None:
+    """
+    增量检查水位线之后、本轮开始之前修改过的笔记和删除的笔记
+
+    按 (时间, _id) 分页读取，每页比较、写入发件箱后立即推进对应的水位线，
+    批量导入或长时间停机后也不会一次读取全部变化；中断后从已保存的水位线继续。
+    """
+    watermark = _as_utc(state.get("watermark"))
+    overlap = timedelta(seconds=RECONCILE_WATERMARK_OVERLAP_SECONDS)
+    async for page in _pages(notes_collection, "updated_at", watermark - overlap, now, {"title": 1, "description": 1}):
+        await _enqueue_repairs(set(await _check_notes(collection, page, stats)), set(), stats)
+        await _advance({"watermark": page[-1]["updated_at"]})
+
+    tombstone_watermark = _as_utc(state.get("tombstone_watermark")) or watermark
+    async for page in _pages(tombstones_collection, "deleted_at", tombstone_watermark - overlap, now, {}):
+        await _enqueue_repairs(set(), set(await _still_indexed(collection, [doc["_id"] for doc in page], stats)), stats)
+        await _advance({"tombstone_watermark": page[-1]["deleted_at"]})
+
+
+async def _find_orphans(collection, offset: int, stats: Dict[str, int]) -> Tuple[List[str], int]:
+    """
+    读取一页索引条目，返回其中在 MongoDB 中已不存在的笔记ID以及下一页的偏移量
+
+    偏移量回到 0 表示已遍历完整个索引。
+    """
+    page = await run_blocking(collection.get, include=["metadatas"], limit=RECONCILE_SWEEP_BATCH, offset=offset)
+    ids = page.get("ids") or []
+    metadatas = page.get("metadatas") or [None] * len(ids)
+    # 旧版整条笔记向量没有 parent_id，其 ID 即笔记 ID
+    parents = {(metadata or {}).get("parent_id", id) for id, metadata in zip(ids, metadatas)}
+    stats["checked_index_entries"] += len(ids)
+    valid = [ObjectId(parent) for parent in parents if ObjectId.is_valid(parent)]
+    existing = {str(doc["_id"]) for doc in await notes_collection.find({"_id": {"$in": valid}}, {"_id": 1}).to_list(length=None)}
+    orphans = [parent for parent in parents if parent not in existing]
+    stats["orphans"] += len(orphans)
+    next_offset = offset + len(ids) if len(ids) == RECONCILE_SWEEP_BATCH else 0
+    return orphans, next_offset
+
+
+async def reconcile_once() -> Optional[Dict[str, Any]]:
+    """
+    执行一轮 MongoDB 与向量索引的一致性检查，只修复有差异的笔记
+
+    每轮包含三部分：
+    1. 增量检查：水位线之后修改过的笔记（updated_at）和删除的笔记（墓碑）；
+    2. 笔记巡检：按 _id 顺序检查一批笔记，覆盖没有 updated_at 的旧笔记和之前漏掉的修改；
+    3. 索引巡检：分页读取一批索引条目，找出 MongoDB 中已不存在的孤儿向量。
+    比较只用内容哈希，不生成嵌入；需要修复的笔记写入索引发件箱，由后台工作协程
+    重新嵌入（只嵌入变化的块）或删除。
+
+    Returns:
+        本轮的统计信息；其它进程正在执行检查时返回 None
+    """
+    now = _now()
+    await reconcile_state.update_one(
+        {"_id": _STATE_ID},
+        {"$setOnInsert": {"watermark": None, "sweep_after": None, "index_offset": 0}},
+        upsert=True
+    )
+    state = await reconcile_state.find_one_and_update(
+        {"_id": _STATE_ID, "$or": [{"lease_until": {"$exists": False}}, {"lease_until": {"$lt": now}}]},
+        {"$set": {"owner": _worker_id, "lease_until": now + timedelta(seconds=RECONCILE_LEASE_SECONDS)}},
+        return_document=ReturnDocument.AFTER
+    )
+    if state is None:
+        return None
+    try:
+        return await _reconcile(state, now)
+    except Exception:
+        await reconcile_state.update_one({"_id": _STATE_ID, "owner": _worker_id}, {"$unset": {"owner": "", "lease_until": ""}})
+        raise
+
+
+async def _reconcile(state: Dict[str, Any], now: datetime) -> Dict[str, Any]:
+    stats = {"checked_notes": 0, "checked_index_entries": 0, "missing": 0, "stale": 0, "orphans": 0, "deleted": 0,
+             "repaired": 0, "removed": 0}
+    collection = await run_blocking(get_index_collection, await run_blocking(get_active_index))
+    repair: Set[str] = set()
+    remove: Set[str] = set()
+
+    # 1. 增量检查
+    watermark = _as_utc(state.get("watermark"))
+    if watermark is not None:
+        await _check_changes(collection, state, now, stats)
+
+    # 2. 笔记巡检
+    sweep_after = state.get("sweep_after")
+    query = {"_id": {"$gt": sweep_after}} if sweep_after is not None else {}
+    batch = await notes_collection.find(query, {"title": 1, "description": 1, "updated_at": 1}).sort("_id", 1).limit(RECONCILE_SWEEP_BATCH).to_list(length=RECONCILE_SWEEP_BATCH)
+    # 增量检查已经比较过的笔记不再重复比较
+    if watermark is not None:
+        since = watermark - timedelta(seconds=RECONCILE_WATERMARK_OVERLAP_SECONDS)
+        batch_to_check = [note for note in batch if not (note.get("updated_at") and since <= _as_utc(note["updated_at"]) < now)]
+    else:
+        batch_to_check = batch
+    repair.update(await _check_notes(collection, batch_to_check, stats))
+    next_sweep_after = batch[-1]["_id"] if len(batch) == RECONCILE_SWEEP_BATCH else None
+
+    # 3. 索引巡检
+    orphans, next_index_offset = await _find_orphans(collection, state.get("index_offset", 0), stats)
+    remove.update(orphans)
+
+    await _enqueue_repairs(repair, remove, stats)
+
+    # 所有在本轮开始前提交的变化都已检查，水位线推进到本轮开始时间
+    await reconcile_state.update_one(
+        {"_id": _STATE_ID, "owner": _worker_id},
+        {
+            "$set": {
+                "watermark": now,
+                "tombstone_watermark": now,
+                "sweep_after": next_sweep_after,
+                "index_offset": next_index_offset,
+                "last_run_at": now,
+                "last_stats": stats,
+            },
+            "$unset": {"owner": "", "lease_until": ""},
+        }
+    )
+    if stats["repaired"] or stats["removed"]:
+        logger.info(f"一致性检查完成，修复 {stats['repaired']} 条笔记，删除 {stats['removed']} 条孤儿/已删除笔记的向量: {stats}")
+    return stats
+
+
+async def get_reconcile_status() -> Optional[Dict[str, Any]]:
+    """返回上一轮一致性检查的时间、统计信息和巡检进度"""
+    state = await reconcile_state.find_one({"_id": _STATE_ID})
+    if state is not None and state.get("sweep_after") is not None:
+        state["sweep_after"] = str(state["sweep_after"])
+    return state
+
+
+async def _reconcile_loop(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await reconcile_once()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception(f"一致性检查出错: {e}")
+
+
+def start_reconciler(interval: float = RECONCILE_INTERVAL_SECONDS) -> None:
+    """启动定时一致性检查（在应用启动时调用）"""
+    global _task
+    if interval <= 0 or (_task is not None and not _task.done()):
+        return
+    _task = asyncio.create_task(_reconcile_loop(interval))
+
+
+async def stop_reconciler() -> None:
+    """停止定时一致性检查"""
+    global _task
+    if _task is not None:
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
+        _task = None
@@ -0,0 +1,349 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.config.chroma_db import (
+    DEFAULT_INDEX_ALIAS,
+    IndexVersion,
+    delete_index_collection,
+    get_active_index,
+    get_index_collection,
+    set_active_index,
+    set_pending_index,
+)
+from app.config.db import async_mongo_client
+from app.config.embedding_model import DEFAULT_MODEL_NAME
+from app.services.executor import run_blocking
+from app.services.index_outbox import OP_UPSERT, enqueue_index_tasks, outbox_collection
+from app.services.semantic_search import add_many_to_search_index
+
+logger = logging.getLogger(__name__)
+
+# 重建索引参数，可通过环境变量调整
+REINDEX_BATCH_SIZE = int(os.environ.get("REINDEX_BATCH_SIZE", "256"))
+REINDEX_LEASE_SECONDS = float(os.environ.get("REINDEX_LEASE_SECONDS", "60"))
+REINDEX_DROP_PREVIOUS = os.environ.get("REINDEX_DROP_PREVIOUS", "false").lower() == "true"
+# 切换前等待发件箱重放任务重新索引期间变化的笔记的最长秒数，超时则任务失败、保留旧集合
+REINDEX_REPLAY_TIMEOUT = float(os.environ.get("REINDEX_REPLAY_TIMEOUT", "600"))
+# 重放变化时向前多取的秒数，容忍各进程之间的时钟偏差
+REINDEX_REPLAY_OVERLAP_SECONDS = float(os.environ.get("REINDEX_REPLAY_OVERLAP_SECONDS", "5"))
+# failed_ids 最多保存的数量；失败数超过它时无法逐条重试，任务直接失败
+REINDEX_MAX_FAILED_IDS = 1000
+
+db = async_mongo_client.notes
+notes_collection = db.notes
+tombstones_collection = db.note_tombstones
+# 每个索引别名一条任务记录（_id 为别名），其中保存检查点，进程崩溃后可从检查点继续
+reindex_jobs = db.reindex_jobs
+
+_worker_id = f"{socket.gethostname()}:{os.getpid()}"
+_tasks: Dict[str, asyncio.Task] = {}
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _version_of(job: Dict[str, Any]) -> IndexVersion:
+    return IndexVersion(job["target"]["collection_name"], job["target"]["model_name"])
+
+
+async def start_reindex(model_name: Optional[str] = None, alias: str = DEFAULT_INDEX_ALIAS) -> Dict[str, Any]:
+    """
+    启动（或继续）后台重建索引任务
+
+    新任务会把所有笔记写入一个新的带版本号的集合，期间搜索仍由当前集合提供，
+    完成后再把别名切换到新集合。若已有运行中或失败的同模型任务，则从其检查点继续。
+
+    Args:
+        model_name: 新索引使用的嵌入模型，为 None 时使用默认模型
+        alias: 索引别名
+
+    Returns:
+        任务记录
+    """
+    model_name = model_name or DEFAULT_MODEL_NAME
+    job = await reindex_jobs.find_one({"_id": alias})
+    resumable = job is not None and job["status"] in ("running", "failed") and job["target"]["model_name"] == model_name
+
+    if resumable:
+        job = await reindex_jobs.find_one_and_update(
+            {"_id": alias, "status": {"$in": ["running", "failed"]}},
+            {"$set": {"status": "running", "error": None, "updated_at": _now()}},
+            return_document=ReturnDocument.AFTER
+        ) or job
+        logger.info(f"继续重建索引任务: {alias} -> {job['target']['collection_name']}")
+    elif job is not None and job["status"] == "running":
+        # 不同模型的任务正在运行时不能再启动新任务
+        return job
+    else:
+        version = IndexVersion(f"{alias}_v{int(time.time())}", model_name)
+        new_job = {
+            "status": "running",
+            "target": {"collection_name": version.collection_name, "model_name": version.model_name},
+            "source": {"collection_name": (await run_blocking(get_active_index, alias)).collection_name},
+            "last_id": None,
+            "processed": 0,
+            "failed": 0,
+            "failed_ids": [],
+            "error": None,
+            "owner": None,
+            "lease_until": None,
+            "started_at": _now(),
+            "updated_at": _now(),
+            "completed_at": None,
+        }
+        try:
+            # 只有在没有运行中任务时才会匹配并覆盖旧记录；否则 upsert 因 _id 冲突而失败
+            job = await reindex_jobs.find_one_and_update(
+                {"_id": alias, "status": {"$ne": "running"}},
+                {"$set": new_job},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            return await reindex_jobs.find_one({"_id": alias})
+        await run_blocking(get_index_collection, version)
+        await run_blocking(set_pending_index, version, alias)
+        logger.info(f"已创建重建索引任务: {alias} -> {version.collection_name} (模型: {model_name})")
+
+    _ensure_task(alias)
+    return job
+
+
+async def resume_reindex_jobs() -> None:
+    """在进程启动时继续所有运行中的重建任务（任务租约过期后才会被本进程接管）"""
+    async for job in reindex_jobs.find({"status": "running"}, {"_id": 1}):
+        _ensure_task(job["_id"])
+
+
+async def get_reindex_status(alias: str = DEFAULT_INDEX_ALIAS) -> Optional[Dict[str, Any]]:
+    """返回重建任务的状态，没有任务时返回 None"""
+    job = await reindex_jobs.find_one({"_id": alias})
+    if job is None:
+        return None
+    job["last_id"] = str(job["last_id"]) if job.get("last_id") is not None else None
+    job["active"] = (await run_blocking(get_active_index, alias)).collection_name
+    return job
+
+
+def _ensure_task(alias: str) -> None:
+    task = _tasks.get(alias)
+    if task is None or task.done():
+        _tasks[alias] = asyncio.create_task(_run_job(alias))
+
+
+async def _claim(alias: str) -> Optional[Dict[str, Any]]:
+    """获取（或续期）任务租约，其它进程持有未过期租约时返回 None"""
+    now = _now()
+    return await reindex_jobs.find_one_and_update(
+        {
+            "_id": alias,
+            "status": "running",
+            "$or": [{"owner": _worker_id}, {"owner": None}, {"lease_until": {"$lt": now}}],
+        },
+        {"$set": {"owner": _worker_id, "lease_until": now + timedelta(seconds=REINDEX_LEASE_SECONDS)}},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def _run_job(alias: str) -> None:
+    try:
+        # 任务正由其它进程执行时，等待其租约过期后再尝试接管
+        job = await _claim(alias)
+        while job is None:
+            if await reindex_jobs.find_one({"_id": alias, "status": "running"}) is None:
+                return
+            await asyncio.sleep(REINDEX_LEASE_SECONDS)
+            job = await _claim(alias)
+
+        version = _version_of(job)
+        logger.info(f"开始执行重建索引任务: {alias} -> {version.collection_name}，检查点: {job.get('last_id')}")
+        try:
+            query = {"_id": {"$gt": job["last_id"]}} if job.get("last_id") is not None else {}
+            cursor = notes_collection.find(query, {"title": 1, "description": 1}).sort("_id", 1).batch_size(REINDEX_BATCH_SIZE)
+            batch: List[Dict[str, Any]] = []
+            async for doc in cursor:
+                batch.append(doc)
+                if len(batch) >= REINDEX_BATCH_SIZE:
+                    if not await _process_batch(alias, version, batch):
+                        return
+                    batch = []
+            if batch and not await _process_batch(alias, version, batch):
+                return
+            # 只有所有笔记都已写入新集合、且期间的变化都已重放后才切换，否则保留旧集合继续提供搜索
+            if not await _retry_failed(alias, version):
+                return
+            if not await _replay_changes(alias, job["started_at"]):
+                return
+            await _cutover(alias, version)
+        except Exception as e:
+            logger.exception(f"重建索引任务失败: {e}")
+            await reindex_jobs.update_one(
+                {"_id": alias, "owner": _worker_id},
+                {"$set": {"status": "failed", "error": str(e), "owner": None, "updated_at": _now()}}
+            )
+    finally:
+        if _tasks.get(alias) is asyncio.current_task():
+            del _tasks[alias]
+
+
+async def _process_batch(alias: str, version: IndexVersion, batch: List[Dict[str, Any]]) -> bool:
+    """索引一批笔记并写入检查点；失去租约时返回 False"""
+    notes: List[Tuple[str, str, str]] = [
+        (str(doc["_id"]), doc.get("title", ""), doc.get("description", "")) for doc in batch
+    ]
+    errors = await run_blocking(add_many_to_search_index, notes, index=version)
+    result = await reindex_jobs.update_one(
+        {"_id": alias, "owner": _worker_id, "status": "running"},
+        {
+            "$set": {
+                "last_id": batch[-1]["_id"],
+                "lease_until": _now() + timedelta(seconds=REINDEX_LEASE_SECONDS),
+                "updated_at": _now(),
+            },
+            "$inc": {"processed": len(batch), "failed": len(errors)},
+            "$push": {"failed_ids": {"$each": list(errors), "$slice": -REINDEX_MAX_FAILED_IDS}},
+        }
+    )
+    if result.matched_count == 0:
+        logger.warning("重建索引任务的租约已丢失，停止执行")
+        return False
+    logger.info(f"重建索引进度: 已处理至 {batch[-1]['_id']}，本批 {len(batch)} 条，失败 {len(errors)} 条")
+    return True
+
+
+async def _fail(alias: str, error: str) -> None:
+    logger.error(f"重建索引任务失败，别名 {alias} 仍指向旧集合: {error}")
+    await reindex_jobs.update_one(
+        {"_id": alias, "owner": _worker_id},
+        {"$set": {"status": "failed", "error": error, "owner": None, "updated_at": _now()}}
+    )
+
+
+async def _retry_failed(alias: str, version: IndexVersion) -> bool:
+    """
+    重试检查点之前写入失败的笔记
+
+    Returns:
+        所有笔记都已写入新集合时返回 True；仍有失败（任务被标记为 failed）或失去租约时返回 False
+    """
+    job = await reindex_jobs.find_one({"_id": alias, "owner": _worker_id, "status": "running"})
+    if job is None:
+        logger.warning("重建索引任务的租约已丢失，停止执行")
+        return False
+    failed_ids = job.get("failed_ids") or []
+    if not job.get("failed"):
+        return True
+    if job["failed"] > len(failed_ids):
+        await _fail(alias, f"{job['failed']} 条笔记写入失败，超过可重试的上限 {REINDEX_MAX_FAILED_IDS}")
+        return False
+
+    logger.info(f"重试 {len(failed_ids)} 条写入失败的笔记")
+    errors: Dict[str, str] = {}
+    for start in range(0, len(failed_ids), REINDEX_BATCH_SIZE):
+        object_ids = [ObjectId(id) for id in failed_ids[start:start + REINDEX_BATCH_SIZE] if ObjectId.is_valid(id)]
+        # 已删除的笔记不需要重试
+        docs = await notes_collection.find({"_id": {"$in": object_ids}}, {"title": 1, "description": 1}).to_list(length=None)
+        if docs:
+            errors.update(await run_blocking(
+                add_many_to_search_index,
+                [(str(doc["_id"]), doc.get("title", ""), doc.get("description", "")) for doc in docs],
+                index=version
+            ))
+    if errors:
+        await reindex_jobs.update_one(
+            {"_id": alias, "owner": _worker_id},
+            {"$set": {"failed": len(errors), "failed_ids": list(errors)}}
+        )
+        await _fail(alias, f"{len(errors)} 条笔记重试后仍写入失败: {next(iter(errors.values()))}")
+        return False
+    await reindex_jobs.update_one({"_id": alias, "owner": _worker_id}, {"$set": {"failed": 0, "failed_ids": []}})
+    return True
+
+
+async def _changed_pages(collection, field: str, since: datetime, until: datetime) -> AsyncIterator[List[str]]:
+    """按 (field, _id) 分页读取 since <= field < until 的文档ID，每页 REINDEX_BATCH_SIZE 条"""
+    query: Dict[str, Any] = {field: {"$gte": since, "$lt": until}}
+    while True:
+        page = await collection.find(query, {field: 1}).sort([(field, 1), ("_id", 1)]).limit(REINDEX_BATCH_SIZE).to_list(length=REINDEX_BATCH_SIZE)
+        if page:
+            yield [str(doc["_id"]) for doc in page]
+        if len(page) < REINDEX_BATCH_SIZE:
+            return
+        last = page[-1]
+        query = {
+            field: {"$lt": until},
+            "$or": [{field: {"$gt": last[field]}}, {field: last[field], "_id": {"$gt": last["_id"]}}],
+        }
+
+
+async def _replay_changes(alias: str, started_at: datetime) -> bool:
+    """
+    重放任务开始后被修改或删除的笔记
+
+    游标读到的笔记可能在写入新集合前已被修改或删除，此时新集合中是旧内容（或已删除的笔记）。
+    为这些笔记重新记录索引任务并等待发件箱处理完成：发件箱读取笔记的当前内容，同时写入当前集合
+    和正在重建的集合，且同一笔记的任务不会并发处理，因此不会再被旧内容覆盖。重放开始之后的
+    变化本身就经由发件箱写入两个集合，因此只需重放到开始时刻；笔记和删除记录按页读取，每页
+    处理完成后再读取下一页。
+
+    Returns:
+        重放完成时返回 True；超时（任务被标记为 failed）或失去租约时返回 False
+    """
+    if started_at.tzinfo is None:
+        started_at = started_at.replace(tzinfo=timezone.utc)
+    since = started_at - timedelta(seconds=REINDEX_REPLAY_OVERLAP_SECONDS)
+    until = _now()
+    deadline = time.monotonic() + REINDEX_REPLAY_TIMEOUT
+    replayed = 0
+    for collection, field in ((notes_collection, "updated_at"), (tombstones_collection, "deleted_at")):
+        async for note_ids in _changed_pages(collection, field, since, until):
+            # 笔记已不存在时发件箱按删除处理
+            versions = list((await enqueue_index_tasks(note_ids, OP_UPSERT)).values())
+            if not await _wait_for_outbox(alias, versions, deadline):
+                return False
+            replayed += len(note_ids)
+    if replayed:
+        logger.info(f"已重放重建期间变化的 {replayed} 条笔记")
+    return True
+
+
+async def _wait_for_outbox(alias: str, versions: List[ObjectId], deadline: float) -> bool:
+    """等待发件箱处理完指定版本的任务，期间续期租约；超时（任务被标记为 failed）或失去租约时返回 False"""
+    while True:
+        remaining = await outbox_collection.count_documents({"version": {"$in": versions}})
+        if remaining == 0:
+            return True
+        if time.monotonic() >= deadline:
+            await _fail(alias, f"等待重放 {remaining} 条变化的笔记超过 {REINDEX_REPLAY_TIMEOUT} 秒")
+            return False
+        # 续期租约，避免等待期间被其它进程接管
+        if await _claim(alias) is None:
+            logger.warning("重建索引任务的租约已丢失，停止执行")
+            return False
+        await asyncio.sleep(1)
+
+
+async def _cutover(alias: str, version: IndexVersion) -> None:
+    """将别名切换到新集合，并将任务标记为完成"""
+    previous = await run_blocking(set_active_index, version, alias)
+    await reindex_jobs.update_one(
+        {"_id": alias},
+        {"$set": {"status": "completed", "owner": None, "completed_at": _now(), "updated_at": _now()}}
+    )
+    logger.info(f"重建索引完成，别名 {alias} 现指向 {version.collection_name}")
+    if REINDEX_DROP_PREVIOUS and previous.collection_name != version.collection_name:
+        try:
+            await run_blocking(delete_index_collection, previous.collection_name)
+            logger.info(f"已删除旧集合: {previous.collection_name}")
+        except Exception as e:
+            logger.error(f"删除旧集合 {previous.collection_name} 时出错: {e}")
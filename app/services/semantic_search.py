@@ -1,65 +1,397 @@
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Union
+import hashlib
+import logging
+import os
+import threading
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from app.config.chroma_db import get_or_create_collection
+from app.config.chroma_db import IndexVersion, get_active_index, get_index_collection, get_write_indexes
+from app.config.embedding_model import DEFAULT_MODEL_NAME, get_embedding_model
+from app.services.embedding_client import RemoteEmbeddingBatcher, get_embedding_client
+from app.services.embedding_engine import EmbeddingBatcher
+from app.services.query_cache import QueryEmbeddingCache, normalize_query
+from app.services.chunking import chunk_size_for_title, split_into_chunks
+from app.services.keyword_index import get_keyword_index, keyword_index, reciprocal_rank_fusion
+from app.services.metrics import observe_batch, register_cache, track_stage
 
-# 加载更准确的预训练模型
-print("正在加载SentenceTransformer模型...")
-model = SentenceTransformer('paraphrase-multilingual-mpnet-base-v2')
-print("SentenceTransformer模型加载完成")
+logger = logging.getLogger(__name__)
 
-def embed_text(text: str) -> List[float]:
+# 并发的嵌入请求由批处理器合并为一次 encode 调用，模型在首次编码时才加载
+# 每个嵌入模型一个批处理器；重建索引切换模型期间新旧模型会同时被使用
+# 配置了 EMBEDDING_SERVER_SOCKET 时请求转发给共享嵌入服务，由服务端跨进程合并批次，本进程不加载模型
+_embedding_batchers: Dict[str, Union[EmbeddingBatcher, RemoteEmbeddingBatcher]] = {}
+_embedding_batchers_lock = threading.Lock()
+
+def get_embedding_batcher(model_name: Optional[str] = None) -> Union[EmbeddingBatcher, RemoteEmbeddingBatcher]:
+    """获取指定嵌入模型的批处理器，为 None 时使用默认模型"""
+    model_name = model_name or DEFAULT_MODEL_NAME
+    batcher = _embedding_batchers.get(model_name)
+    if batcher is None:
+        with _embedding_batchers_lock:
+            batcher = _embedding_batchers.get(model_name)
+            if batcher is None:
+                client = get_embedding_client()
+                if client is not None:
+                    batcher = RemoteEmbeddingBatcher(client, model_name)
+                else:
+                    batcher = EmbeddingBatcher(lambda texts: get_embedding_model(model_name).encode(texts),
+                                               name=f"embedding-batcher-{model_name}")
+                _embedding_batchers[model_name] = batcher
+    return batcher
+
+# 搜索时按 limit 的倍数取块级候选，聚合后每条笔记只保留得分最高的块
+SEARCH_CHUNK_OVERSAMPLE = int(os.environ.get("SEARCH_CHUNK_OVERSAMPLE", "3"))
+
+# 批量写入 ChromaDB 时每次 upsert 的最大块数量
+INDEX_UPSERT_BATCH_SIZE = int(os.environ.get("INDEX_UPSERT_BATCH_SIZE", "1000"))
+
+# 混合检索：关键词（BM25）与向量结果按倒数排名融合，关闭时只使用向量检索
+HYBRID_SEARCH = os.environ.get("HYBRID_SEARCH", "true").lower() == "true"
+RRF_K = int(os.environ.get("RRF_K", "60"))
+
+# 重复查询直接命中缓存，跳过模型推理
+query_embedding_cache = QueryEmbeddingCache()
+register_cache("query_embedding", query_embedding_cache.stats)
+
+def embed_text(text: str, model_name: Optional[str] = None) -> List[float]:
     """
     将文本转换为向量嵌入
     
     Args:
         text: 要转换的文本字符串
+        model_name: 嵌入模型名称，为 None 时使用默认模型
     
     Returns:
         包含嵌入向量的列表
     """
-    print(f"正在生成文本嵌入，文本长度: {len(text)}")
-    embedding = model.encode(text)
-    print(f"嵌入生成完成，向量维度: {len(embedding)}")
+    embedding = get_embedding_batcher(model_name).submit(text).result()
+    logger.debug("嵌入生成完成", extra={"text_length": len(text), "dim": len(embedding)})
     return embedding.tolist()
 
-def add_to_search_index(id: str, title: str, description: str) -> None:
+def embed_texts(texts: List[str], model_name: Optional[str] = None) -> List[List[float]]:
+    """
+    批量将文本转换为向量嵌入
+    
+    Args:
+        texts: 要转换的文本列表
+        model_name: 嵌入模型名称，为 None 时使用默认模型
+    
+    Returns:
+        与输入顺序一致的嵌入向量列表
+    """
+    futures = get_embedding_batcher(model_name).submit_many(texts)
+    return [f.result().tolist() for f in futures]
+
+def embed_query(query: str, model_name: Optional[str] = None) -> List[float]:
+    """
+    将查询文本转换为向量嵌入，优先使用查询嵌入缓存
+    
+    Args:
+        query: 查询文本
+        model_name: 嵌入模型名称，为 None 时使用当前索引版本的模型
+    
+    Returns:
+        包含嵌入向量的列表
+    """
+    model_name = model_name or get_active_index().model_name
+    normalized = normalize_query(query)
+    embedding = query_embedding_cache.get(model_name, normalized)
+    if embedding is None:
+        embedding = embed_text(normalized, model_name)
+        query_embedding_cache.put(model_name, normalized, embedding)
+    return embedding
+
+def embed_queries(queries: List[str], model_name: Optional[str] = None) -> List[List[float]]:
+    """
+    批量将查询文本转换为向量嵌入，未命中缓存的查询去重后一次提交编码
+    
+    Args:
+        queries: 查询文本列表
+        model_name: 嵌入模型名称，为 None 时使用当前索引版本的模型
+    
+    Returns:
+        与输入顺序一致的嵌入向量列表
+    """
+    model_name = model_name or get_active_index().model_name
+    normalized = [normalize_query(query) for query in queries]
+    embeddings = [query_embedding_cache.get(model_name, text) for text in normalized]
+    missing = list(dict.fromkeys(text for text, embedding in zip(normalized, embeddings) if embedding is None))
+    if missing:
+        computed = dict(zip(missing, embed_texts(missing, model_name)))
+        for text, embedding in computed.items():
+            query_embedding_cache.put(model_name, text, embedding)
+        embeddings = [embedding if embedding is not None else computed[text]
+                      for text, embedding in zip(normalized, embeddings)]
+    return embeddings
+
+def compute_content_hash(title: str, description: str) -> str:
+    """
+    计算笔记被索引内容的哈希值
+    
+    Args:
+        title: 笔记标题
+        description: 笔记描述
+    
+    Returns:
+        搜索文本的 SHA-256 十六进制摘要
+    """
+    return hashlib.sha256(f"{title} {description}".encode("utf-8")).hexdigest()
+
+def chunk_id(note_id: str, index: int) -> str:
+    """返回笔记第 index 个块在向量索引中的 ID"""
+    return f"{note_id}#{index}"
+
+def build_note_chunks(id: str, title: str, description: str) -> List[Dict[str, Any]]:
+    """
+    将笔记切分为待索引的块
+    
+    每个块的嵌入文本为 "标题 块内容"，元数据中记录父笔记 ID、块序号和块哈希；
+    第 0 块（头块）额外保存完整描述，用于在搜索结果中还原整条笔记。
+    
+    Args:
+        id: 笔记ID
+        title: 笔记标题
+        description: 笔记描述
+    
+    Returns:
+        块列表，每项包含 id、text（嵌入文本）和 metadata
+    """
+    content_hash = compute_content_hash(title, description)
+    # 块内容与标题一起嵌入，为标题预留模型输入长度
+    pieces = split_into_chunks(description, chunk_size_for_title(title)) or [description]
+    chunks = []
+    for index, piece in enumerate(pieces):
+        text = f"{title} {piece}"
+        metadata = {
+            "parent_id": id,
+            "chunk_index": index,
+            "chunk_count": len(pieces),
+            "title": title,
+            "text": piece,
+            "chunk_hash": hashlib.sha256(text.encode("utf-8")).hexdigest(),
+            "content_hash": content_hash
+        }
+        if index == 0:
+            metadata["description"] = description
+        chunks.append({"id": chunk_id(id, index), "text": text, "metadata": metadata})
+    return chunks
+
+def add_to_search_index(id: str, title: str, description: str, index: Optional[IndexVersion] = None) -> bool:
     """
     将笔记添加到搜索索引中
     
+    笔记按块索引；更新时只对内容发生变化的块重新生成嵌入，
+    未变化的块直接复用索引中已存储的向量。
+    
     Args:
         id: 笔记ID
         title: 笔记标题
         description: 笔记描述
+        index: 要写入的索引版本，为 None 时写入当前版本以及正在重建的版本
+    
+    Returns:
+        是否实际写入了索引；内容哈希未变化时跳过并返回 False
     """
-    print(f"正在将笔记添加到搜索索引，ID: {id}")
-    # 合并标题和描述以创建搜索文本
-    search_text = f"{title} {description}"
+    logger.debug(f"正在将笔记添加到搜索索引，ID: {id}")
+    keyword_index.add(id, title, description)
+    chunks = build_note_chunks(id, title, description)
+    written = False
+    for version in ([index] if index else get_write_indexes()):
+        written = _add_chunks_to_index(version, id, chunks) or written
+    return written
+
+def _add_chunks_to_index(version: IndexVersion, id: str, chunks: List[Dict[str, Any]]) -> bool:
+    content_hash = chunks[0]["metadata"]["content_hash"]
     
     try:
-        # 获取嵌入向量
-        embedding = embed_text(search_text)
-        print("成功生成文本嵌入")
-        
         # 获取ChromaDB集合
-        collection = get_or_create_collection()
-        print("成功获取ChromaDB集合")
+        collection = get_index_collection(version)
+        
+        with track_stage("vector_get"):
+            existing = collection.get(where={"parent_id": id}, include=["metadatas"])
+        existing_ids = existing.get('ids') or []
+        existing_metadatas = dict(zip(existing_ids, existing.get('metadatas') or []))
+        
+        # 索引内容未变化时跳过重新嵌入和 upsert
+        head = existing_metadatas.get(chunk_id(id, 0))
+        if head and head.get("content_hash") == content_hash and len(existing_ids) == len(chunks):
+            logger.debug(f"笔记内容未变化，跳过索引更新，ID: {id}")
+            return False
+        
+        # 复用内容未变化的块的已有向量
+        needed_hashes = {chunk["metadata"]["chunk_hash"] for chunk in chunks}
+        reusable_ids = {}
+        for existing_id, metadata in existing_metadatas.items():
+            if metadata and metadata.get("chunk_hash") in needed_hashes:
+                reusable_ids.setdefault(metadata["chunk_hash"], existing_id)
+        embeddings_by_hash: Dict[str, List[float]] = {}
+        if reusable_ids:
+            with track_stage("vector_get"):
+                reused = collection.get(ids=list(reusable_ids.values()), include=["metadatas", "embeddings"])
+            for metadata, embedding in zip(reused['metadatas'], reused['embeddings']):
+                embeddings_by_hash[metadata["chunk_hash"]] = [float(x) for x in embedding]
+        
+        # 只为新增或变化的块生成嵌入
+        to_embed = {}
+        for chunk in chunks:
+            chunk_hash = chunk["metadata"]["chunk_hash"]
+            if chunk_hash not in embeddings_by_hash:
+                to_embed.setdefault(chunk_hash, chunk["text"])
+        if to_embed:
+            embeddings_by_hash.update(zip(to_embed.keys(), embed_texts(list(to_embed.values()), version.model_name)))
+        logger.debug("成功生成文本嵌入", extra={"note_id": id, "chunks": len(chunks), "embedded": len(to_embed)})
         
         # 使用 upsert 确保向量和元数据在 ID 已存在时被更新
-        collection.upsert(
-            ids=[id],
-            embeddings=[embedding],
-            metadatas=[{
-                "title": title,
-                "description": description
-            }]
-        )
-        print(f"成功将笔记添加到 ChromaDB (Upsert)，ID: {id}")
+        observe_batch("vector_upsert", len(chunks))
+        with track_stage("vector_upsert"):
+            collection.upsert(
+                ids=[chunk["id"] for chunk in chunks],
+                embeddings=[embeddings_by_hash[chunk["metadata"]["chunk_hash"]] for chunk in chunks],
+                metadatas=[chunk["metadata"] for chunk in chunks]
+            )
+        
+        # 删除笔记变短后多余的块；首次按块索引时删除旧版的整条笔记向量
+        new_ids = {chunk["id"] for chunk in chunks}
+        stale_ids = [existing_id for existing_id in existing_ids if existing_id not in new_ids]
+        if not existing_ids:
+            stale_ids.append(id)
+        if stale_ids:
+            with track_stage("vector_delete"):
+                collection.delete(ids=stale_ids)
+        logger.debug(f"成功将笔记添加到 ChromaDB (Upsert)，ID: {id}")
+        return True
     except Exception as e:
-        print(f"添加/更新笔记到搜索索引时出错: {str(e)}")
+        logger.error(f"添加/更新笔记到搜索索引时出错: {str(e)}", extra={"note_id": id})
         raise
 
-def search_notes(query: str, limit: int = 5, threshold: float = 0.0) -> List[Dict[str, Any]]:
+def add_many_to_search_index(notes: List[Tuple[str, str, str]], upsert_batch_size: Optional[int] = None,
+                             index: Optional[IndexVersion] = None) -> Dict[str, str]:
+    """
+    批量将新笔记添加到搜索索引中
+    
+    所有块的嵌入一次性提交给批处理器，再按批 upsert 到 ChromaDB。
+    适用于刚写入、尚未被索引的笔记，因此不检查已有索引内容。
+    
+    Args:
+        notes: (笔记ID, 标题, 描述) 列表
+        upsert_batch_size: 每次 upsert 的最大块数量，为 None 时使用 INDEX_UPSERT_BATCH_SIZE
+        index: 要写入的索引版本，为 None 时写入当前版本以及正在重建的版本
+    
+    Returns:
+        索引失败的笔记 ID 到错误信息的映射
+    """
+    logger.debug(f"正在批量添加 {len(notes)} 条笔记到搜索索引")
+    for id, title, description in notes:
+        keyword_index.add(id, title, description)
+    chunks = [chunk for id, title, description in notes for chunk in build_note_chunks(id, title, description)]
+    if not chunks:
+        return {}
+    errors: Dict[str, str] = {}
+    for version in ([index] if index else get_write_indexes()):
+        errors.update(_add_many_chunks_to_index(version, notes, chunks, upsert_batch_size or INDEX_UPSERT_BATCH_SIZE))
+    (logger.warning if errors else logger.debug)(f"批量索引完成，成功 {len(notes) - len(errors)} 条，失败 {len(errors)} 条")
+    return errors
+
+def _add_many_chunks_to_index(version: IndexVersion, notes: List[Tuple[str, str, str]],
+                              chunks: List[Dict[str, Any]], upsert_batch_size: int) -> Dict[str, str]:
+    try:
+        embeddings = embed_texts([chunk["text"] for chunk in chunks], version.model_name)
+        collection = get_index_collection(version)
+    except Exception as e:
+        logger.error(f"批量生成嵌入时出错: {str(e)}")
+        return {id: str(e) for id, _, _ in notes}
+    
+    errors: Dict[str, str] = {}
+    for start in range(0, len(chunks), upsert_batch_size):
+        batch = chunks[start:start + upsert_batch_size]
+        observe_batch("vector_upsert", len(batch))
+        try:
+            with track_stage("vector_upsert"):
+                collection.upsert(
+                    ids=[chunk["id"] for chunk in batch],
+                    embeddings=embeddings[start:start + upsert_batch_size],
+                    metadatas=[chunk["metadata"] for chunk in batch]
+                )
+        except Exception as e:
+            logger.error(f"批量 upsert 到 ChromaDB 时出错: {str(e)}")
+            for chunk in batch:
+                errors[chunk["metadata"]["parent_id"]] = str(e)
+    return errors
+
+def aggregate_chunk_hits(collection, ids: List[str], metadatas: Optional[List[Dict[str, Any]]],
+                         distances: Optional[List[float]], embeddings: Optional[List[Any]],
+                         limit: int, threshold: float) -> List[Dict[str, Any]]:
+    """
+    将块级命中聚合为每条笔记一个结果
+    
+    每条笔记取相似度最高的块作为其得分，过滤、排序并截取前 limit 条后，
+    再从头块中读取完整的标题和描述。
+    
+    Args:
+        collection: ChromaDB 集合
+        ids: 命中的块 ID
+        metadatas: 命中块的元数据
+        distances: 命中块的余弦距离
+        embeddings: 命中块的嵌入向量，为 None 时结果中不附带向量
+        limit: 返回结果的最大数量
+        threshold: 相似度阈值
+    
+    Returns:
+        按相似度降序排列的笔记列表
+    """
+    best: Dict[str, Dict[str, Any]] = {}
+    for i in range(len(ids)):
+        similarity = None
+        if distances and distances[i] is not None:
+             similarity = 1 - distances[i]  # 将距离转换为相似度
+        
+        # 只有在相似度计算成功并且 (阈值为0 或 相似度大于等于阈值) 时才添加
+        if similarity is None or (threshold > 0.0 and similarity < threshold):
+            continue
+        metadata = metadatas[i] if metadatas else None
+        # 旧版整条笔记向量没有 parent_id，其 ID 即笔记 ID
+        parent_id = (metadata or {}).get("parent_id", ids[i])
+        if parent_id not in best or similarity > best[parent_id]['similarity']:
+            best[parent_id] = {
+                'id': parent_id,
+                'metadata': metadata,
+                'similarity': similarity,
+                'embedding': list(embeddings[i]) if embeddings is not None else None
+            }
+    
+    # 按相似度排序（如果需要）
+    hits = sorted(best.values(), key=lambda x: x['similarity'], reverse=True)[:limit]
+    
+    # 命中的不是头块时，从头块读取完整描述
+    missing_heads = [chunk_id(hit['id'], 0) for hit in hits
+                     if hit['metadata'] is None or 'description' not in hit['metadata']]
+    heads: Dict[str, Dict[str, Any]] = {}
+    if missing_heads:
+        with track_stage("vector_get"):
+            fetched = collection.get(ids=missing_heads, include=["metadatas"])
+        for metadata in fetched.get('metadatas') or []:
+            if metadata:
+                heads[metadata["parent_id"]] = metadata
+    
+    processed_results = []
+    for hit in hits:
+        metadata = heads.get(hit['id']) or hit['metadata'] or {}
+        item = {
+            'id': hit['id'],
+            'metadata': {
+                "title": metadata.get("title", ""),
+                "description": metadata.get("description", metadata.get("text", ""))
+            },
+            'similarity': hit['similarity']
+        }
+        if embeddings is not None:
+            item['embedding'] = hit['embedding']
+        processed_results.append(item)
+    return processed_results
+
+def search_notes(query: str, limit: int = 5, threshold: float = 0.0,
+                 query_embedding: Optional[List[float]] = None,
+                 include_embeddings: bool = False,
+                 index: Optional[IndexVersion] = None) -> List[Dict[str, Any]]:
     """
     搜索笔记
     
@@ -67,76 +399,216 @@ def search_notes(query: str, limit: int = 5, threshold: float = 0.0) -> List[Dic
         query: 搜索查询
         limit: 返回结果的最大数量
         threshold: 相似度阈值
+        query_embedding: 调用方已计算好的查询嵌入，提供时不再重新嵌入
+        include_embeddings: 是否在结果中附带笔记已存储的嵌入向量（embedding 字段）
+        index: 要搜索的索引版本，为 None 时使用当前版本
     
     Returns:
         匹配的笔记列表
     """
-    print(f"正在搜索笔记，查询: {query}, 限制: {limit}, 阈值: {threshold}")
     try:
+        version = index or get_active_index()
         # 获取查询文本的嵌入
-        query_embedding = embed_text(query)
-        print("成功生成查询文本嵌入")
+        if query_embedding is None:
+            with track_stage("query_embedding"):
+                query_embedding = embed_query(query, version.model_name)
         
         # 获取ChromaDB集合
-        collection = get_or_create_collection()
-        print("成功获取ChromaDB集合")
+        collection = get_index_collection(version)
         
-        # 执行搜索 (移除不支持的参数)
-        results = collection.query(
-            query_embeddings=[query_embedding],
-            n_results=limit
-        )
-        print(f"搜索完成，原始结果: {results}") 
+        # 一条笔记可能有多个块命中，多取一些候选再按笔记聚合
+        candidates = limit * SEARCH_CHUNK_OVERSAMPLE
+        with track_stage("vector_query"):
+            results = collection.query(
+                query_embeddings=[query_embedding],
+                n_results=candidates,
+                include=_query_include(include_embeddings)
+            )
         
-        # 处理结果 (调整以适应新的结果结构)
-        processed_results = []
-        if results and results.get('ids') and results['ids'][0]:
-            ids = results['ids'][0]
-            metadatas = results.get('metadatas', [None] * len(ids))[0] 
-            distances = results.get('distances', [None] * len(ids))[0] 
-            
-            for i in range(len(ids)):
-                similarity = None
-                if distances and distances[i] is not None:
-                     similarity = 1 - distances[i]  # 将距离转换为相似度
-                
-                # 只有在相似度计算成功并且 (阈值为0 或 相似度大于等于阈值) 时才添加
-                if similarity is not None and (threshold <= 0.0 or similarity >= threshold):
-                    processed_results.append({
-                        'id': ids[i],
-                        'metadata': metadatas[i] if metadatas else None,
-                        'similarity': similarity
-                    })
-            
-            # 按相似度排序（如果需要）
-            processed_results.sort(key=lambda x: x['similarity'], reverse=True)
-            
-        print(f"处理完成，返回 {len(processed_results)} 条结果")
+        processed_results = _process_query_results(collection, results, 0, query, query_embedding,
+                                                   limit, threshold, include_embeddings)
+        logger.debug("搜索完成", extra={"query": query, "limit": limit, "threshold": threshold,
+                                        "results": len(processed_results)})
         return processed_results
     except Exception as e:
-        print(f"搜索笔记时出错: {str(e)}")
+        logger.error(f"搜索笔记时出错: {str(e)}")
         return []
 
-def remove_from_search_index(id: str) -> None:
+def search_notes_batch(searches: List[Dict[str, Any]], include_embeddings: bool = False,
+                       index: Optional[IndexVersion] = None) -> List[List[Dict[str, Any]]]:
+    """
+    批量搜索笔记：所有查询一次编码，并在一次 collection.query 中检索
+    
+    Args:
+        searches: 查询列表，每项包含 query，以及可选的 limit（默认 5）和 threshold（默认 0.0）
+        include_embeddings: 是否在结果中附带笔记已存储的嵌入向量（embedding 字段）
+        index: 要搜索的索引版本，为 None 时使用当前版本
+    
+    Returns:
+        与输入顺序一致的每个查询的匹配笔记列表
+    """
+    if not searches:
+        return []
+    try:
+        version = index or get_active_index()
+        queries = [search["query"] for search in searches]
+        limits = [search.get("limit", 5) for search in searches]
+        thresholds = [search.get("threshold", 0.0) for search in searches]
+        observe_batch("search", len(searches))
+        with track_stage("query_embedding"):
+            query_embeddings = embed_queries(queries, version.model_name)
+        
+        collection = get_index_collection(version)
+        # 按最大的 limit 取候选，每个查询再截取到自己的候选数量，与单独搜索的结果一致
+        with track_stage("vector_query"):
+            results = collection.query(
+                query_embeddings=query_embeddings,
+                n_results=max(limits) * SEARCH_CHUNK_OVERSAMPLE,
+                include=_query_include(include_embeddings)
+            )
+        
+        batch_results = [
+            _process_query_results(collection, results, i, queries[i], query_embeddings[i],
+                                   limits[i], thresholds[i], include_embeddings)
+            for i in range(len(searches))
+        ]
+        logger.debug("批量搜索完成", extra={"queries": len(searches),
+                                          "results": sum(len(r) for r in batch_results)})
+        return batch_results
+    except Exception as e:
+        logger.error(f"批量搜索笔记时出错: {str(e)}")
+        return [[] for _ in searches]
+
+def _query_include(include_embeddings: bool) -> List[str]:
+    include = ["metadatas", "distances"]
+    if include_embeddings:
+        include.append("embeddings")
+    return include
+
+def _process_query_results(collection, results: Dict[str, Any], i: int, query: str, query_embedding: List[float],
+                           limit: int, threshold: float, include_embeddings: bool) -> List[Dict[str, Any]]:
+    # 处理 collection.query 结果中第 i 个查询的命中：按笔记聚合，开启混合检索时再与关键词结果融合
+    candidates = limit * SEARCH_CHUNK_OVERSAMPLE
+    processed_results = []
+    if results and results.get('ids') and results['ids'][i]:
+        ids = results['ids'][i][:candidates]
+        metadatas = results['metadatas'][i][:candidates] if results.get('metadatas') else None
+        distances = results['distances'][i][:candidates] if results.get('distances') else None
+        embeddings = results['embeddings'][i][:candidates] if include_embeddings and results.get('embeddings') is not None else None
+        processed_results = aggregate_chunk_hits(collection, ids, metadatas, distances, embeddings,
+                                                 candidates if HYBRID_SEARCH else limit, threshold)
+    
+    if HYBRID_SEARCH:
+        processed_results = fuse_keyword_hits(collection, query, query_embedding, processed_results,
+                                              limit, candidates, include_embeddings)
+    return processed_results
+
+def fuse_keyword_hits(collection, query: str, query_embedding: List[float], vector_results: List[Dict[str, Any]],
+                      limit: int, candidates: int, include_embeddings: bool = False) -> List[Dict[str, Any]]:
+    """
+    将关键词（BM25）检索结果与向量检索结果按倒数排名融合
+    
+    只由关键词命中的笔记从其头块读取标题、描述和向量，similarity 取查询向量与
+    头块向量的余弦相似度；这类笔记不受相似度阈值限制，以保证精确词项（编号、
+    人名等）能被检索到。结果按融合得分排序，score 字段为融合得分。
+    
+    Args:
+        collection: ChromaDB 集合
+        query: 搜索查询
+        query_embedding: 查询嵌入
+        vector_results: 按相似度降序排列的向量检索结果
+        limit: 返回结果的最大数量
+        candidates: 关键词检索的候选数量
+        include_embeddings: 是否在结果中附带 embedding 字段
+    
+    Returns:
+        按融合得分降序排列的笔记列表
+    """
+    index = get_keyword_index()
+    with track_stage("keyword_search"):
+        keyword_hits = index.search(query, candidates) if index is not None else []
+    if not keyword_hits:
+        return vector_results[:limit]
+    
+    by_id = {item['id']: item for item in vector_results}
+    fused = reciprocal_rank_fusion([list(by_id), [id for id, _ in keyword_hits]], k=RRF_K)
+    
+    # 读取只由关键词命中的笔记的头块
+    keyword_only = [id for id, _ in fused[:limit] if id not in by_id]
+    if keyword_only:
+        with track_stage("vector_get"):
+            fetched = collection.get(ids=[chunk_id(id, 0) for id in keyword_only], include=["metadatas", "embeddings"])
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        query_vector = query_vector / (np.linalg.norm(query_vector) or 1.0)
+        fetched_embeddings = fetched.get('embeddings')
+        for i, metadata in enumerate(fetched.get('metadatas') or []):
+            if not metadata:
+                continue
+            vector = np.asarray(fetched_embeddings[i], dtype=np.float32)
+            item = {
+                'id': metadata["parent_id"],
+                'metadata': {
+                    "title": metadata.get("title", ""),
+                    "description": metadata.get("description", metadata.get("text", ""))
+                },
+                'similarity': float(np.dot(query_vector, vector) / (np.linalg.norm(vector) or 1.0))
+            }
+            if include_embeddings:
+                item['embedding'] = [float(x) for x in vector]
+            by_id[item['id']] = item
+    
+    # 关键词索引中存在、但向量索引中缺失的笔记会被跳过
+    processed_results = []
+    for id, score in fused:
+        if id in by_id:
+            processed_results.append({**by_id[id], 'score': score})
+            if len(processed_results) >= limit:
+                break
+    return processed_results
+
+def remove_from_search_index(id: str, index: Optional[IndexVersion] = None) -> None:
     """
     从搜索索引中删除笔记
     
     Args:
         id: 要删除的笔记的唯一标识符
+        index: 要删除的索引版本，为 None 时从当前版本以及正在重建的版本中删除
     """
-    print(f"正在从搜索索引中删除笔记，ID: {id}")
+    keyword_index.remove(id)
     try:
-        # 获取ChromaDB集合
-        collection = get_or_create_collection()
-        print("成功获取ChromaDB集合以进行删除")
-        
-        # 从ChromaDB删除
-        collection.delete(ids=[id])
-        print(f"成功从ChromaDB删除笔记，ID: {id}")
+        for version in ([index] if index else get_write_indexes()):
+            # 获取ChromaDB集合
+            collection = get_index_collection(version)
+            
+            # 从ChromaDB删除笔记的所有块，以及旧版的整条笔记向量
+            with track_stage("vector_delete"):
+                collection.delete(where={"parent_id": id})
+                collection.delete(ids=[id])
+        logger.debug(f"成功从ChromaDB删除笔记，ID: {id}")
     except Exception as e:
-        # 如果删除失败，记录错误，但通常我们希望即使向量删除失败，主数据库的删除也能成功
-        # 因此这里只打印错误，不向上抛出，除非有特定需求
-        print(f"从搜索索引删除笔记时出错: {str(e)}")
+        # 删除失败时向上抛出，由索引发件箱稍后重试
+        logger.error(f"从搜索索引删除笔记时出错: {str(e)}", extra={"note_id": id})
+        raise
+
+def _vector_store_stats() -> Optional[Dict[str, Any]]:
+    collection = get_index_collection(get_active_index())
+    return collection.stats() if hasattr(collection, "stats") else None
+
+def check_index_recall(samples: int = 100, k: int = 10) -> Optional[Dict[str, Any]]:
+    """
+    检查当前索引的近似检索（压缩编码粗排 + 精排）相对精确检索的召回率
+    
+    Args:
+        samples: 抽样的查询数量
+        k: top-k
+    
+    Returns:
+        召回率与内存统计；当前向量库后端不支持时返回 None
+    """
+    collection = get_index_collection(get_active_index())
+    if not hasattr(collection, "recall_check"):
+        return None
+    return collection.recall_check(samples=samples, k=k)
 
 def debug_search(query: str, limit: int = 20) -> Dict[str, Any]:
     """
@@ -149,10 +621,8 @@ def debug_search(query: str, limit: int = 20) -> Dict[str, Any]:
     Returns:
         包含调试信息的字典
     """
-    print(f"正在执行调试搜索，查询: {query}")
     try:
         results = search_notes(query, limit=limit, threshold=0.0)
-        print(f"调试搜索完成，找到 {len(results)} 条结果")
         
         # 计算平均相似度
         if results:
@@ -163,10 +633,13 @@ def debug_search(query: str, limit: int = 20) -> Dict[str, Any]:
         return {
             "query": query,
             "results": results,
-            "average_similarity": average_similarity
+            "average_similarity": average_similarity,
+            "query_cache": query_embedding_cache.stats(),
+            "keyword_index": keyword_index.stats(),
+            "vector_store": _vector_store_stats()
         }
     except Exception as e:
-        print(f"调试搜索时出错: {str(e)}")
+        logger.error(f"调试搜索时出错: {str(e)}")
         return {
             "query": query,
             "results": [],
@@ -0,0 +1,27 @@
+import math
+import re
+
+# CJK 字符（含日文假名、韩文）的 Unicode 范围，可直接嵌入正则字符类
+CJK_CHARS = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+CJK_RE = re.compile(f"[{CJK_CHARS}]")
+
+# 非 CJK 文本在常见 BPE 分词器中平均每个 token 约 4 个字符
+DEFAULT_CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str, chars_per_token: int = DEFAULT_CHARS_PER_TOKEN) -> int:
+    """
+    粗略估计文本的 token 数量（不依赖具体分词器）
+
+    CJK 字符在常见分词器中大致一个字符一个 token，按每字 1 个 token 计算；
+    其余字符按每 chars_per_token 个字符 1 个 token 计算。
+
+    Args:
+        text: 要估计的文本
+        chars_per_token: 非 CJK 字符每个 token 的平均字符数，越小估计越保守
+
+    Returns:
+        估计的 token 数量
+    """
+    cjk_count = len(CJK_RE.findall(text))
+    return cjk_count + math.ceil((len(text) - cjk_count) / chars_per_token)
@@ -0,0 +1,506 @@
+import json
+import logging
+import os
+import shutil
+import threading
+from typing import Any, Dict, List, Optional, Protocol, Sequence, Set
+
+import numpy as np
+
+from app.services.quantization import (
+    COMPRESSION_MODES,
+    DEFAULT_COMPRESSION,
+    DEFAULT_PCA_DIM,
+    DEFAULT_RESCORE_FACTOR,
+    VectorCodec,
+    approximate_scores,
+    recall_at_k,
+    rescore_top_k,
+)
+
+logger = logging.getLogger(__name__)
+
+# 本地向量库参数，可通过环境变量调整
+DEFAULT_STORE_PATH = os.environ.get("VECTOR_STORE_PATH", "./vector_store")
+# 墓碑行占比超过此比例时压缩文件
+COMPACT_RATIO = float(os.environ.get("VECTOR_STORE_COMPACT_RATIO", "0.3"))
+_MIN_CAPACITY = 1024
+_MIN_COMPACT_ROWS = 1024
+# 向量数量达到此值后才拟合压缩编码，样本太少时 PCA 和量化范围都不可靠
+_MIN_CODEC_ROWS = int(os.environ.get("VECTOR_STORE_CODEC_MIN_ROWS", "1024"))
+
+_VECTORS_FILE = "vectors.f32"
+_LOG_FILE = "records.jsonl"
+_META_FILE = "meta.json"
+_CODEC_FILE = "codec.npz"
+
+
+class VectorCollection(Protocol):
+    """
+    搜索服务使用的向量集合接口（ChromaDB Collection API 的子集）
+
+    where 过滤只需支持单个或多个元数据字段的相等比较，例如 {"parent_id": id}。
+    """
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None,
+            include: Sequence[str] = ("metadatas",), limit: Optional[int] = None,
+            offset: Optional[int] = None) -> Dict[str, Any]: ...
+
+    def upsert(self, ids: List[str], embeddings: List[List[float]],
+               metadatas: Optional[List[Dict[str, Any]]] = None) -> None: ...
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None) -> None: ...
+
+    def query(self, query_embeddings: List[List[float]], n_results: int = 10,
+              where: Optional[Dict[str, Any]] = None,
+              include: Sequence[str] = ("metadatas", "distances")) -> Dict[str, Any]: ...
+
+    def count(self) -> int: ...
+
+
+def _matches(metadata: Optional[Dict[str, Any]], where: Optional[Dict[str, Any]]) -> bool:
+    if not where:
+        return True
+    if metadata is None:
+        return False
+    for key, expected in where.items():
+        if isinstance(expected, dict):
+            if set(expected) != {"$eq"}:
+                raise ValueError(f"本地向量库只支持相等过滤: {where}")
+            expected = expected["$eq"]
+        if metadata.get(key) != expected:
+            return False
+    return True
+
+
+class NumpyVectorStore:
+    """
+    进程内的本地向量集合，使用余弦距离
+
+    向量归一化后保存在一个连续的 float32 矩阵中（内存映射到 vectors.f32），
+    查询时一次矩阵乘法再用 argpartition 取 top-k。ID 与元数据以追加日志
+    records.jsonl 持久化，启动时重放日志恢复。删除只在行上打墓碑，墓碑过多时
+    压缩重写文件。只适用于单进程部署：多个进程之间不会同步写入。
+
+    启用 compression 时，内存中另外保存一份压缩编码（int8 量化和/或 PCA 降维），
+    查询先用编码粗排出 k 的 rescore_factor 倍候选，再从内存映射文件中读取这些
+    候选的 float32 向量精排；完整矩阵留在磁盘上，只有被读取的行进入页缓存。
+    """
+
+    def __init__(self, path: str, compression: str = DEFAULT_COMPRESSION, pca_dim: int = DEFAULT_PCA_DIM,
+                 rescore_factor: int = DEFAULT_RESCORE_FACTOR):
+        """
+        Args:
+            path: 集合的数据目录，不存在时自动创建
+            compression: 压缩方式："none"、"int8"、"pca" 或 "pca-int8"
+            pca_dim: PCA 降维后的维度
+            rescore_factor: 精排候选数量为 k 的倍数
+        """
+        if compression not in COMPRESSION_MODES:
+            raise ValueError(f"不支持的向量压缩方式: {compression}（可选: {', '.join(COMPRESSION_MODES)}）")
+        self.path = path
+        self.compression = compression
+        self.pca_dim = pca_dim
+        self.rescore_factor = rescore_factor
+        self._codec: Optional[VectorCodec] = None
+        self._codes: Optional[np.ndarray] = None
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.RLock()
+        self._dim: Optional[int] = None
+        self._capacity = 0
+        self._size = 0
+        self._matrix: Optional[np.memmap] = None
+        self._ids: List[Optional[str]] = []
+        self._metadatas: List[Optional[Dict[str, Any]]] = []
+        self._live = np.zeros(0, dtype=bool)
+        self._rows: Dict[str, int] = {}
+        # parent_id -> 行号，用于按笔记读取/删除块时避免全表扫描
+        self._by_parent: Dict[str, Set[int]] = {}
+        # 压缩会重排行号，查询期间发生压缩时需要重新计算
+        self._generation = 0
+        self._log = None
+        self._load()
+
+    # --- 持久化 ---
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _load(self) -> None:
+        meta_path = self._file(_META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                self._dim = json.load(f)["dim"]
+            self._map(os.path.getsize(self._file(_VECTORS_FILE)) // (4 * self._dim))
+            with open(self._file(_LOG_FILE), encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 进程崩溃时最后一行可能不完整
+                        continue
+                    if record["op"] == "put":
+                        self._set_row(record["row"], record["id"], record.get("metadata"))
+                    else:
+                        self._clear_row(record["row"])
+            if self.compression != "none" and os.path.exists(self._file(_CODEC_FILE)):
+                codec = VectorCodec.load(self._file(_CODEC_FILE))
+                if codec.mode == self.compression:
+                    self._set_codec(codec)
+            self._fit_codec_if_needed()
+            logger.info(f"已加载本地向量集合: {self.path}，共 {len(self._rows)} 条向量")
+        self._log = open(self._file(_LOG_FILE), "a", encoding="utf-8")
+
+    def _map(self, capacity: int) -> None:
+        """按给定容量（行数）映射向量文件，文件不足时扩展"""
+        vectors_path = self._file(_VECTORS_FILE)
+        size = capacity * self._dim * 4
+        if not os.path.exists(vectors_path) or os.path.getsize(vectors_path) < size:
+            with open(vectors_path, "ab") as f:
+                f.truncate(size)
+        if self._matrix is not None:
+            self._matrix.flush()
+        self._matrix = np.memmap(vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self._dim)) if capacity else None
+        self._capacity = capacity
+        live = np.zeros(capacity, dtype=bool)
+        live[:len(self._live)] = self._live[:capacity]
+        self._live = live
+        if self._codes is not None:
+            codes = np.zeros((capacity, self._codes.shape[1]), dtype=self._codes.dtype)
+            codes[:min(len(self._codes), capacity)] = self._codes[:capacity]
+            self._codes = codes
+
+    def _set_codec(self, codec: Optional[VectorCodec]) -> None:
+        """启用（或在 codec 为 None 时停用）压缩编码，并编码所有已有的行"""
+        self._codec = codec
+        if codec is None:
+            self._codes = None
+            return
+        sample = codec.encode(np.zeros((1, self._dim), dtype=np.float32))
+        self._codes = np.zeros((self._capacity, sample.shape[1]), dtype=sample.dtype)
+        for start in range(0, self._size, 65536):
+            end = min(start + 65536, self._size)
+            self._codes[start:end] = codec.encode(self._matrix[start:end])
+
+    def _fit_codec_if_needed(self, refit: bool = False) -> None:
+        if self.compression == "none" or (self._codec is not None and not refit):
+            return
+        if len(self._rows) < _MIN_CODEC_ROWS:
+            return
+        logger.info(f"正在为本地向量集合拟合压缩编码 ({self.compression}): {self.path}")
+        rows = sorted(self._rows.values())
+        codec = VectorCodec.fit(np.array(self._matrix[rows]), self.compression, self.pca_dim)
+        codec.save(self._file(_CODEC_FILE))
+        self._set_codec(codec)
+
+    def _append_log(self, records: List[Dict[str, Any]]) -> None:
+        self._log.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+        self._log.flush()
+
+    def _set_row(self, row: int, id: str, metadata: Optional[Dict[str, Any]]) -> None:
+        self._clear_row(row)
+        while len(self._ids) <= row:
+            self._ids.append(None)
+            self._metadatas.append(None)
+        self._ids[row] = id
+        self._metadatas[row] = metadata
+        self._live[row] = True
+        self._rows[id] = row
+        self._size = max(self._size, row + 1)
+        parent_id = (metadata or {}).get("parent_id")
+        if parent_id is not None:
+            self._by_parent.setdefault(parent_id, set()).add(row)
+
+    def _clear_row(self, row: int) -> None:
+        if row >= len(self._ids) or self._ids[row] is None:
+            return
+        id = self._ids[row]
+        if self._rows.get(id) == row:
+            del self._rows[id]
+        parent_id = (self._metadatas[row] or {}).get("parent_id")
+        if parent_id is not None and parent_id in self._by_parent:
+            self._by_parent[parent_id].discard(row)
+            if not self._by_parent[parent_id]:
+                del self._by_parent[parent_id]
+        self._ids[row] = None
+        self._metadatas[row] = None
+        self._live[row] = False
+
+    def _compact_if_needed(self) -> None:
+        tombstones = self._size - len(self._rows)
+        if self._size < _MIN_COMPACT_ROWS or tombstones <= self._size * COMPACT_RATIO:
+            return
+        logger.info(f"正在压缩本地向量集合: {self.path}，墓碑 {tombstones} / {self._size}")
+        rows = sorted(self._rows.values())
+        vectors = np.array(self._matrix[rows]) if rows else np.zeros((0, self._dim), dtype=np.float32)
+        entries = [(self._ids[row], self._metadatas[row]) for row in rows]
+
+        # 先写临时文件再原子替换，压缩中途崩溃时旧文件仍然完整
+        capacity = max(_MIN_CAPACITY, 2 * len(rows))
+        tmp_vectors = self._file(_VECTORS_FILE + ".tmp")
+        tmp_log = self._file(_LOG_FILE + ".tmp")
+        compacted = np.memmap(tmp_vectors, dtype=np.float32, mode="w+", shape=(capacity, self._dim))
+        compacted[:len(rows)] = vectors
+        compacted.flush()
+        del compacted
+        with open(tmp_log, "w", encoding="utf-8") as f:
+            for row, (id, metadata) in enumerate(entries):
+                f.write(json.dumps({"op": "put", "row": row, "id": id, "metadata": metadata}, ensure_ascii=False) + "\n")
+        self._log.close()
+        self._matrix = None
+        os.replace(tmp_vectors, self._file(_VECTORS_FILE))
+        os.replace(tmp_log, self._file(_LOG_FILE))
+
+        self._ids, self._metadatas, self._rows, self._by_parent = [], [], {}, {}
+        self._live = np.zeros(0, dtype=bool)
+        self._size = 0
+        self._generation += 1
+        self._codes = None
+        self._map(capacity)
+        for row, (id, metadata) in enumerate(entries):
+            self._set_row(row, id, metadata)
+        self._log = open(self._file(_LOG_FILE), "a", encoding="utf-8")
+        # 删除了大量向量后数据分布可能已经变化，重新拟合压缩编码
+        if self._codec is not None:
+            self._fit_codec_if_needed(refit=True)
+
+    # --- 集合接口 ---
+
+    def _select_rows(self, ids: Optional[List[str]], where: Optional[Dict[str, Any]]) -> List[int]:
+        if ids is not None:
+            rows = [self._rows[id] for id in ids if id in self._rows]
+        elif where and list(where) == ["parent_id"] and not isinstance(where["parent_id"], dict):
+            rows = sorted(self._by_parent.get(where["parent_id"], ()))
+        else:
+            rows = sorted(self._rows.values())
+        return [row for row in rows if _matches(self._metadatas[row], where)]
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None,
+            include: Sequence[str] = ("metadatas",), limit: Optional[int] = None,
+            offset: Optional[int] = None) -> Dict[str, Any]:
+        """
+        按 ID 或元数据过滤读取向量，结果顺序与 ids 一致（缺失的 ID 被跳过）
+
+        不指定 ids 时按行号顺序返回，可用 limit/offset 分页遍历整个集合。
+        """
+        with self._lock:
+            rows = self._select_rows(ids, where)
+            if offset:
+                rows = rows[offset:]
+            if limit is not None:
+                rows = rows[:limit]
+            result: Dict[str, Any] = {"ids": [self._ids[row] for row in rows]}
+            if "metadatas" in include:
+                result["metadatas"] = [self._metadatas[row] for row in rows]
+            if "embeddings" in include:
+                result["embeddings"] = np.array(self._matrix[rows]) if rows else np.zeros((0, self._dim or 0), dtype=np.float32)
+            return result
+
+    def upsert(self, ids: List[str], embeddings: List[List[float]],
+               metadatas: Optional[List[Dict[str, Any]]] = None) -> None:
+        """写入或覆盖向量（向量在写入前归一化）"""
+        if not ids:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(ids):
+            raise ValueError("embeddings 的数量必须与 ids 一致")
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms > 0, norms, 1.0)
+        metadatas = metadatas or [None] * len(ids)
+
+        with self._lock:
+            if self._dim is None:
+                self._dim = vectors.shape[1]
+                with open(self._file(_META_FILE), "w", encoding="utf-8") as f:
+                    json.dump({"dim": self._dim, "space": "cosine"}, f)
+                self._map(_MIN_CAPACITY)
+            elif vectors.shape[1] != self._dim:
+                raise ValueError(f"向量维度 {vectors.shape[1]} 与集合维度 {self._dim} 不一致")
+
+            records = []
+            for id, vector, metadata in zip(ids, vectors, metadatas):
+                row = self._rows.get(id)
+                if row is None:
+                    row = self._size
+                    if row >= self._capacity:
+                        self._map(max(_MIN_CAPACITY, self._capacity * 2))
+                self._matrix[row] = vector
+                if self._codec is not None:
+                    self._codes[row] = self._codec.encode(vector[None, :])[0]
+                self._set_row(row, id, metadata)
+                records.append({"op": "put", "row": row, "id": id, "metadata": metadata})
+            # 先落盘向量再写日志：日志中出现的行一定已有完整的向量
+            self._matrix.flush()
+            self._append_log(records)
+            self._fit_codec_if_needed()
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None) -> None:
+        """按 ID 或元数据过滤删除向量（标记墓碑）"""
+        with self._lock:
+            if self._dim is None:
+                return
+            rows = self._select_rows(ids, where)
+            if not rows:
+                return
+            for row in rows:
+                self._clear_row(row)
+            self._append_log([{"op": "delete", "row": row} for row in rows])
+            self._compact_if_needed()
+
+    def query(self, query_embeddings: List[List[float]], n_results: int = 10,
+              where: Optional[Dict[str, Any]] = None,
+              include: Sequence[str] = ("metadatas", "distances")) -> Dict[str, Any]:
+        """
+        批量查询最相近的向量
+
+        Args:
+            query_embeddings: 查询向量列表
+            n_results: 每个查询返回的最大数量
+            where: 元数据相等过滤
+            include: 结果中包含的字段（metadatas、distances、embeddings）
+
+        Returns:
+            与 ChromaDB 相同结构的结果，每个字段是与查询一一对应的列表
+        """
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms > 0, norms, 1.0)
+
+        while True:
+            # 在锁内取快照，矩阵乘法在锁外进行，查询之间不会相互阻塞
+            with self._lock:
+                generation = self._generation
+                size = self._size
+                matrix = self._matrix
+                codec, codes = self._codec, self._codes
+                live = self._live[:size].copy()
+                if where:
+                    live[:] = False
+                    live[self._select_rows(None, where)] = True
+
+            result: Dict[str, Any] = {"ids": []}
+            for field in ("metadatas", "distances", "embeddings"):
+                if field in include:
+                    result[field] = []
+            if matrix is None or size == 0 or not live.any():
+                for _ in range(len(queries)):
+                    for field in result:
+                        result[field].append([])
+                return result
+
+            k = min(n_results, int(live.sum()))
+            # 每个查询的 (top-k 行号, 对应的精确相似度)
+            hits = []
+            if codec is not None:
+                # 压缩编码粗排，候选行再读取 float32 向量精排
+                approx = approximate_scores(codes[:size], codec.encode_queries(queries))
+                approx[:, ~live] = -np.inf
+                for query, scores in zip(queries, approx):
+                    top = rescore_top_k(scores, k, self.rescore_factor, lambda rows: np.asarray(matrix[rows]) @ query)
+                    hits.append((top, np.asarray(matrix[top]) @ query))
+            else:
+                similarities = queries @ matrix[:size].T
+                similarities[:, ~live] = -np.inf
+                for scores in similarities:
+                    top = np.argpartition(-scores, k - 1)[:k]
+                    top = top[np.argsort(-scores[top])]
+                    hits.append((top, scores[top]))
+            with self._lock:
+                if generation != self._generation:
+                    continue
+                for top, top_scores in hits:
+                    # 快照之后被删除的行直接跳过
+                    kept = [i for i, row in enumerate(top) if self._ids[row] is not None]
+                    top, top_scores = top[kept], top_scores[kept]
+                    result["ids"].append([self._ids[row] for row in top])
+                    if "metadatas" in result:
+                        result["metadatas"].append([self._metadatas[row] for row in top])
+                    if "distances" in result:
+                        result["distances"].append([float(1.0 - score) for score in top_scores])
+                    if "embeddings" in result:
+                        result["embeddings"].append(np.array(matrix[top]))
+                return result
+
+    def stats(self) -> Dict[str, Any]:
+        """返回向量数量、维度、压缩方式以及常驻内存中用于打分的字节数"""
+        with self._lock:
+            full_bytes = (self._dim or 0) * 4
+            bytes_per_vector = self._codec.bytes_per_vector(self._dim) if self._codec is not None else full_bytes
+            return {
+                "backend": "numpy",
+                "count": len(self._rows),
+                "dim": self._dim,
+                "compression": self._codec.mode if self._codec is not None else "none",
+                "bytes_per_vector": bytes_per_vector,
+                "scoring_bytes": bytes_per_vector * self._size,
+                "full_precision_bytes": full_bytes * self._size,
+            }
+
+    def recall_check(self, samples: int = 100, k: int = 10, seed: int = 0) -> Dict[str, Any]:
+        """
+        以已存储的向量为查询，比较当前查询路径与精确检索的 top-k 召回率
+
+        Args:
+            samples: 抽样的查询数量
+            k: top-k
+            seed: 抽样随机种子
+
+        Returns:
+            召回率与内存统计
+        """
+        with self._lock:
+            rows = np.array(sorted(self._rows.values()))
+            if len(rows) == 0:
+                return {"recall": 1.0, "samples": 0, "k": k, **self.stats()}
+            chosen = np.random.default_rng(seed).choice(rows, min(samples, len(rows)), replace=False)
+            queries = np.array(self._matrix[np.sort(chosen)])
+            live = self._live[:self._size].copy()
+            exact_scores = queries @ self._matrix[:self._size].T
+        exact_scores[:, ~live] = -np.inf
+        k = min(k, int(live.sum()))
+        exact = [self._ids_of(np.argpartition(-scores, k - 1)[:k]) for scores in exact_scores]
+        approximate = self.query(queries, n_results=k, include=())["ids"]
+        return {"recall": recall_at_k(exact, approximate), "samples": len(queries), "k": k, **self.stats()}
+
+    def _ids_of(self, rows: np.ndarray) -> List[str]:
+        with self._lock:
+            return [self._ids[row] for row in rows if self._ids[row] is not None]
+
+    def count(self) -> int:
+        """返回集合中（未删除的）向量数量"""
+        with self._lock:
+            return len(self._rows)
+
+    def close(self) -> None:
+        """落盘并关闭数据文件"""
+        with self._lock:
+            if self._matrix is not None:
+                self._matrix.flush()
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+
+_stores: Dict[str, NumpyVectorStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_numpy_store(name: str, base_path: str = DEFAULT_STORE_PATH) -> NumpyVectorStore:
+    """获取（或打开）指定名称的本地向量集合，同一进程内每个集合只打开一次"""
+    path = os.path.join(base_path, name)
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = NumpyVectorStore(path)
+            _stores[path] = store
+        return store
+
+
+def delete_numpy_store(name: str, base_path: str = DEFAULT_STORE_PATH) -> None:
+    """删除本地向量集合及其数据文件"""
+    path = os.path.join(base_path, name)
+    with _stores_lock:
+        store = _stores.pop(path, None)
+        if store is not None:
+            store.close()
+        shutil.rmtree(path, ignore_errors=True)
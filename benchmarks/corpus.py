@@ -0,0 +1,125 @@
+import random
+from typing import Dict, Iterator, List, Sequence
+
+# 合成语料的词表：按语言分组的主题词与连接句式，足以产生相似但不重复的笔记
+_VOCAB: Dict[str, Dict[str, List[str]]] = {
+    "zh": {
+        "topics": ["机器学习", "数据库", "向量检索", "项目管理", "读书笔记", "旅行计划", "健身", "烹饪", "投资", "会议纪要",
+                   "前端开发", "操作系统", "网络协议", "产品设计", "心理学", "历史", "摄影", "音乐", "语言学习", "家庭财务"],
+        "words": ["索引", "缓存", "延迟", "吞吐量", "模型", "训练", "预算", "进度", "风险", "目标", "复盘", "方案", "接口",
+                  "用户", "指标", "实验", "版本", "部署", "文档", "计划", "总结", "问题", "原因", "优化", "测试", "数据"],
+        "templates": ["今天讨论了{a}和{b}的关系，结论是需要先解决{c}。", "关于{a}，主要的{b}来自{c}。",
+                      "下周继续跟进{a}，重点关注{b}与{c}。", "{a}的{b}比预期高，需要重新评估{c}。",
+                      "记录一下：{a}、{b}、{c}之间存在依赖。"],
+    },
+    "en": {
+        "topics": ["machine learning", "databases", "vector search", "project management", "reading notes", "travel",
+                   "fitness", "cooking", "investing", "meeting minutes", "frontend", "operating systems", "networking",
+                   "product design", "psychology", "history", "photography", "music", "language learning", "budgeting"],
+        "words": ["index", "cache", "latency", "throughput", "model", "training", "budget", "schedule", "risk", "goal",
+                  "retrospective", "proposal", "interface", "user", "metric", "experiment", "release", "deployment",
+                  "documentation", "plan", "summary", "issue", "root cause", "optimization", "testing", "dataset"],
+        "templates": ["We discussed how {a} relates to {b}; the conclusion is to fix {c} first. ",
+                      "Regarding {a}, most of the {b} comes from {c}. ",
+                      "Follow up next week on {a}, focusing on {b} and {c}. ",
+                      "The {b} of {a} is higher than expected, so {c} needs another look. ",
+                      "Note to self: {a}, {b} and {c} depend on each other. "],
+    },
+    "ja": {
+        "topics": ["機械学習", "データベース", "ベクトル検索", "プロジェクト管理", "読書メモ", "旅行", "筋トレ", "料理", "投資",
+                   "議事録", "フロントエンド", "ネットワーク", "デザイン", "心理学", "歴史", "写真", "音楽", "語学"],
+        "words": ["インデックス", "キャッシュ", "レイテンシ", "スループット", "モデル", "学習", "予算", "進捗", "リスク", "目標",
+                  "振り返り", "提案", "ユーザー", "指標", "実験", "リリース", "ドキュメント", "計画", "課題", "最適化"],
+        "templates": ["{a}と{b}の関係について話し合い、まず{c}を解決することにした。", "{a}について、{b}の大部分は{c}が原因だ。",
+                      "来週も{a}を確認し、{b}と{c}に注目する。", "{a}の{b}が想定より高いので、{c}を見直す必要がある。"],
+    },
+}
+
+DEFAULT_LANGUAGES = ("zh", "en", "ja")
+
+
+def _sentence(rng: random.Random, vocab: Dict[str, List[str]]) -> str:
+    a, b, c = rng.sample(vocab["words"], 3)
+    return rng.choice(vocab["templates"]).format(a=a, b=b, c=c)
+
+
+def _code(rng: random.Random) -> str:
+    # 编号类词项，用于检验关键词检索对精确匹配的召回
+    return f"{rng.choice(['INV', 'TKT', 'PRJ', 'SKU'])}-{rng.randint(1000, 99999)}"
+
+
+def generate_note(rng: random.Random, languages: Sequence[str] = DEFAULT_LANGUAGES) -> Dict[str, str]:
+    """
+    生成一条合成笔记
+
+    描述长度服从长尾分布：大多数笔记只有一两句，少数笔记超过一个分块，
+    约一成的笔记混用两种语言，约两成的笔记带有编号。
+
+    Args:
+        rng: 随机数生成器
+        languages: 可选的语言
+
+    Returns:
+        包含 title 和 description 的笔记
+    """
+    language = rng.choice(languages)
+    vocab = _VOCAB[language]
+    topic = rng.choice(vocab["topics"])
+    sentences = [_sentence(rng, vocab) for _ in range(min(int(rng.paretovariate(1.2)), 40))]
+    if len(languages) > 1 and rng.random() < 0.1:
+        other = _VOCAB[rng.choice([l for l in languages if l != language])]
+        sentences.append(_sentence(rng, other))
+    title = f"{topic} {rng.choice(vocab['words'])}"
+    if rng.random() < 0.2:
+        code = _code(rng)
+        title = f"{title} {code}"
+        sentences.append(code)
+    return {"title": title, "description": "".join(sentences)}
+
+
+def generate_notes(count: int, seed: int = 0, languages: Sequence[str] = DEFAULT_LANGUAGES) -> Iterator[Dict[str, str]]:
+    """
+    按固定种子逐条生成合成笔记，相同参数总是生成相同的语料（可用于 100 万条以上而不占内存）
+
+    Args:
+        count: 笔记数量
+        seed: 随机种子
+        languages: 可选的语言
+
+    Returns:
+        笔记迭代器
+    """
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield generate_note(rng, languages)
+
+
+def generate_queries(count: int, seed: int = 0, languages: Sequence[str] = DEFAULT_LANGUAGES,
+                     repeat_ratio: float = 0.2) -> List[str]:
+    """
+    生成搜索/问答使用的查询
+
+    Args:
+        count: 查询数量
+        seed: 随机种子
+        languages: 可选的语言
+        repeat_ratio: 重复之前查询的比例，用于模拟热门查询对缓存的影响
+
+    Returns:
+        查询列表
+    """
+    rng = random.Random(seed + 1)
+    queries: List[str] = []
+    for _ in range(count):
+        if queries and rng.random() < repeat_ratio:
+            queries.append(rng.choice(queries))
+            continue
+        vocab = _VOCAB[rng.choice(languages)]
+        kind = rng.random()
+        if kind < 0.1:
+            queries.append(_code(rng))
+        elif kind < 0.5:
+            queries.append(f"{rng.choice(vocab['topics'])} {rng.choice(vocab['words'])}")
+        else:
+            queries.append(_sentence(rng, vocab))
+    return queries
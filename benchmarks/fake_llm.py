@@ -0,0 +1,118 @@
+"""
+兼容 OpenAI Chat Completions 接口的假 LLM 服务，按配置的延迟返回固定长度的回答
+
+单独运行（需要 uvicorn）：
+    python -m benchmarks.fake_llm --port 9100 --latency-ms 300 --tokens 64 --token-interval-ms 10
+基准测试默认在进程内通过 ASGI 调用它，不占用端口。
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+_WORDS = ["根据", "你的", "笔记", "，", "相关", "内容", "如下", "：", "note", "summary", "。"]
+
+
+def create_app(latency_ms: float = 300, tokens: int = 64, token_interval_ms: float = 10,
+               error_rate: float = 0.0) -> FastAPI:
+    """
+    创建假 LLM 应用
+
+    Args:
+        latency_ms: 首个 token 之前的延迟（毫秒），模拟排队与 prefill
+        tokens: 每个回答的 token 数量
+        token_interval_ms: 流式输出时相邻 token 的间隔（毫秒），模拟 decode 速度
+        error_rate: 以该比例返回 503，模拟上游过载
+
+    Returns:
+        FastAPI 应用
+    """
+    app = FastAPI(title="fake-llm")
+    app.state.requests = 0
+
+    def _token(i: int) -> str:
+        return _WORDS[i % len(_WORDS)]
+
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": "fake-llm", "object": "model"}]}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        model = body.get("model", "fake-llm")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // 2
+
+        await asyncio.sleep(latency_ms / 1000)
+        if random.random() < error_rate:
+            return JSONResponse({"error": {"message": "overloaded", "type": "server_error"}}, status_code=503)
+        if not body.get("stream"):
+            # 非流式：一次返回，总耗时包含全部 decode 时间
+            await asyncio.sleep(tokens * token_interval_ms / 1000)
+            return JSONResponse({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(_token(i) for i in range(tokens))},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": tokens,
+                          "total_tokens": prompt_tokens + tokens},
+            })
+
+        async def events():
+            for i in range(tokens):
+                if i:
+                    await asyncio.sleep(token_interval_ms / 1000)
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": _token(i)}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            done = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            }
+            yield f"data: {json.dumps(done)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的假 LLM 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--tokens", type=int, default=64)
+    parser.add_argument("--token-interval-ms", type=float, default=10)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    import uvicorn
+    app = create_app(args.latency_ms, args.tokens, args.token_interval_ms, args.error_rate)
+    uvicorn.run(app, host=args.host, port=args.port,
+                log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
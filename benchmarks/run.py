@@ -0,0 +1,344 @@
+"""
+离线基准测试：写入、嵌入、搜索与问答的吞吐量和延迟分位数
+
+示例：
+    python -m benchmarks.run --notes 10000 --concurrency 16 --embedder fake
+    python -m benchmarks.run --notes 1000000 --scenarios load,search --mongo-uri mongodb://localhost:27017 --reset
+
+默认全部使用本地替身：内存 MongoDB（mongomock）、进程内 NumPy 向量库、进程内假 LLM，
+请求通过 ASGI 直接调用应用，不经过网络。结果写入 JSON，便于比较不同版本。
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ALL_SCENARIOS = ("load", "ingest", "embed", "search", "ask")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="LMNOTES 离线基准测试")
+    parser.add_argument("--scenarios", default=",".join(ALL_SCENARIOS),
+                        help=f"要运行的场景，逗号分隔（{', '.join(ALL_SCENARIOS)}）")
+    parser.add_argument("--notes", type=int, default=1000, help="预先导入的笔记数量（load 场景）")
+    parser.add_argument("--languages", default="zh,en,ja", help="合成语料的语言")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--concurrency", type=int, default=8, help="并发请求数")
+    parser.add_argument("--load-batch", type=int, default=1000, help="load 场景每次批量导入的笔记数")
+    parser.add_argument("--ingest-requests", type=int, default=200, help="ingest 场景逐条写入的笔记数")
+    parser.add_argument("--embed-requests", type=int, default=500, help="embed 场景的嵌入次数")
+    parser.add_argument("--search-requests", type=int, default=500, help="search 场景的查询次数")
+    parser.add_argument("--ask-requests", type=int, default=100, help="ask 场景的提问次数")
+    parser.add_argument("--repeat-ratio", type=float, default=0.2, help="查询中重复出现的比例（影响缓存命中）")
+    parser.add_argument("--search-limit", type=int, default=10)
+    parser.add_argument("--mongo-uri", default=None, help="使用本地 MongoDB，不指定时使用内存 mongomock")
+    parser.add_argument("--reset", action="store_true", help="开始前清空 --mongo-uri 中的 notes 数据库")
+    parser.add_argument("--vector-store", choices=("numpy", "chroma"), default="numpy",
+                        help="numpy 为进程内向量库，chroma 连接 localhost:8000 的 ChromaDB 服务")
+    parser.add_argument("--vector-store-path", default=None, help="NumPy 向量库目录，默认使用临时目录")
+    parser.add_argument("--embedder", choices=("model", "fake"), default="model",
+                        help="model 使用真实的嵌入模型（需已缓存到本地），fake 使用哈希向量")
+    parser.add_argument("--fake-embed-dim", type=int, default=384)
+    parser.add_argument("--fake-embed-batch-ms", type=float, default=0.0, help="假嵌入模型每批的模拟耗时")
+    parser.add_argument("--fake-embed-text-ms", type=float, default=0.0, help="假嵌入模型每条文本的模拟耗时")
+    parser.add_argument("--llm-url", default=None, help="使用外部的 OpenAI 兼容服务（例如 benchmarks.fake_llm）")
+    parser.add_argument("--llm-latency-ms", type=float, default=300, help="进程内假 LLM 的首 token 延迟")
+    parser.add_argument("--llm-tokens", type=int, default=64, help="进程内假 LLM 每个回答的 token 数")
+    parser.add_argument("--llm-token-interval-ms", type=float, default=10, help="进程内假 LLM 的 token 间隔")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="进程内假 LLM 返回 503 的比例（用于观察重试）")
+    parser.add_argument("--output", default=None, help="结果文件路径，默认 benchmarks/results/<时间>.json")
+    return parser.parse_args(argv)
+
+
+def configure_environment(args: argparse.Namespace) -> None:
+    """在导入 app 之前设置环境变量与替身"""
+    # 关闭定时一致性检查，避免其在测量期间运行；日志只保留警告
+    os.environ.setdefault("RECONCILE_INTERVAL_SECONDS", "0")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ["VECTOR_STORE_BACKEND"] = args.vector_store
+    if args.vector_store == "numpy":
+        os.environ["VECTOR_STORE_PATH"] = args.vector_store_path or tempfile.mkdtemp(prefix="lmnotes-bench-")
+    if args.mongo_uri:
+        os.environ["MONGO_URI"] = args.mongo_uri
+    else:
+        from benchmarks.stand_ins import install_mongo_mock
+        install_mongo_mock()
+
+
+def summarize(latencies: List[float], errors: int, wall_seconds: float, items: Optional[int] = None) -> Dict[str, Any]:
+    """汇总一个场景的延迟分位数与吞吐量（延迟单位为毫秒）"""
+    values = np.asarray(latencies, dtype=np.float64) * 1000
+    result: Dict[str, Any] = {
+        "requests": len(latencies),
+        "errors": errors,
+        "wall_seconds": round(wall_seconds, 4),
+        "throughput_rps": round(len(latencies) / wall_seconds, 2) if wall_seconds > 0 else None,
+    }
+    if items is not None:
+        result["items"] = items
+        result["items_per_second"] = round(items / wall_seconds, 2) if wall_seconds > 0 else None
+    if len(values):
+        result["latency_ms"] = {
+            "mean": round(float(values.mean()), 3),
+            "p50": round(float(np.percentile(values, 50)), 3),
+            "p95": round(float(np.percentile(values, 95)), 3),
+            "p99": round(float(np.percentile(values, 99)), 3),
+            "max": round(float(values.max()), 3),
+        }
+    return result
+
+
+async def run_concurrently(call: Callable[[Any], Awaitable[bool]], items: Iterable[Any],
+                           concurrency: int) -> Dict[str, Any]:
+    """
+    以固定并发度执行请求，记录每个请求的耗时
+
+    Args:
+        call: 执行一个请求的协程函数，返回是否成功
+        items: 请求参数
+        concurrency: 并发数
+
+    Returns:
+        summarize() 的结果
+    """
+    iterator = iter(items)
+    latencies: List[float] = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        for item in iterator:
+            start = time.perf_counter()
+            try:
+                ok = await call(item)
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+def stage_snapshot() -> Dict[str, Dict[str, float]]:
+    from app.services.metrics import STAGE_DURATION
+    return {labels["stage"]: values for labels, values in STAGE_DURATION.snapshots()}
+
+
+def stage_delta(before: Dict[str, Dict[str, float]], after: Dict[str, Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+    """场景期间各处理阶段的调用次数和平均耗时（毫秒）"""
+    delta = {}
+    for stage, values in after.items():
+        count = values["count"] - before.get(stage, {}).get("count", 0)
+        total = values["sum"] - before.get(stage, {}).get("sum", 0.0)
+        if count:
+            delta[stage] = {"count": count, "mean_ms": round(total / count * 1000, 3)}
+    return delta
+
+
+async def wait_for_outbox(timeout: float = 3600) -> float:
+    """等待索引发件箱清空，返回等待的秒数"""
+    from app.services.index_outbox import get_outbox_stats
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if (await get_outbox_stats())["pending"] == 0:
+            break
+        await asyncio.sleep(0.05)
+    return time.perf_counter() - started
+
+
+async def scenario_load(client, args) -> Dict[str, Any]:
+    """批量导入 --notes 条笔记，分别统计写入 MongoDB 与完成索引的吞吐量"""
+    from benchmarks.corpus import generate_notes
+    notes = generate_notes(args.notes, seed=args.seed, languages=args.languages)
+    latencies: List[float] = []
+    errors = 0
+    started = time.perf_counter()
+    while True:
+        batch = [note for _, note in zip(range(args.load_batch), notes)]
+        if not batch:
+            break
+        request_started = time.perf_counter()
+        response = await client.post("/api/v1/notes/bulk/", json=batch)
+        latencies.append(time.perf_counter() - request_started)
+        if response.status_code != 201:
+            errors += 1
+    write_seconds = time.perf_counter() - started
+    index_wait = await wait_for_outbox()
+    result = summarize(latencies, errors, write_seconds, items=args.notes)
+    result["indexed_items_per_second"] = round(args.notes / (write_seconds + index_wait), 2)
+    return result
+
+
+async def scenario_ingest(client, args) -> Dict[str, Any]:
+    """逐条写入笔记并等待索引完成（读己之写），延迟包含嵌入与向量写入"""
+    from benchmarks.corpus import generate_notes
+    notes = generate_notes(args.ingest_requests, seed=args.seed + 100, languages=args.languages)
+
+    async def call(note):
+        response = await client.post("/api/v1/notes/", json=note, params={"wait_for_index": "true"})
+        return response.status_code == 201 and response.headers.get("X-Index-Status") == "indexed"
+
+    return await run_concurrently(call, notes, args.concurrency)
+
+
+async def scenario_embed(client, args) -> Dict[str, Any]:
+    """直接调用 embed_text，衡量嵌入批处理器在并发下的吞吐量"""
+    from app.services.executor import run_blocking
+    from app.services.semantic_search import embed_text
+    from benchmarks.corpus import generate_queries
+    texts = generate_queries(args.embed_requests, seed=args.seed + 200, languages=args.languages, repeat_ratio=0)
+
+    async def call(text):
+        return len(await run_blocking(embed_text, text)) > 0
+
+    return await run_concurrently(call, texts, args.concurrency)
+
+
+async def scenario_search(client, args) -> Dict[str, Any]:
+    """并发语义搜索"""
+    from benchmarks.corpus import generate_queries
+    queries = generate_queries(args.search_requests, seed=args.seed + 300, languages=args.languages,
+                               repeat_ratio=args.repeat_ratio)
+
+    async def call(query):
+        response = await client.get("/api/v1/notes/search/", params={"q": query, "limit": args.search_limit})
+        return response.status_code == 200
+
+    return await run_concurrently(call, queries, args.concurrency)
+
+
+async def scenario_ask(client, args) -> Dict[str, Any]:
+    """并发问答（检索 + 上下文构建 + 假 LLM）"""
+    from benchmarks.corpus import generate_queries
+    questions = generate_queries(args.ask_requests, seed=args.seed + 400, languages=args.languages,
+                                 repeat_ratio=args.repeat_ratio)
+
+    async def call(question):
+        response = await client.post("/api/v1/notes/ask/", json={"question": question})
+        return response.status_code == 200
+
+    return await run_concurrently(call, questions, args.concurrency)
+
+
+SCENARIOS = {
+    "load": scenario_load,
+    "ingest": scenario_ingest,
+    "embed": scenario_embed,
+    "search": scenario_search,
+    "ask": scenario_ask,
+}
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def _install_llm(args: argparse.Namespace) -> None:
+    """把问答接口使用的 LLM 网关指向假 LLM"""
+    import httpx
+    from app.services.llm_gateway import LLMGateway, set_llm_gateway
+    from benchmarks.fake_llm import create_app
+
+    if args.llm_url:
+        set_llm_gateway(LLMGateway(base_url=args.llm_url, api_key="benchmark"))
+        return
+    fake_llm = create_app(args.llm_latency_ms, args.llm_tokens, args.llm_token_interval_ms, args.llm_error_rate)
+    set_llm_gateway(LLMGateway(
+        base_url="http://fake-llm/v1",
+        api_key="benchmark",
+        http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=fake_llm), base_url="http://fake-llm")
+    ))
+
+
+async def wait_until_ready(client, timeout: float = 120) -> None:
+    """依赖在应用启动后于后台初始化，等待 /readyz 返回 200 再开始测量"""
+    deadline = time.monotonic() + timeout
+    while True:
+        response = await client.get("/readyz")
+        if response.status_code == 200:
+            return
+        if time.monotonic() > deadline:
+            raise SystemExit(f"应用在 {timeout} 秒内未就绪: {response.text}")
+        await asyncio.sleep(0.1)
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    import httpx
+    import main
+    from app.config.db import async_mongo_client
+
+    if args.embedder == "fake":
+        from benchmarks.stand_ins import HashingEmbeddingModel, install_fake_embedder
+        install_fake_embedder(HashingEmbeddingModel(args.fake_embed_dim, args.fake_embed_batch_ms,
+                                                    args.fake_embed_text_ms))
+    _install_llm(args)
+
+    if args.mongo_uri:
+        if args.reset:
+            await async_mongo_client.drop_database("notes")
+        elif await async_mongo_client.notes.notes.estimated_document_count():
+            raise SystemExit("notes 数据库不为空；请使用专用的 MongoDB 实例或加上 --reset")
+
+    report: Dict[str, Any] = {"scenarios": {}}
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            await wait_until_ready(client)
+            for name in args.scenarios:
+                print(f"运行场景: {name}", file=sys.stderr)
+                before = stage_snapshot()
+                result = await SCENARIOS[name](client, args)
+                result["stages"] = stage_delta(before, stage_snapshot())
+                report["scenarios"][name] = result
+                print(json.dumps({name: {k: v for k, v in result.items() if k != "stages"}}, ensure_ascii=False),
+                      file=sys.stderr)
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"未知场景: {', '.join(unknown)}")
+    args.languages = [language.strip() for language in args.languages.split(",") if language.strip()]
+
+    sys.path.insert(0, ROOT)
+    configure_environment(args)
+    started_at = datetime.now(timezone.utc)
+    report = asyncio.run(run(args))
+
+    report["meta"] = {
+        "timestamp": started_at.isoformat(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "args": {key: value for key, value in vars(args).items()},
+    }
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", f"{started_at:%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+基准测试使用的本地替身：内存 MongoDB 与基于哈希的假嵌入模型
+
+必须在导入 app 之前调用 install_mongo_mock()。
+"""
+import hashlib
+import re
+import time
+from typing import List, Sequence
+
+import numpy as np
+
+
+def install_mongo_mock() -> None:
+    """
+    用 mongomock 替换 pymongo/motor 客户端（需要 pip install mongomock mongomock-motor）
+
+    同步与异步客户端共用同一个内存存储，与真实部署中两者连接同一个数据库一致。
+    """
+    try:
+        import mongomock
+        import mongomock_motor
+    except ImportError as e:
+        raise SystemExit("--mongo mock 需要安装 mongomock 和 mongomock-motor，或通过 --mongo-uri 使用本地 MongoDB") from e
+    import motor.motor_asyncio
+    import pymongo
+    import pymongo.mongo_client
+
+    store = mongomock.MongoClient()
+
+    def sync_client(*args, **kwargs):
+        return store
+
+    def async_client(*args, **kwargs):
+        return mongomock_motor.AsyncMongoMockClient(mock_mongo_client=store)
+
+    pymongo.MongoClient = sync_client
+    pymongo.mongo_client.MongoClient = sync_client
+    motor.motor_asyncio.AsyncIOMotorClient = async_client
+
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class HashingEmbeddingModel:
+    """
+    确定性的假嵌入模型：把词和 CJK 字的哈希累加到固定维度的向量上
+
+    共享词项的文本得到相近的向量，检索结果有意义；编码耗时可配置，用于在没有
+    模型权重的环境里衡量嵌入之外的开销（批处理、索引、检索、HTTP）。
+    """
+
+    def __init__(self, dim: int = 384, latency_ms_per_batch: float = 0.0, latency_ms_per_text: float = 0.0):
+        """
+        Args:
+            dim: 向量维度
+            latency_ms_per_batch: 每次 encode 调用的固定耗时（毫秒）
+            latency_ms_per_text: 每条文本额外的耗时（毫秒）
+        """
+        self.dim = dim
+        self.latency_ms_per_batch = latency_ms_per_batch
+        self.latency_ms_per_text = latency_ms_per_text
+
+    def _features(self, text: str) -> List[str]:
+        features = []
+        for token in _TOKEN_RE.findall(text.lower()):
+            if token.isascii():
+                features.append(token)
+            else:
+                features.extend(token)
+        return features
+
+    def encode(self, texts: Sequence[str], **kwargs) -> np.ndarray:
+        started = time.perf_counter()
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                value = int.from_bytes(digest, "little")
+                vectors[row, value % self.dim] += 1.0 if value >> 63 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms > 0, norms, 1.0)
+        # 模拟模型推理耗时（time.sleep 会释放 GIL，与真实推理一样可与其它线程并行）
+        remaining = (self.latency_ms_per_batch + self.latency_ms_per_text * len(texts)) / 1000
+        remaining -= time.perf_counter() - started
+        if remaining > 0:
+            time.sleep(remaining)
+        return vectors
+
+
+def install_fake_embedder(model: HashingEmbeddingModel) -> None:
+    """把假嵌入模型放入共享模型缓存，所有使用默认模型的代码都会拿到它"""
+    from app.config import embedding_model
+
+    key = (embedding_model.DEFAULT_MODEL_NAME, embedding_model.DEFAULT_DEVICE, embedding_model.DEFAULT_BACKEND)
+    embedding_model._models[key] = model
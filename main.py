@@ -1,22 +1,88 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Response
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse
 from dotenv import load_dotenv
-from app.routes.note import router as note_router
+from app.config.logging_config import setup_logging
+import asyncio
+import logging
 import os
+import time
 
+# 先加载 .env 并配置日志，后面导入的模块在导入时就会读取环境变量和输出日志
 load_dotenv()
+setup_logging()
+
+# 这里的导入只定义路由和配置，不连接外部服务也不加载模型；连接与预热在 lifespan 中于后台完成
+from app.routes.note import router as note_router
+from app.services.index_outbox import stop_index_workers
+from app.services.reconciler import stop_reconciler
+from app.services.keyword_index import stop_keyword_sync
+from app.services.llm_gateway import close_llm_gateway
+from app.services.metrics import CONTENT_TYPE_LATEST, HTTP_REQUEST_DURATION, render_metrics
+from app.services.readiness import check_readiness, initialize_dependencies
+
+logger = logging.getLogger(__name__)
+
+# 启动时在后台初始化依赖（MongoDB 索引与后台任务、向量库连接、嵌入模型预热），
+# 应用立即开始接受请求，依赖是否可用通过 /readyz 报告；关闭时停止后台任务并释放连接
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    initialization = asyncio.create_task(initialize_dependencies())
+    try:
+        yield
+    finally:
+        initialization.cancel()
+        await asyncio.gather(initialization, return_exceptions=True)
+        await stop_reconciler()
+        await stop_keyword_sync()
+        await stop_index_workers()
+        await close_llm_gateway()
 
-app = FastAPI(title="LMNOTES")
+app = FastAPI(title="LMNOTES", lifespan=lifespan)
 
 app.include_router(note_router, prefix='/api/v1/notes')
 
+# 按路由模板（而不是实际路径）统计请求耗时，避免笔记 ID 造成标签数量膨胀
+@app.middleware("http")
+async def record_request_duration(request: Request, call_next):
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        HTTP_REQUEST_DURATION.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=status_code
+        )
+
+# Prometheus 抓取端点
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+# 存活探针：进程能响应即可，不检查外部依赖
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    return {"status": "ok"}
+
+# 就绪探针：依赖初始化完成且 MongoDB、向量库当前可用时返回 200，否则返回 503
+@app.get("/readyz", include_in_schema=False)
+async def readyz():
+    readiness = await check_readiness()
+    return JSONResponse(readiness, status_code=200 if readiness["ready"] else 503)
+
 # 挂载 static 目录，用于提供 CSS, JS 等文件
 # 确保 'static' 文件夹在项目根目录下
 static_dir = os.path.join(os.path.dirname(__file__), "static")
 if not os.path.exists(static_dir):
     os.makedirs(static_dir)
-    print(f"Created static directory at: {static_dir}")
+    logger.info(f"Created static directory at: {static_dir}")
 
 app.mount("/static", StaticFiles(directory=static_dir), name="static")
 
@@ -1,11 +1,15 @@
 // LMNOTES Vue应用入口文件
 const API_BASE_URL = '/api/v1/notes';
+// 分页获取笔记列表时每页的数量
+const NOTES_PAGE_SIZE = 500;
 
 const app = Vue.createApp({
   data() {
     return {
       // 当前载入的笔记列表
       notes: [],
+      // 增量同步游标（服务器返回），用于只获取之后变化的笔记
+      syncCursor: null,
       // 当前选中的笔记
       currentNote: {
         id: null,
@@ -54,18 +58,31 @@ const app = Vue.createApp({
     };
   },
   methods: {
-    // 获取所有笔记
+    // 获取所有笔记（按页获取，每页最多 NOTES_PAGE_SIZE 条）
     async fetchNotes() {
       this.loading.notes = true;
       try {
-        const response = await fetch(`${API_BASE_URL}/`);
-        if (!response.ok) {
-          throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        this.notes = await response.json();
+        const notes = [];
+        let after = null;
+        let syncCursor = null;
+        do {
+          const params = new URLSearchParams({ limit: NOTES_PAGE_SIZE });
+          if (after) {
+            params.set('after', after);
+          }
+          const response = await fetch(`${API_BASE_URL}/?${params}`);
+          if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+          }
+          // 以第一页的同步游标为准，翻页期间发生的变化会在下次同步时获取
+          syncCursor = syncCursor || response.headers.get('X-Sync-Cursor');
+          after = response.headers.get('X-Next-Cursor');
+          notes.push(...await response.json());
+        } while (after);
         // 翻转数组，使最新的笔记显示在顶部
-        this.notes.reverse();
-        console.log('Notes loaded successfully:', this.notes);
+        this.notes = notes.reverse();
+        this.syncCursor = syncCursor;
+        console.log('Notes loaded successfully:', this.notes.length);
       } catch (error) {
         console.error('获取笔记失败:', error);
       } finally {
@@ -73,6 +90,39 @@ const app = Vue.createApp({
       }
     },
     
+    // 只获取上次同步之后变化的笔记并合并到列表中
+    async syncNotes() {
+      if (!this.syncCursor) {
+        await this.fetchNotes();
+        return;
+      }
+      try {
+        const response = await fetch(`${API_BASE_URL}/changes/?since=${encodeURIComponent(this.syncCursor)}`);
+        if (!response.ok) {
+          throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const changes = await response.json();
+        const deleted = new Set(changes.deleted);
+        const notes = this.notes.filter(note => !deleted.has(note.id));
+        for (const changed of changes.notes) {
+          if (deleted.has(changed.id)) {
+            continue;
+          }
+          const index = notes.findIndex(note => note.id === changed.id);
+          if (index >= 0) {
+            notes.splice(index, 1, changed);
+          } else {
+            notes.unshift(changed);
+          }
+        }
+        this.notes = notes;
+        this.syncCursor = changes.cursor;
+      } catch (error) {
+        console.error('同步笔记失败，重新加载全部笔记:', error);
+        await this.fetchNotes();
+      }
+    },
+    
     // 切换主题
     toggleTheme() {
       this.isDarkTheme = !this.isDarkTheme;
@@ -171,7 +221,7 @@ const app = Vue.createApp({
         
         console.log('笔记保存成功');
         this.clearForm();
-        await this.fetchNotes();
+        await this.syncNotes();
         
       } catch (error) {
         console.error('保存笔记失败:', error);
@@ -210,7 +260,7 @@ const app = Vue.createApp({
         
         console.log('笔记删除成功');
         this.clearForm();
-        await this.fetchNotes();
+        await this.syncNotes();
         
       } catch (error) {
         console.error('删除笔记失败:', error);
@@ -289,7 +339,8 @@ const app = Vue.createApp({
       this.qa.sources = [];
       
       try {
-        const response = await fetch(`${API_BASE_URL}/ask/`, {
+        // 使用流式接口：先收到来源笔记，再逐段收到答案
+        const response = await fetch(`${API_BASE_URL}/ask/stream/`, {
           method: 'POST',
           headers: {
             'Content-Type': 'application/json',
@@ -302,11 +353,30 @@ const app = Vue.createApp({
           throw new Error(`HTTP error! status: ${response.status}, message: ${errorData.detail || 'Unknown error'}`);
         }
         
-        const result = await response.json();
-        console.log('问答结果:', result);
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        
+        while (true) {
+          const { value, done } = await reader.read();
+          if (done) break;
+          
+          buffer += decoder.decode(value, { stream: true });
+          const lines = buffer.split('\n');
+          // 最后一段可能是不完整的行，留到下一次处理
+          buffer = lines.pop();
+          
+          for (const line of lines) {
+            if (line.trim()) {
+              this.handleAskStreamEvent(JSON.parse(line));
+            }
+          }
+        }
         
-        this.qa.answer = result.answer;
-        this.qa.sources = result.sources || [];
+        if (buffer.trim()) {
+          this.handleAskStreamEvent(JSON.parse(buffer));
+        }
+        console.log('问答完成');
         
       } catch (error) {
         console.error('问答失败:', error);
@@ -316,6 +386,17 @@ const app = Vue.createApp({
       }
     },
     
+    // 处理流式问答返回的单个事件
+    handleAskStreamEvent(event) {
+      if (event.type === 'sources') {
+        this.qa.sources = event.sources || [];
+      } else if (event.type === 'token') {
+        this.qa.answer += event.content;
+      } else if (event.type === 'error') {
+        this.qa.answer += event.message;
+      }
+    },
+    
     // 选择问答来源笔记
     selectQASource(source) {
       this.selectNote({
@@ -573,8 +654,8 @@ const app = Vue.createApp({
         // 关闭模态框
         this.importModal.hide();
         
-        // 重新加载笔记列表
-        this.fetchNotes();
+        // 同步笔记列表
+        this.syncNotes();
         
         // 显示成功提示
         alert('文件成功导入为笔记!');